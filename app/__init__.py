@@ -1,10 +1,17 @@
-from flask import Flask
-from app.scheduler.scheduler import init_scheduler
-from app.routes.message_routes import message_blueprint
-from app.routes.template_routes import template_blueprint
-from app.config import Config
-
 def create_app():
+    # Flask, the scheduler and the routes are imported here rather than with
+    # the package, so tools that only use app.services or app.utils (and
+    # app.dispatcher's argument parsing) don't pay for them
+    from flask import Flask
+    from app.scheduler.scheduler import init_scheduler
+    from app.routes.message_routes import message_blueprint
+    from app.routes.template_routes import template_blueprint
+    from app.routes.metrics_routes import metrics_blueprint
+    from app.routes.broadcast_routes import broadcast_blueprint
+    from app.routes.credential_routes import credential_blueprint
+    from app.config import Config
+    from app.utils.profiling import init_request_timing
+
     app = Flask(__name__)
     
     # Load configuration
@@ -13,8 +20,15 @@ def create_app():
     # Initialize scheduler
     init_scheduler(app)
     
+    # Per-phase timings, with REQUEST_TIMING on; hooks have to be added
+    # before the blueprints are registered
+    init_request_timing(app, message_blueprint, template_blueprint)
+
     # Register blueprints
     app.register_blueprint(message_blueprint)
     app.register_blueprint(template_blueprint)
+    app.register_blueprint(metrics_blueprint)
+    app.register_blueprint(broadcast_blueprint)
+    app.register_blueprint(credential_blueprint)
     
     return app
@@ -1,19 +1,163 @@
-import pytz
-from apscheduler.jobstores.memory import MemoryJobStore
+import json
+import os
+
+# Executor each dispatch mode sends on; normal priority messages use it
+DISPATCH_EXECUTORS = {'threadpool': 'default', 'asyncio': 'asyncio', 'batch': 'batch'}
+
+
+def lane_executors(executors, mode, budgets):
+    # One copy of the dispatch mode's executor per extra priority lane, with
+    # the lane's own worker (or, for asyncio, concurrency) budget
+    base = executors[DISPATCH_EXECUTORS[mode]]
+    lanes = {}
+    for lane, budget in budgets.items():
+        executor = dict(base)
+        executor['max_concurrency' if 'max_concurrency' in base else 'max_workers'] = budget
+        lanes[lane] = executor
+    return lanes
+
 
 class Config:
     SCHEDULER_API_ENABLED = True
+    # Jobs are persisted in a local SQLite file so pending messages survive
+    # restarts; SCHEDULER_JOBSTORE=memory keeps them in process memory only
+    SCHEDULER_JOBSTORE = os.environ.get('SCHEDULER_JOBSTORE', 'sqlite')
+    SCHEDULER_DB_PATH = os.environ.get('SCHEDULER_DB_PATH', 'data/scheduler.db')
+    # "all" runs API and dispatch in one process. For multiple processes, API
+    # workers use "api" (they only add jobs) and each of SCHEDULER_SHARDS
+    # dispatchers (python -m app.dispatcher --shard i --shards N) runs the
+    # jobs of its shard, hashed by SCHEDULER_SHARD_BY (phone_number_id|job_id)
+    SCHEDULER_ROLE = os.environ.get('SCHEDULER_ROLE', 'all')
+    SCHEDULER_SHARDS = int(os.environ.get('SCHEDULER_SHARDS', 1))
+    # "eager" starts the scheduler with the app; "lazy" waits for the first
+    # request to the message or broadcast routes, so API workers that never
+    # schedule (or short-lived CLI processes) don't start it at all
+    SCHEDULER_START = os.environ.get(
+        'SCHEDULER_START', 'lazy' if SCHEDULER_ROLE == 'api' else 'eager'
+    )
+    SCHEDULER_SHARD_BY = os.environ.get('SCHEDULER_SHARD_BY', 'phone_number_id')
+    # How often dispatchers look for jobs added by other processes, and API
+    # workers reload the job index
+    SCHEDULER_POLL_SECONDS = float(os.environ.get('SCHEDULER_POLL_SECONDS', 1))
+    SCHEDULER_INDEX_REFRESH_SECONDS = float(os.environ.get('SCHEDULER_INDEX_REFRESH_SECONDS', 30))
     SCHEDULER_JOBSTORES = {
-        'default': MemoryJobStore()
+        'default': (
+            {'type': 'memory'}
+            if SCHEDULER_JOBSTORE == 'memory'
+            else {
+                'class': 'app.scheduler.jobstores:SQLiteJobStore',
+                'path': SCHEDULER_DB_PATH,
+                'shard_by': SCHEDULER_SHARD_BY,
+            }
+        )
     }
+    # "threadpool" runs each send on a worker thread, "asyncio" awaits sends
+    # on an event loop so thousands can be in flight at once, "batch" groups
+    # jobs due in the same time bucket and sends them in batches
+    SCHEDULER_DISPATCH_MODE = os.environ.get('SCHEDULER_DISPATCH_MODE', 'threadpool')
+    ASYNC_DISPATCH_CONCURRENCY = int(os.environ.get('ASYNC_DISPATCH_CONCURRENCY', 1000))
+    BATCH_DISPATCH_BUCKET_MS = int(os.environ.get('BATCH_DISPATCH_BUCKET_MS', 100))
+    BATCH_DISPATCH_SIZE = int(os.environ.get('BATCH_DISPATCH_SIZE', 100))
+    BATCH_DISPATCH_WORKERS = int(os.environ.get('BATCH_DISPATCH_WORKERS', 20))
     SCHEDULER_EXECUTORS = {
-        'default': {'type': 'threadpool', 'max_workers': 20}
+        'default': {'type': 'threadpool', 'max_workers': 20},
+        'asyncio': {
+            'class': 'app.scheduler.executors:AsyncioDispatchExecutor',
+            'max_concurrency': ASYNC_DISPATCH_CONCURRENCY,
+        },
+        'batch': {
+            'class': 'app.scheduler.executors:BatchDispatchExecutor',
+            'bucket_ms': BATCH_DISPATCH_BUCKET_MS,
+            'batch_size': BATCH_DISPATCH_SIZE,
+            'max_workers': BATCH_DISPATCH_WORKERS,
+        },
+    }
+    # Priority lanes. Transactional and bulk messages run on executors of
+    # their own, so a bulk burst can't hold the workers an OTP needs; normal
+    # ones use the dispatch mode's executor above.
+    PRIORITY_LANES = ('transactional', 'normal', 'bulk')
+    DEFAULT_PRIORITY = 'normal'
+    TRANSACTIONAL_WORKERS = int(os.environ.get('TRANSACTIONAL_WORKERS', 10))
+    BULK_WORKERS = int(os.environ.get('BULK_WORKERS', 10))
+    SCHEDULER_EXECUTORS.update(
+        lane_executors(
+            SCHEDULER_EXECUTORS,
+            SCHEDULER_DISPATCH_MODE,
+            {'transactional': TRANSACTIONAL_WORKERS, 'bulk': BULK_WORKERS},
+        )
+    )
+    # Runs a lane may have due but unfinished before the schedule API
+    # answers 429 for that lane
+    LANE_MAX_BACKLOG = {
+        'transactional': int(os.environ.get('TRANSACTIONAL_MAX_BACKLOG', 1000)),
+        'normal': int(os.environ.get('NORMAL_MAX_BACKLOG', 20000)),
+        'bulk': int(os.environ.get('BULK_MAX_BACKLOG', 100000)),
     }
+    # API workers have no executors to look at; they count a lane's jobs in
+    # the shared store due within this many seconds, at most once per
+    # refresh interval
+    ADMISSION_WINDOW_SECONDS = float(os.environ.get('ADMISSION_WINDOW_SECONDS', 60))
+    ADMISSION_REFRESH_SECONDS = float(os.environ.get('ADMISSION_REFRESH_SECONDS', 1))
     SCHEDULER_JOB_DEFAULTS = {
         'coalesce': False,
         'max_instances': 3
     }
     WHATSAPP_API_VERSION = "v17.0"
-    WHATSAPP_API_URL = "https://graph.facebook.com"
+    # Point at benchmarks/fake_graph_api.py for local load tests
+    WHATSAPP_API_URL = os.environ.get('WHATSAPP_API_URL', "https://graph.facebook.com")
+    # Sends per second allowed for each business phone number, with optional
+    # per phone_number_id overrides, e.g. {"1234": {"rate": 250, "burst": 250}}
+    WHATSAPP_RATE_LIMIT = float(os.environ.get('WHATSAPP_RATE_LIMIT', 80))
+    WHATSAPP_RATE_BURST = float(os.environ.get('WHATSAPP_RATE_BURST', 80))
+    WHATSAPP_RATE_LIMITS = json.loads(os.environ.get('WHATSAPP_RATE_LIMITS', '{}'))
+    # Threads sending what waits in the rate limiter's per-sender queues:
+    # broadcast recipients and rate-limited occurrences of recurring messages
+    SEND_QUEUE_WORKERS = int(os.environ.get('SEND_QUEUE_WORKERS', 20))
+    # Per phone_number_id circuit breaker: opens when CIRCUIT_FAILURE_RATIO of
+    # the last CIRCUIT_WINDOW requests failed, after which sends fail fast and
+    # their jobs are pushed back instead of retrying into a failing API
+    CIRCUIT_WINDOW = int(os.environ.get('CIRCUIT_WINDOW', 50))
+    CIRCUIT_MIN_CALLS = int(os.environ.get('CIRCUIT_MIN_CALLS', 20))
+    CIRCUIT_FAILURE_RATIO = float(os.environ.get('CIRCUIT_FAILURE_RATIO', 0.5))
+    CIRCUIT_OPEN_SECONDS = float(os.environ.get('CIRCUIT_OPEN_SECONDS', 15))
+    CIRCUIT_MAX_OPEN_SECONDS = float(os.environ.get('CIRCUIT_MAX_OPEN_SECONDS', 300))
+    # Jobs are deferred until this long after their scheduled time, then fail
+    CIRCUIT_MAX_DEFER_SECONDS = float(os.environ.get('CIRCUIT_MAX_DEFER_SECONDS', 3600))
+    # Up to SEND_MAX_RETRIES retries per send while the endpoint's retry
+    # budget lasts: each failure spends a token, each success earns back
+    # RETRY_BUDGET_RATIO of one
+    SEND_MAX_RETRIES = int(os.environ.get('SEND_MAX_RETRIES', 3))
+    RETRY_BUDGET_TOKENS = float(os.environ.get('RETRY_BUDGET_TOKENS', 10))
+    RETRY_BUDGET_RATIO = float(os.environ.get('RETRY_BUDGET_RATIO', 0.1))
     DEFAULT_TIMEZONE = 'Africa/Dar_es_Salaam'
-    ALLOWED_TIMEZONES = pytz.all_timezones
\ No newline at end of file
+    # None allows every zone pytz knows; listed on first use, so importing
+    # the config doesn't load pytz
+    ALLOWED_TIMEZONES = None
+    BULK_SCHEDULE_BATCH_SIZE = 1000
+    # Broadcasts and their recipient lists live in their own SQLite file
+    BROADCAST_DB_PATH = os.environ.get('BROADCAST_DB_PATH', 'data/broadcasts.db')
+    # History of job runs (message id, status, latency, attempts), written in
+    # batches and kept for OUTCOME_RETENTION_DAYS
+    OUTCOME_DB_PATH = os.environ.get('OUTCOME_DB_PATH', 'data/outcomes.db')
+    # One access token per phone_number_id, shared by all of its jobs
+    CREDENTIALS_DB_PATH = os.environ.get('CREDENTIALS_DB_PATH', 'data/credentials.db')
+    # Check a new credential against the WhatsApp API before storing it
+    VERIFY_CREDENTIALS = os.environ.get('VERIFY_CREDENTIALS', 'true').lower() in ('1', 'true', 'yes')
+    OUTCOME_RETENTION_DAYS = float(os.environ.get('OUTCOME_RETENTION_DAYS', 90))
+    OUTCOME_FLUSH_SECONDS = float(os.environ.get('OUTCOME_FLUSH_SECONDS', 1))
+    OUTCOME_BATCH_SIZE = int(os.environ.get('OUTCOME_BATCH_SIZE', 500))
+    TEMPLATE_CACHE_TTL = float(os.environ.get('TEMPLATE_CACHE_TTL', 60))
+    TEMPLATE_CACHE_SIZE = int(os.environ.get('TEMPLATE_CACHE_SIZE', 256))
+    LOG_DIR = os.environ.get('LOG_DIR', 'logs')
+    # Per-phase timings for the message and template routes, returned in a
+    # Server-Timing header and summarised at /timings. Off, the routes carry
+    # no timing hooks at all.
+    REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '').lower() in ('1', 'true', 'yes')
+    # Where POST /profiler/start writes its stack samples, and its defaults
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'data/profiles')
+    PROFILE_SECONDS = float(os.environ.get('PROFILE_SECONDS', 30))
+    PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 600))
+    PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 10))
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    # Comma separated module=LEVEL overrides, e.g. "routes=DEBUG,services=WARNING"
+    LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
@@ -0,0 +1,50 @@
+import argparse
+import signal
+import threading
+from app.config import Config
+from app.scheduler.sharding import acquire_shard
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def main(argv=None):
+    # Runs the scheduled jobs of one shard of the shared job store, e.g.
+    #   python -m app.dispatcher --shard 0 --shards 4
+    # next to API workers started with SCHEDULER_ROLE=api
+    parser = argparse.ArgumentParser(description="Dispatch the scheduled messages of one shard")
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--shards", type=int, default=Config.SCHEDULER_SHARDS)
+    args = parser.parse_args(argv)
+
+    if Config.SCHEDULER_JOBSTORE == "memory":
+        parser.error("dispatchers need the shared sqlite job store")
+    try:
+        shard_lock = acquire_shard(Config.SCHEDULER_DB_PATH, args.shard, args.shards)
+    except (RuntimeError, ValueError) as e:
+        parser.error(str(e))
+
+    Config.SCHEDULER_ROLE = "dispatcher"
+    Config.SCHEDULER_START = "eager"
+    Config.SCHEDULER_SHARDS = args.shards
+    Config.SCHEDULER_JOBSTORES["default"].update(shard=args.shard, shards=args.shards)
+
+    from app import create_app
+    from app.scheduler.scheduler import scheduler
+
+    create_app()
+    logger.info("Dispatcher for shard %s of %s running", args.shard, args.shards)
+
+    stopped = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopped.set())
+    while not stopped.wait(1):
+        pass
+
+    logger.info("Dispatcher for shard %s shutting down", args.shard)
+    scheduler.shutdown()
+    shard_lock.close()
+
+
+if __name__ == "__main__":
+    main()
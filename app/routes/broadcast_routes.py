@@ -0,0 +1,133 @@
+import csv
+import time
+from datetime import datetime
+from flask import Blueprint, request, jsonify
+from app.routes.message_routes import NDJSON_MIMETYPES
+from app.scheduler.jobs import BROADCAST_JOB_PREFIX, broadcast_job_def
+from app.scheduler.scheduler import scheduler, start_scheduler
+from app.services.broadcasts import (
+    BroadcastClosedError,
+    broadcast_store,
+    iter_csv_recipients,
+    iter_ndjson_recipients,
+)
+from app.services.credentials import token_vault
+from app.utils.ids import new_id
+from app.utils.logger import setup_logger
+from app.utils.validators import ValidationError, resolve_timezone, validate_broadcast
+
+logger = setup_logger(__name__)
+broadcast_blueprint = Blueprint("broadcasts", __name__)
+broadcast_blueprint.before_request(start_scheduler)
+
+
+def _broadcast_details(broadcast, timezone, tz):
+    return {
+        "broadcast_id": broadcast["id"],
+        "job_id": f"{BROADCAST_JOB_PREFIX}{broadcast['id']}",
+        "status": broadcast["status"],
+        "phone_number_id": broadcast["phone_number_id"],
+        "scheduled_time": datetime.fromtimestamp(broadcast["run_ts"], tz).isoformat(),
+        "created_at": datetime.fromtimestamp(broadcast["created_ts"], tz).isoformat(),
+        "recipients": broadcast["recipients"],
+        "sent": broadcast["sent"],
+        "failed": broadcast["failed"],
+        "timezone": timezone,
+    }
+
+
+@broadcast_blueprint.route("/broadcasts", methods=["POST"])
+def create_broadcast():
+    # Step one of a broadcast: the message every recipient gets, scheduled
+    # as a single job. Recipients are uploaded to it afterwards.
+    try:
+        logger.info("Received broadcast request")
+        data = request.get_json()
+
+        try:
+            run_date = validate_broadcast(data)
+        except ValidationError as e:
+            return jsonify({"error": str(e), "errors": e.errors}), 400
+
+        broadcast_id = new_id()
+        message_data = data["message_data"]
+        broadcast_store.create(
+            broadcast_id,
+            run_date.timestamp(),
+            data["phone_number_id"],
+            token_vault.reference(data["phone_number_id"], data["auth_token"]),
+            message_data,
+        )
+
+        scheduler.add_job(**broadcast_job_def(
+            broadcast_id,
+            run_date,
+            data["phone_number_id"],
+            message_data.get("type", "Unknown"),
+            campaign=str(data["campaign"]) if data.get("campaign") is not None else None,
+            priority=data.get("priority"),
+        ))
+
+        timezone, tz = resolve_timezone(data.get("timezone"))
+        logger.info("Broadcast %s scheduled for %s", broadcast_id, run_date)
+        return jsonify({
+            "message": "Broadcast scheduled",
+            **_broadcast_details(broadcast_store.get(broadcast_id), timezone, tz),
+            "upload_url": f"/broadcasts/{broadcast_id}/recipients",
+        }), 201
+
+    except Exception as e:
+        logger.error("Error scheduling broadcast: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@broadcast_blueprint.route("/broadcasts/<broadcast_id>/recipients", methods=["POST"])
+def upload_recipients(broadcast_id):
+    # Streamed CSV (default) or NDJSON recipient list. Can be called more
+    # than once until the broadcast starts; numbers already added are
+    # skipped as duplicates.
+    try:
+        logger.info("Receiving recipients for broadcast %s", broadcast_id)
+        column = request.args.get("column", "phone_number")
+        if request.mimetype in NDJSON_MIMETYPES:
+            values = iter_ndjson_recipients(request.stream, column)
+        else:
+            values = iter_csv_recipients(request.stream, column)
+
+        started = time.perf_counter()
+        try:
+            result = broadcast_store.add_recipients(broadcast_id, values)
+        except LookupError:
+            return jsonify({"error": "Broadcast not found"}), 404
+        except BroadcastClosedError as e:
+            return jsonify({"error": str(e)}), 409
+        except (ValueError, csv.Error) as e:
+            # Nothing from a rejected upload is kept
+            return jsonify({"error": f"Invalid recipient list: {str(e)}"}), 400
+        elapsed = time.perf_counter() - started
+
+        result["recipients"] = broadcast_store.get(broadcast_id)["recipients"]
+        result["seconds"] = round(elapsed, 3)
+        logger.info(
+            "Added %s recipients to broadcast %s (%s duplicates, %s invalid) in %.2fs",
+            result["added"], broadcast_id, result["duplicates"], result["invalid"], elapsed,
+        )
+        return jsonify({"broadcast_id": broadcast_id, **result}), 200
+
+    except Exception as e:
+        logger.error("Error uploading broadcast recipients: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@broadcast_blueprint.route("/broadcasts/<broadcast_id>", methods=["GET"])
+def get_broadcast(broadcast_id):
+    try:
+        timezone, tz = resolve_timezone(request.args.get("timezone"))
+        broadcast = broadcast_store.get(broadcast_id)
+        if broadcast is None:
+            return jsonify({"error": "Broadcast not found"}), 404
+        return jsonify(_broadcast_details(broadcast, timezone, tz)), 200
+
+    except Exception as e:
+        logger.error("Error fetching broadcast: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
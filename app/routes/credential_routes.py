@@ -0,0 +1,110 @@
+from datetime import datetime
+from flask import Blueprint, request, jsonify
+from app.config import Config
+from app.services.credentials import CredentialChangedError, token_fingerprint, token_vault
+from app.services.whatsapp_service import verify_token
+from app.utils.logger import setup_logger
+from app.utils.validators import ValidationError, resolve_timezone, validate_credential
+
+logger = setup_logger(__name__)
+credential_blueprint = Blueprint("credentials", __name__)
+
+
+def _credential_details(credential, timezone, tz):
+    # Tokens are only ever shown by fingerprint
+    return {
+        "phone_number_id": credential["phone_number_id"],
+        "fingerprint": credential["fingerprint"],
+        "updated_at": datetime.fromtimestamp(credential["updated_ts"], tz).isoformat(),
+        "timezone": timezone,
+    }
+
+
+def _authorized(phone_number_id):
+    # Changing or removing a registered credential takes that credential,
+    # sent as "Authorization: Bearer <token>"
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and token_vault.matches(phone_number_id, token.strip())
+
+
+def _unauthorized():
+    return (
+        jsonify({"error": "Send the current credential as 'Authorization: Bearer <token>'"}),
+        401,
+        {"WWW-Authenticate": "Bearer"},
+    )
+
+
+@credential_blueprint.route("/credentials", methods=["GET"])
+def list_credentials():
+    try:
+        timezone, tz = resolve_timezone(request.args.get("timezone"))
+        credentials = [
+            _credential_details(credential, timezone, tz) for credential in token_vault.list()
+        ]
+        return jsonify({"credentials": credentials, "count": len(credentials)}), 200
+    except Exception as e:
+        logger.error("Error listing credentials: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@credential_blueprint.route("/credentials/<phone_number_id>", methods=["PUT"])
+def rotate_credential(phone_number_id):
+    # Every pending job of this phone number that uses its registered
+    # credential sends with the new token from now on. Replacing a
+    # credential takes the current one; either way the new token must be
+    # accepted by the API first.
+    try:
+        logger.info("Rotating credential for %s", phone_number_id)
+        try:
+            auth_token = validate_credential(request.get_json(silent=True))
+        except ValidationError as e:
+            return jsonify({"error": str(e), "errors": e.errors}), 400
+
+        current = token_vault.get(phone_number_id)
+        if current is not None and not _authorized(phone_number_id):
+            return _unauthorized()
+
+        if Config.VERIFY_CREDENTIALS:
+            valid = verify_token(phone_number_id, auth_token)
+            if valid is None:
+                return jsonify({"error": "Couldn't reach the WhatsApp API to verify the token"}), 502
+            if not valid:
+                return jsonify(
+                    {"error": "The WhatsApp API rejected the token for this phone number"}
+                ), 400
+
+        try:
+            previous = token_vault.rotate(phone_number_id, auth_token, current)
+        except CredentialChangedError:
+            return jsonify({"error": "Credential changed during the request; try again"}), 409
+        return jsonify({
+            "message": "Credential rotated" if previous else "Credential registered",
+            "phone_number_id": phone_number_id,
+            "fingerprint": token_fingerprint(auth_token),
+            "previous_fingerprint": previous,
+        }), 200
+
+    except Exception as e:
+        logger.error("Error rotating credential: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@credential_blueprint.route("/credentials/<phone_number_id>", methods=["DELETE"])
+def delete_credential(phone_number_id):
+    # Pending jobs that relied on it fail when they run, until a new one is
+    # registered. Takes the credential being removed.
+    try:
+        current = token_vault.get(phone_number_id)
+        if current is None:
+            return jsonify({"error": "Credential not found"}), 404
+        if not _authorized(phone_number_id):
+            return _unauthorized()
+        if not token_vault.remove(phone_number_id, current):
+            return jsonify({"error": "Credential changed during the request; try again"}), 409
+        logger.info("Removed credential for %s", phone_number_id)
+        return jsonify({"message": "Credential removed", "phone_number_id": phone_number_id}), 200
+
+    except Exception as e:
+        logger.error("Error removing credential: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
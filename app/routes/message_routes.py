@@ -1,253 +1,837 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from datetime import datetime, timedelta
+import codecs
+import json
+import math
+import time
 import pytz
+from apscheduler.jobstores.base import ConflictingIdError, JobLookupError
+from apscheduler.triggers.date import DateTrigger
 from app.config import Config
-from app.scheduler.scheduler import scheduler
-from app.services.whatsapp_service import send_whatsapp_message
-from app.utils.validators import validate_request_data
+from app.scheduler.job_index import INDEXED_FIELDS, decode_cursor, job_index
+from app.scheduler.jobs import cancel_broadcasts, dispatch_options
+from app.scheduler.metadata import build_meta
+from app.scheduler.scheduler import (
+    add_jobs,
+    admission_rejected,
+    lane_is_full,
+    remove_jobs,
+    reschedule_jobs,
+    rescheduled_changes,
+    scheduler,
+    select_jobs,
+    start_scheduler,
+)
+from app.services.circuit_breaker import circuit_breakers
+from app.services.credentials import token_vault
+from app.services.http_client import get_pool_stats
+from app.services.message_templates import TemplateMessage
+from app.services.outcomes import outcome_store
+from app.services.rate_limiter import rate_limiter
+from app.utils.ids import idempotent_id, new_id
+from app.utils.validators import (
+    ValidationError,
+    resolve_timezone,
+    validate_message,
+    validate_reschedule,
+)
 from app.utils.logger import setup_logger
+from app.utils.metrics import dispatch_lateness
+from app.utils.profiling import phase
 
-logger = setup_logger()
+logger = setup_logger(__name__)
 message_blueprint = Blueprint("messages", __name__)
+# With SCHEDULER_START=lazy, the first request here starts the scheduler
+message_blueprint.before_request(start_scheduler)
+
+
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Upper bound for ?occurrences=N previews of recurring messages
+MAX_OCCURRENCES = 100
+# Retry-After (seconds) sent with 429s from a full priority lane
+ADMISSION_RETRY_AFTER = 5
+
+
+def _message_job_def(job_id, data, run_date):
+    recurrence = data.get("recurrence")
+    if recurrence is not None:
+        # One job for the whole schedule; its trigger computes each next run
+        trigger = {"trigger": recurrence.trigger()}
+    else:
+        trigger = {"trigger": "date", "run_date": run_date}
+    return {
+        **dispatch_options(data.get("priority")),
+        **trigger,
+        "id": job_id,
+        "name": f"WhatsApp message to {data['phone_number']}",
+        "args": [
+            data["phone_number"],
+            data["message_data"],
+            # Never the token itself: None when the phone number has a
+            # credential, else a reference to the token in the vault. The
+            # job looks the token up when it runs.
+            token_vault.reference(data["phone_number_id"], data["auth_token"]),
+            data["phone_number_id"],
+        ],
+        "kwargs": {"job_id": job_id, "meta": build_meta(job_id, run_date, data)},
+        "misfire_grace_time": 3600,  # Allow 1 hour grace time for misfired jobs
+        "coalesce": True,  # Combine multiple waiting runs into a single one
+    }
+
+
+def _new_job_id(data, idempotency_key=None):
+    if idempotency_key:
+        return f"whatsapp_msg_{idempotent_id(data['phone_number_id'], idempotency_key)}"
+    return f"whatsapp_msg_{new_id()}"
+
+
+def _lane_full_response(priority):
+    # Backpressure: refuse new work for a lane whose dispatch backlog is
+    # already past its limit, rather than let it queue without bound
+    logger.warning("Refusing %s message: lane backlog is full", priority)
+    admission_rejected.inc(priority)
+    response = jsonify({
+        "error": f"Too many {priority} messages waiting to be sent; retry later",
+        "priority": priority,
+    })
+    response.headers["Retry-After"] = str(ADMISSION_RETRY_AFTER)
+    return response, 429
+
+
+def _schedule_response(message, job, tz, current_time):
+    run_time = job.next_run_time.astimezone(tz) if job.next_run_time else None
+    return {
+        "message": message,
+        "job_id": job.id,
+        "scheduled_time": run_time.isoformat() if run_time else None,
+        "timezone": str(tz),
+        "current_time": current_time.isoformat(),
+        "job_details": {
+            "next_run_time": job.next_run_time.isoformat() if job.next_run_time else None,
+            "pending": job.pending
+        }
+    }
 
 
 @message_blueprint.route("/schedule-message", methods=["POST"])
 def schedule_message():
     try:
         logger.info("Received schedule message request")
-        data = request.get_json()
-        logger.debug(f"Request data: {data}")
+        with phase("parse"):
+            data = request.get_json()
+        logger.debug("Request data: %s", data)
 
-        # Validate request data
-        required_fields = ["schedule_time", "phone_number", "message_data", "auth_token", "phone_number_id"]
-        missing_fields = [field for field in required_fields if field not in data]
-        if missing_fields:
-            return jsonify({"error": f"Missing required fields: {', '.join(missing_fields)}"}), 400
-
-        # Parse and validate schedule time
-        try:
-            tz = pytz.timezone(Config.DEFAULT_TIMEZONE)
+        # Validate request data and schedule time
+        with phase("validate"):
+            try:
+                schedule_time_local = validate_message(data)
+            except ValidationError as e:
+                return jsonify({"error": str(e), "errors": e.errors}), 400
+            tz = resolve_timezone(data.get("timezone"))[1]
             current_time = datetime.now(tz)
 
-            # Parse incoming local time and make it timezone-aware
-            schedule_time_local = datetime.fromisoformat(data["schedule_time"])
-            if not schedule_time_local.tzinfo:
-                schedule_time_local = tz.localize(schedule_time_local)
-            
-            # Convert local time to UTC for comparison
-            schedule_time_utc = schedule_time_local.astimezone(pytz.UTC)
-
-            # Compare using local time
-            if schedule_time_local <= current_time:
-                return jsonify({"error": "Schedule time must be in the future"}), 400
-                
-        except ValueError as e:
-            return jsonify({"error": f"Invalid schedule time format: {str(e)}"}), 400
-
-        # Create unique job ID
-        job_id = f"whatsapp_msg_{int(datetime.now(tz).timestamp())}"
-
-        logger.info(f"Scheduling message with job ID: {job_id} for {schedule_time_local}")
-
-        # Prepare the message function and arguments
-        def scheduled_message_job():
-            try:
-                result = send_whatsapp_message(
-                    phone_number=data["phone_number"],
-                    message_data=data["message_data"],
-                    auth_token=data["auth_token"],
-                    phone_number_id=data["phone_number_id"]
-                )
-                logger.info(f"Scheduled message executed for job {job_id}: {result}")
-                return result
-            except Exception as e:
-                logger.error(f"Failed to execute scheduled message for job {job_id}: {str(e)}")
-                raise
+        # Create unique job ID. A client-supplied idempotency key always maps
+        # to the same job, so a retried request returns the existing job
+        idempotency_key = request.headers.get("Idempotency-Key") or data.get(
+            "idempotency_key"
+        )
+        job_id = _new_job_id(data, idempotency_key)
+        if idempotency_key:
+            with phase("idempotency"):
+                existing_job = scheduler.get_job(job_id)
+            if existing_job:
+                logger.info("Returning existing job %s for idempotency key", job_id)
+                return jsonify(
+                    _schedule_response("Message already scheduled", existing_job, tz, current_time)
+                ), 200
+
+        priority = data.get("priority") or Config.DEFAULT_PRIORITY
+        with phase("admission"):
+            lane_full = lane_is_full(priority)
+        if lane_full:
+            return _lane_full_response(priority)
+
+        logger.info("Scheduling message with job ID: %s for %s", job_id, schedule_time_local)
 
         # Add the job to the scheduler
-        job = scheduler.add_job(
-            func=scheduled_message_job,
-            trigger="date",
-            run_date=schedule_time_local,
-            id=job_id,
-            name=f"WhatsApp message to {data['phone_number']}",
-            misfire_grace_time=3600,  # Allow 1 hour grace time for misfired jobs
-            coalesce=True  # Combine multiple waiting runs into a single one
-        )
+        try:
+            with phase("job_def"):
+                job_def = _message_job_def(job_id, data, schedule_time_local)
+            with phase("add_job"):
+                job = scheduler.add_job(**job_def)
+        except ConflictingIdError:
+            # A concurrent retry with the same key got there first
+            existing_job = scheduler.get_job(job_id)
+            if not idempotency_key or not existing_job:
+                raise
+            return jsonify(
+                _schedule_response("Message already scheduled", existing_job, tz, current_time)
+            ), 200
 
         # Verify job was added
-        if not scheduler.get_job(job_id):
-            logger.error(f"Failed to add job {job_id} to scheduler")
+        with phase("verify"):
+            added = scheduler.get_job(job_id)
+        if not added:
+            logger.error("Failed to add job %s to scheduler", job_id)
             return jsonify({"error": "Failed to schedule message"}), 500
 
-        response_data = {
-            "message": "Message scheduled successfully",
-            "job_id": job_id,
-            "scheduled_time": schedule_time_local.isoformat(),
-            "timezone": str(tz),
-            "current_time": current_time.isoformat(),
-            "job_details": {
-                "next_run_time": job.next_run_time.isoformat() if job.next_run_time else None,
-                "pending": job.pending
-            }
-        }
+        with phase("respond"):
+            response_data = _schedule_response(
+                "Message scheduled successfully", job, tz, current_time
+            )
+            response = jsonify(response_data)
 
-        logger.info(f"Message scheduled successfully: {response_data}")
-        return jsonify(response_data), 201
+        logger.info("Message scheduled successfully: %s", job_id)
+        logger.debug("Schedule response: %s", response_data)
+        return response, 201
 
     except Exception as e:
-        logger.error(f"Error scheduling message: {str(e)}", exc_info=True)
+        logger.error("Error scheduling message: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
+def _iter_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            # Keep going: a bad line only fails its own item
+            yield ValueError(f"Invalid JSON: {str(e)}")
+
+
+class _ItemBoundary:
+    # Finds where a JSON value ends by tracking bracket depth and whether it
+    # is inside a string, so it's only decoded once all of it has been read.
+    # Picks up where the last call stopped when more of the body arrives.
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # Characters of the current value scanned so far
+        self.scanned = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def end(self, buffer, start, eof):
+        # Index just past the value starting at ``start``, or None when it
+        # may carry on in the next chunk
+        index = start + self.scanned
+        while index < len(buffer):
+            char = buffer[index]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 0:
+                        return index + 1
+            elif self.depth == 0 and index > start and (char in ",]}" or char.isspace()):
+                # The end of a number or literal
+                return index
+            elif char == '"':
+                self.in_string = True
+            elif char in "[{":
+                self.depth += 1
+            elif char in "]}":
+                self.depth -= 1
+                if self.depth <= 0:
+                    return index + 1
+            index += 1
+        self.scanned = index - start
+        return len(buffer) if eof else None
+
+
+def _iter_json_array(stream, chunk_size=64 * 1024):
+    # Decode a top-level JSON array one element at a time so the request body
+    # never has to be held in memory as a whole.
+    decoder = json.JSONDecoder()
+    reader = codecs.getincrementaldecoder("utf-8")()
+    boundary = _ItemBoundary()
+    buffer, pos, eof = "", 0, False
+    state = "start"
+
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+
+        if pos == len(buffer) or state == "partial":
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + reader.decode(chunk, final=eof)
+            pos = 0
+            if state == "partial":
+                state = "item"
+            continue
+
+        char = buffer[pos]
+        if state == "start":
+            if char != "[":
+                raise ValueError("Expected a JSON array of messages")
+            state = "first"
+            pos += 1
+        elif state == "separator":
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' at position {pos}")
+            state = "item"
+            pos += 1
+        elif state == "first" and char == "]":
+            return
+        else:
+            if boundary.end(buffer, pos, eof) is None:
+                state = "partial"
+                continue
+            # Invalid JSON stops the parse here, without reading the rest of
+            # the body
+            item, pos = decoder.raw_decode(buffer, pos)
+            boundary.reset()
+            state = "separator"
+            yield item
+
+
+def _until_error(items):
+    # A body that can't be parsed any further ends the stream as one failed
+    # item. The items before it are still scheduled and reported, rather
+    # than dropped with the batch they were collected in.
+    try:
+        yield from items
+    except ValueError as e:
+        yield ValueError(f"{e}; the rest of the request body was not read")
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _schedule_batch(batch):
+    now = time.time()
+    job_defs = []
+    positions = []
+    results = {}
+    # Checked once per batch rather than per item
+    full_lanes = {lane for lane in Config.PRIORITY_LANES if lane_is_full(lane)}
+
+    for index, data in batch:
+        if isinstance(data, Exception):
+            results[index] = {"index": index, "error": str(data)}
+            continue
+        try:
+            schedule_time_local = validate_message(data, now)
+        except ValidationError as e:
+            results[index] = {"index": index, "error": str(e), "errors": e.errors}
+            continue
+        priority = data.get("priority") or Config.DEFAULT_PRIORITY
+        if priority in full_lanes:
+            admission_rejected.inc(priority)
+            results[index] = {
+                "index": index,
+                "error": f"Too many {priority} messages waiting to be sent; retry later",
+                "retry_after": ADMISSION_RETRY_AFTER,
+            }
+            continue
+        idempotent = bool(data.get("idempotency_key"))
+        job_id = _new_job_id(data, data.get("idempotency_key"))
+        job_defs.append(_message_job_def(job_id, data, schedule_time_local))
+        positions.append((index, job_id, idempotent))
+
+    for (index, job_id, idempotent), job in zip(positions, add_jobs(job_defs)):
+        if isinstance(job, ConflictingIdError) and idempotent:
+            # Already scheduled by an earlier request with the same key
+            results[index] = {"index": index, "job_id": job_id, "duplicate": True}
+        elif isinstance(job, Exception):
+            results[index] = {"index": index, "error": str(job)}
+        else:
+            results[index] = {"index": index, "job_id": job.id}
+
+    for index, _ in batch:
+        yield results[index]
+
+
+@message_blueprint.route("/schedule-messages/bulk", methods=["POST"])
+def schedule_messages_bulk():
+    logger.info("Received bulk schedule request")
+    batch_size = Config.BULK_SCHEDULE_BATCH_SIZE
+
+    if request.mimetype in NDJSON_MIMETYPES:
+        items = _iter_ndjson(request.stream)
+    else:
+        items = _iter_json_array(request.stream)
+
+    def generate():
+        scheduled = failed = 0
+        try:
+            for batch in _batches(enumerate(_until_error(items)), batch_size):
+                for result in _schedule_batch(batch):
+                    if "job_id" in result:
+                        scheduled += 1
+                    else:
+                        failed += 1
+                    yield json.dumps(result) + "\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            logger.error("Error in bulk scheduling: %s", e, exc_info=True)
+            yield json.dumps({"error": str(e)}) + "\n"
+
+        logger.info("Bulk schedule finished: %s scheduled, %s failed", scheduled, failed)
+        yield json.dumps({"scheduled": scheduled, "failed": failed}) + "\n"
+
+    return Response(
+        stream_with_context(generate()), status=200, mimetype="application/x-ndjson"
+    )
+
+
+def _parse_window_bound(value, tz):
+    if not value:
+        return None
+    bound = datetime.fromisoformat(value)
+    if not bound.tzinfo:
+        bound = tz.localize(bound)
+    return bound.timestamp()
+
+
+def _format_run_ts(run_ts, tz):
+    # Paused jobs have no next run time and sort last in the index
+    if run_ts == math.inf:
+        return None
+    return datetime.fromtimestamp(run_ts, tz).isoformat()
+
+
+def _selection(tz):
+    # Field filters and run time window shared by the listing and bulk routes
+    filters = {
+        field: request.args[field]
+        for field in INDEXED_FIELDS
+        if request.args.get(field)
+    }
+    start_ts = _parse_window_bound(request.args.get("start"), tz)
+    end_ts = _parse_window_bound(request.args.get("end"), tz)
+    return filters, start_ts, end_ts
+
+
+def _occurrences_param():
+    return min(max(int(request.args.get("occurrences", 0)), 0), MAX_OCCURRENCES)
+
+
+def _message_details(entry, timezone, tz, occurrences=0):
+    details = {
+        "job_id": entry.job_id,
+        "phone_number": entry.phone_number,
+        "phone_number_id": entry.phone_number_id,
+        "message_type": entry.message_type,
+        "scheduled_time": _format_run_ts(entry.run_ts, tz),
+        "status": entry.status,
+        "timezone": timezone,
+    }
+    if entry.campaign is not None:
+        details["campaign"] = entry.campaign
+    if entry.priority is not None:
+        details["priority"] = entry.priority
+    recurrence = entry.recurrence
+    if recurrence is not None:
+        details["recurrence"] = recurrence.to_dict()
+        if occurrences and entry.run_ts != math.inf:
+            # Worked out from the schedule; nothing is stored per occurrence
+            details["next_occurrences"] = [
+                _format_run_ts(run_ts, tz)
+                for run_ts in recurrence.occurrences(entry.run_ts, occurrences)
+            ]
+    return details
+
+
+def _outcome_details(outcome, tz):
+    return {
+        "job_id": outcome["job_id"],
+        "sent": outcome["wamid"] is not None,
+        "wamid": outcome["wamid"],
+        "status": outcome["status"],
+        "error": outcome["error"],
+        "scheduled_time": _format_run_ts(outcome["run_ts"], tz) if outcome["run_ts"] else None,
+        "finished_at": _format_run_ts(outcome["finished_ts"], tz),
+        "latency_ms": outcome["latency_ms"],
+        "attempts": outcome["attempts"],
+        "phone_number_id": outcome["phone_number_id"],
+    }
+
+
 @message_blueprint.route("/scheduled-messages", methods=["GET"])
 def get_scheduled_messages():
     try:
         logger.info("Fetching all scheduled messages")
 
-        timezone = request.args.get("timezone", Config.DEFAULT_TIMEZONE)
-        if timezone not in pytz.all_timezones:
-            logger.warning(
-                f"Invalid timezone provided: {timezone}, falling back to {Config.DEFAULT_TIMEZONE}"
-            )
-            timezone = Config.DEFAULT_TIMEZONE
-
-        tz = pytz.timezone(timezone)
-        jobs = scheduler.get_jobs()
-        scheduled_messages = []
-
-        for job in jobs:
-            run_time = job.next_run_time.astimezone(tz)
-            phone_number = job.args[0] if job.args else None
-            message_type = (
-                job.args[1].get("type", "Unknown") if len(job.args) > 1 else "Unknown"
-            )
-
-            scheduled_messages.append(
-                {
-                    "job_id": job.id,
-                    "phone_number": phone_number,
-                    "message_type": message_type,
-                    "scheduled_time": run_time.isoformat(),
-                    "status": "scheduled",
-                    "timezone": timezone,
-                }
+        with phase("params"):
+            timezone, tz = resolve_timezone(request.args.get("timezone"))
+            try:
+                filters, start_ts, end_ts = _selection(tz)
+                limit = min(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+                cursor = request.args.get("cursor")
+                after = decode_cursor(cursor) if cursor else None
+                occurrences = _occurrences_param()
+            except ValueError as e:
+                return jsonify({"error": f"Invalid query parameter: {str(e)}"}), 400
+
+        if request.args.get("count_only", "").lower() in ("1", "true", "yes"):
+            with phase("query"):
+                count = job_index.count(filters, start_ts, end_ts)
+            return jsonify({"count": count, "timezone": timezone}), 200
+
+        with phase("query"):
+            entries, next_cursor = job_index.page(
+                filters, start_ts, end_ts, after=after, limit=max(limit, 1)
             )
+        with phase("format"):
+            scheduled_messages = [
+                _message_details(entry, timezone, tz, occurrences) for entry in entries
+            ]
 
         response_data = {
             "count": len(scheduled_messages),
             "timezone": timezone,
             "messages": scheduled_messages,
+            "next_cursor": next_cursor,
         }
 
         logger.info(
-            f"Successfully fetched {len(scheduled_messages)} scheduled messages"
+            "Successfully fetched %s scheduled messages", len(scheduled_messages)
         )
-        return jsonify(response_data), 200
+        with phase("respond"):
+            response = jsonify(response_data)
+        return response, 200
 
     except Exception as e:
-        logger.error(f"Error fetching scheduled messages: {str(e)}", exc_info=True)
+        logger.error("Error fetching scheduled messages: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
 @message_blueprint.route("/scheduled-messages/<job_id>", methods=["GET"])
 def get_scheduled_message(job_id):
     try:
-        logger.info(f"Fetching details for job ID: {job_id}")
-
-        timezone = request.args.get("timezone", Config.DEFAULT_TIMEZONE)
-        if timezone not in pytz.all_timezones:
-            logger.warning(
-                f"Invalid timezone provided: {timezone}, falling back to {Config.DEFAULT_TIMEZONE}"
-            )
-            timezone = Config.DEFAULT_TIMEZONE
+        logger.info("Fetching details for job ID: %s", job_id)
 
-        tz = pytz.timezone(timezone)
-        job = scheduler.get_job(job_id)
-
-        if not job:
-            logger.warning(f"Job not found with ID: {job_id}")
+        timezone, tz = resolve_timezone(request.args.get("timezone"))
+        try:
+            occurrences = _occurrences_param()
+        except ValueError as e:
+            return jsonify({"error": f"Invalid query parameter: {str(e)}"}), 400
+        meta = job_index.get(job_id)
+
+        if not meta:
+            # Jobs leave the scheduler once they have run; what happened to
+            # them is in the outcome history, with the status recorded for
+            # the latest run (a response status, "deferred", "missed", ...)
+            outcomes = outcome_store.get(job_id)
+            if outcomes:
+                return jsonify({
+                    **_outcome_details(outcomes[0], tz),
+                    "timezone": timezone,
+                    "outcomes": [_outcome_details(outcome, tz) for outcome in outcomes],
+                }), 200
+            logger.warning("Job not found with ID: %s", job_id)
             return jsonify({"error": "Scheduled message not found"}), 404
 
-        run_time = job.next_run_time.astimezone(tz)
+        message_details = _message_details(meta, timezone, tz, occurrences)
 
-        message_details = {
-            "job_id": job.id,
-            "phone_number": job.args[0] if job.args else None,
-            "message_data": job.args[1] if len(job.args) > 1 else None,
-            "scheduled_time": run_time.isoformat(),
-            "status": "scheduled",
-            "timezone": timezone,
-        }
+        # The payload lives in the pickled job; only load it when asked for
+        if "message_data" in request.args.get("include", "").split(","):
+            job = scheduler.get_job(job_id)
+            message_data = job.args[1] if job and len(job.args) > 1 else None
+            if isinstance(message_data, TemplateMessage):
+                message_data = message_data.to_dict()
+            message_details["message_data"] = message_data
 
-        logger.info(f"Successfully fetched details for job ID: {job_id}")
+        logger.info("Successfully fetched details for job ID: %s", job_id)
         return jsonify(message_details), 200
 
     except Exception as e:
         logger.error(
-            f"Error fetching scheduled message details: {str(e)}", exc_info=True
+            "Error fetching scheduled message details: %s", e, exc_info=True
         )
         return jsonify({"error": str(e)}), 500
 
 
+@message_blueprint.route("/scheduled-messages/<job_id>", methods=["DELETE"])
+def cancel_scheduled_message(job_id):
+    try:
+        logger.info("Cancelling job %s", job_id)
+        try:
+            scheduler.remove_job(job_id)
+        except JobLookupError:
+            logger.warning("Job not found with ID: %s", job_id)
+            return jsonify({"error": "Scheduled message not found"}), 404
+        cancel_broadcasts([job_id])
+
+        logger.info("Cancelled job %s", job_id)
+        return jsonify({"message": "Scheduled message cancelled", "job_id": job_id}), 200
+
+    except Exception as e:
+        logger.error("Error cancelling scheduled message: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@message_blueprint.route("/scheduled-messages/<job_id>", methods=["PATCH"])
+def reschedule_scheduled_message(job_id):
+    try:
+        logger.info("Rescheduling job %s", job_id)
+        data = request.get_json()
+        try:
+            run_date = validate_reschedule(data)[0]
+        except ValidationError as e:
+            return jsonify({"error": str(e), "errors": e.errors}), 400
+        tz = resolve_timezone(data.get("timezone"))[1]
+
+        job = scheduler.get_job(job_id)
+        if job is None:
+            logger.warning("Job not found with ID: %s", job_id)
+            return jsonify({"error": "Scheduled message not found"}), 404
+        if not isinstance(job.trigger, DateTrigger):
+            return jsonify(
+                {"error": "Recurring messages can't be moved; cancel and schedule them again"}
+            ), 409
+
+        job = scheduler.scheduler.modify_job(job_id, **rescheduled_changes(job, run_date))
+        logger.info("Rescheduled job %s to %s", job_id, run_date)
+        return jsonify(
+            _schedule_response("Scheduled message rescheduled", job, tz, datetime.now(tz))
+        ), 200
+
+    except JobLookupError:
+        # Started running (or was cancelled) in the meantime
+        return jsonify({"error": "Scheduled message not found"}), 404
+    except Exception as e:
+        logger.error("Error rescheduling message: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+def _bulk_selection(tz):
+    # Filters and window of a bulk cancel or move. One filter at least, so an
+    # empty query string can't touch every job by accident. The jobs are
+    # picked with select_jobs, from the shared store rather than the index,
+    # which API workers only refresh every few seconds.
+    filters, start_ts, end_ts = _selection(tz)
+    if not filters and start_ts is None and end_ts is None:
+        raise ValueError(
+            f"give at least one of {', '.join(INDEXED_FIELDS)}, start or end"
+        )
+    return filters, start_ts, end_ts
+
+
+@message_blueprint.route("/scheduled-messages", methods=["DELETE"])
+def cancel_scheduled_messages():
+    try:
+        logger.info("Received bulk cancel request")
+        tz = resolve_timezone(request.args.get("timezone"))[1]
+        started = time.perf_counter()
+        try:
+            selection = _bulk_selection(tz)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid query parameter: {str(e)}"}), 400
+
+        with select_jobs(*selection) as entries:
+            cancelled = remove_jobs([entry.job_id for entry in entries])
+        cancel_broadcasts(cancelled)
+        elapsed = time.perf_counter() - started
+
+        logger.info("Cancelled %s of %s matched jobs in %.2fs", len(cancelled), len(entries), elapsed)
+        return jsonify({
+            "matched": len(entries),
+            "cancelled": len(cancelled),
+            "elapsed_ms": round(elapsed * 1000, 1),
+        }), 200
+
+    except Exception as e:
+        logger.error("Error cancelling scheduled messages: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@message_blueprint.route("/scheduled-messages", methods=["PATCH"])
+def reschedule_scheduled_messages():
+    # Moves every matched one-off message to a new schedule_time, or by
+    # shift_seconds each. Recurring and paused messages are skipped.
+    try:
+        logger.info("Received bulk reschedule request")
+        data = request.get_json()
+        try:
+            run_date, shift = validate_reschedule(data, allow_shift=True)
+        except ValidationError as e:
+            return jsonify({"error": str(e), "errors": e.errors}), 400
+        tz = resolve_timezone(request.args.get("timezone") or data.get("timezone"))[1]
+
+        started = time.perf_counter()
+        try:
+            selection = _bulk_selection(tz)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid query parameter: {str(e)}"}), 400
+
+        now = time.time()
+        with select_jobs(*selection) as entries:
+            run_dates = {}
+            for entry in entries:
+                if entry.recurrence is not None or entry.run_ts == math.inf:
+                    continue
+                if shift is None:
+                    run_dates[entry.job_id] = run_date
+                    continue
+                run_ts = entry.run_ts + shift
+                if run_ts <= now:
+                    return jsonify({
+                        "error": f"shift_seconds would move {entry.job_id} into the past"
+                    }), 400
+                run_dates[entry.job_id] = datetime.fromtimestamp(run_ts, tz)
+
+            rescheduled = reschedule_jobs(run_dates)
+        elapsed = time.perf_counter() - started
+
+        logger.info(
+            "Rescheduled %s of %s matched jobs in %.2fs", len(rescheduled), len(entries), elapsed
+        )
+        return jsonify({
+            "matched": len(entries),
+            "rescheduled": len(rescheduled),
+            "skipped": len(entries) - len(rescheduled),
+            "elapsed_ms": round(elapsed * 1000, 1),
+        }), 200
+
+    except Exception as e:
+        logger.error("Error rescheduling scheduled messages: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@message_blueprint.route("/outcomes", methods=["GET"])
+def get_outcomes():
+    # Delivery history by job_id, by WhatsApp message id (wamid), or by
+    # phone_number_id and/or a start/end window on when the send finished
+    try:
+        timezone, tz = resolve_timezone(request.args.get("timezone"))
+        try:
+            limit = min(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+            start_ts = _parse_window_bound(request.args.get("start"), tz)
+            end_ts = _parse_window_bound(request.args.get("end"), tz)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid query parameter: {str(e)}"}), 400
+
+        job_id = request.args.get("job_id")
+        if job_id:
+            outcomes = outcome_store.get(job_id, max(limit, 1))
+        else:
+            outcomes = outcome_store.find(
+                wamid=request.args.get("wamid") or None,
+                phone_number_id=request.args.get("phone_number_id") or None,
+                start_ts=start_ts,
+                end_ts=end_ts,
+                limit=max(limit, 1),
+            )
+
+        return jsonify({
+            "count": len(outcomes),
+            "timezone": timezone,
+            "outcomes": [_outcome_details(outcome, tz) for outcome in outcomes],
+        }), 200
+
+    except Exception as e:
+        logger.error("Error fetching delivery outcomes: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
 @message_blueprint.route("/test-scheduler", methods=["POST"])
 def test_scheduler():
     try:
         data = request.get_json()
-        test_time = datetime.now(pytz.timezone(Config.DEFAULT_TIMEZONE)) + timedelta(
-            seconds=30
+        if not isinstance(data, dict):
+            return jsonify({"error": "Request body must be a JSON object"}), 400
+        timezone, tz = resolve_timezone(data.get("timezone"))
+        current_time = datetime.now(tz)
+
+        # A fixed text message 30 seconds from now, scheduled like any other:
+        # same validation, ids, metadata, credential and lane
+        data = {
+            key: value for key, value in data.items() if key not in ("template", "recurrence")
+        }
+        data.update(
+            message_data={"type": "text", "text": {"body": "This is a test scheduled message"}},
+            schedule_time=(current_time + timedelta(seconds=30)).isoformat(),
+            timezone=timezone,
         )
+        try:
+            schedule_time_local = validate_message(data)
+        except ValidationError as e:
+            return jsonify({"error": str(e), "errors": e.errors}), 400
 
-        job_id = f"test_msg_{datetime.now().timestamp()}"
-
-        # Schedule a test message
-        scheduler.add_job(
-            id=job_id,
-            func=send_whatsapp_message,
-            trigger="date",
-            run_date=test_time,
-            args=[
-                data["phone_number"],
-                {"type": "text", "text": {"body": "This is a test scheduled message"}},
-                data["auth_token"],
-                data["phone_number_id"],
-            ],
-        )
+        priority = data.get("priority") or Config.DEFAULT_PRIORITY
+        if lane_is_full(priority):
+            return _lane_full_response(priority)
 
-        return (
-            jsonify(
-                {
-                    "message": "Test message scheduled",
-                    "job_id": job_id,
-                    "scheduled_time": test_time.isoformat(),
-                }
-            ),
-            201,
+        idempotency_key = request.headers.get("Idempotency-Key") or data.get(
+            "idempotency_key"
         )
+        job_id = _new_job_id(data, idempotency_key)
+        job = add_jobs([_message_job_def(job_id, data, schedule_time_local)])[0]
+        if isinstance(job, ConflictingIdError) and idempotency_key:
+            existing_job = scheduler.get_job(job_id)
+            if existing_job:
+                return jsonify(
+                    _schedule_response("Test message already scheduled", existing_job, tz, current_time)
+                ), 200
+        if isinstance(job, Exception):
+            raise job
+
+        logger.info("Test message scheduled: %s", job_id)
+        return jsonify(
+            _schedule_response("Test message scheduled", job, tz, current_time)
+        ), 201
 
     except Exception as e:
-        logger.error(f"Error scheduling test message: {str(e)}", exc_info=True)
+        logger.error("Error scheduling test message: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
 @message_blueprint.route("/scheduler-status", methods=["GET"])
 def get_scheduler_status():
     try:
+        try:
+            limit = min(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+            cursor = request.args.get("cursor")
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return jsonify({"error": f"Invalid query parameter: {str(e)}"}), 400
+
+        entries, next_cursor = job_index.page(after=after, limit=max(limit, 1))
         status = {
             "running": scheduler.running,
             "state": scheduler.state,
-            "job_count": len(scheduler.get_jobs()),
+            "role": Config.SCHEDULER_ROLE,
+            "job_count": len(job_index),
             "jobs": [
                 {
-                    "id": job.id,
-                    "next_run_time": (
-                        job.next_run_time.isoformat() if job.next_run_time else None
-                    ),
+                    "id": entry.job_id,
+                    "next_run_time": _format_run_ts(entry.run_ts, pytz.UTC),
                 }
-                for job in scheduler.get_jobs()
+                for entry in entries
             ],
+            "next_cursor": next_cursor,
+            "http_pool": get_pool_stats(),
+            "rate_limits": rate_limiter.stats(),
+            "circuit_breakers": circuit_breakers.stats(),
+            "dispatch_lateness": dispatch_lateness.snapshot(),
         }
         return jsonify(status), 200
     except Exception as e:
-        logger.error(f"Error getting scheduler status: {str(e)}", exc_info=True)
+        logger.error("Error getting scheduler status: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
@@ -0,0 +1,73 @@
+from flask import Blueprint, Response, request, jsonify
+from app.config import Config
+from app.utils.logger import setup_logger
+from app.utils.metrics import render
+from app.utils.profiling import profiler, timing_snapshot
+
+logger = setup_logger(__name__)
+metrics_blueprint = Blueprint("metrics", __name__)
+
+
+@metrics_blueprint.route("/metrics", methods=["GET"])
+def metrics():
+    try:
+        return Response(render(), mimetype="text/plain; version=0.0.4")
+    except Exception as e:
+        logger.error("Error rendering metrics: %s", e, exc_info=True)
+        return Response(f"# error: {e}\n", status=500, mimetype="text/plain")
+
+
+@metrics_blueprint.route("/timings", methods=["GET"])
+def timings():
+    # Request phase timings per endpoint since the process started
+    try:
+        return jsonify({"enabled": Config.REQUEST_TIMING, "endpoints": timing_snapshot()}), 200
+    except Exception as e:
+        logger.error("Error getting request timings: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@metrics_blueprint.route("/profiler", methods=["GET"])
+def profiler_status():
+    return jsonify(profiler.status()), 200
+
+
+@metrics_blueprint.route("/profiler/start", methods=["POST"])
+def start_profiler():
+    # Samples the scheduler's threads (or every thread, with
+    # "threads": "all") until stopped or "seconds" have passed
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            seconds = float(data.get("seconds", Config.PROFILE_SECONDS))
+            interval_ms = float(data.get("interval_ms", Config.PROFILE_INTERVAL_MS))
+            threads = data.get("threads", "scheduler")
+            if not 0 < seconds <= Config.PROFILE_MAX_SECONDS:
+                raise ValueError(f"seconds must be between 0 and {Config.PROFILE_MAX_SECONDS:g}")
+            if interval_ms < 1:
+                raise ValueError("interval_ms must be at least 1")
+            if threads not in ("scheduler", "all"):
+                raise ValueError("threads must be 'scheduler' or 'all'")
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+
+        try:
+            profiler.start(seconds, interval_ms / 1000, all_threads=threads == "all")
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 409
+        return jsonify({"message": "Profiler started", **profiler.status()}), 202
+    except Exception as e:
+        logger.error("Error starting profiler: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@metrics_blueprint.route("/profiler/stop", methods=["POST"])
+def stop_profiler():
+    try:
+        path = profiler.stop()
+        if path is None:
+            return jsonify({"error": "No profile is being taken"}), 409
+        return jsonify({"message": "Profile written", "profile": path}), 200
+    except Exception as e:
+        logger.error("Error stopping profiler: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
@@ -2,10 +2,12 @@ from flask import Blueprint, request, jsonify
 from app.services.template_service import (
     create_whatsapp_template,
     get_whatsapp_templates,
+    template_cache,
 )
 from app.utils.logger import setup_logger
+from app.utils.profiling import phase
 
-logger = setup_logger()
+logger = setup_logger(__name__)
 template_blueprint = Blueprint("templates", __name__)
 
 
@@ -13,14 +15,15 @@ template_blueprint = Blueprint("templates", __name__)
 def create_template():
     try:
         logger.info("Received template creation request")
-        data = request.get_json()
+        with phase("parse"):
+            data = request.get_json()
 
         # Validate required fields
         required_fields = ["auth_token", "phone_number_id", "template"]
         missing_fields = [field for field in required_fields if field not in data]
 
         if missing_fields:
-            logger.error(f"Missing required fields: {missing_fields}")
+            logger.error("Missing required fields: %s", missing_fields)
             return (
                 jsonify(
                     {"error": f"Missing required fields: {', '.join(missing_fields)}"}
@@ -28,11 +31,12 @@ def create_template():
                 400,
             )
 
-        response = create_whatsapp_template(
-            auth_token=data["auth_token"],
-            phone_number_id=data["phone_number_id"],
-            template_data=data["template"],
-        )
+        with phase("graph_api"):
+            response = create_whatsapp_template(
+                auth_token=data["auth_token"],
+                phone_number_id=data["phone_number_id"],
+                template_data=data["template"],
+            )
 
         if response:
             return (
@@ -48,7 +52,7 @@ def create_template():
             return jsonify({"error": "Failed to create template"}), 500
 
     except Exception as e:
-        logger.error(f"Error in template creation: {str(e)}", exc_info=True)
+        logger.error("Error in template creation: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
@@ -71,7 +75,9 @@ def list_templates():
         # Remove 'Bearer ' if present
         auth_token = auth_token.replace("Bearer ", "")
 
-        templates = get_whatsapp_templates(auth_token, phone_number_id)
+        # Served from the template cache when it holds them
+        with phase("graph_api"):
+            templates = get_whatsapp_templates(auth_token, phone_number_id)
 
         if templates:
             return jsonify(templates), 200
@@ -79,5 +85,10 @@ def list_templates():
             return jsonify({"error": "Failed to fetch templates"}), 500
 
     except Exception as e:
-        logger.error(f"Error fetching templates: {str(e)}", exc_info=True)
+        logger.error("Error fetching templates: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
+
+
+@template_blueprint.route("/templates/cache-stats", methods=["GET"])
+def template_cache_stats():
+    return jsonify(template_cache.stats()), 200
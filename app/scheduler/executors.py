@@ -0,0 +1,299 @@
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from apscheduler.executors.base import BaseExecutor, run_coroutine_job, run_job
+from apscheduler.util import iscoroutinefunction_partial
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class AsyncioDispatchExecutor(BaseExecutor):
+    # Runs coroutine jobs on an event loop owned by this executor, so it can be
+    # used from the background scheduler Flask-APScheduler creates. Plain
+    # functions fall back to the loop's default thread pool.
+
+    def __init__(self, max_concurrency=1000):
+        super().__init__()
+        self.max_concurrency = max_concurrency
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._pending_futures = set()
+        self._pending_lock = threading.Lock()
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run_loop, name=f"asyncio-dispatch-{alias}", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            "Asyncio dispatch executor '%s' started with concurrency %s", alias, self.max_concurrency
+        )
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._loop.run_forever()
+
+    def shutdown(self, wait=True):
+        if self._loop is None:
+            return
+
+        with self._pending_lock:
+            pending = list(self._pending_futures)
+        if wait:
+            for future in pending:
+                try:
+                    future.result()
+                except BaseException:
+                    pass
+        else:
+            for future in pending:
+                future.cancel()
+
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    async def _close(self):
+        from app.services.http_client import close_async_session
+
+        await close_async_session()
+
+    @property
+    def in_flight(self):
+        return len(self._pending_futures)
+
+    async def _run(self, job, run_times):
+        async with self._semaphore:
+            if iscoroutinefunction_partial(job.func):
+                return await run_coroutine_job(
+                    job, job._jobstore_alias, run_times, self._logger.name
+                )
+            return await self._loop.run_in_executor(
+                None, run_job, job, job._jobstore_alias, run_times, self._logger.name
+            )
+
+    def _do_submit_job(self, job, run_times):
+        def callback(future):
+            with self._pending_lock:
+                self._pending_futures.discard(future)
+            try:
+                events = future.result()
+            except BaseException:
+                self._run_job_error(job.id, *sys.exc_info()[1:])
+            else:
+                self._run_job_success(job.id, events)
+
+        future = asyncio.run_coroutine_threadsafe(self._run(job, run_times), self._loop)
+        with self._pending_lock:
+            self._pending_futures.add(future)
+        future.add_done_callback(callback)
+
+
+def _phone_number_id(job):
+    meta = job.kwargs.get("meta")
+    if meta is not None:
+        return getattr(meta, "phone_number_id", None)
+    # Message jobs without metadata pass it as their fourth argument
+    return job.args[3] if len(job.args) > 3 else None
+
+
+class BatchDispatchExecutor(BaseExecutor):
+    # Collects jobs as the scheduler submits them and dispatches everything
+    # due in the same time bucket together: each bucket is split into batches
+    # of up to ``batch_size`` jobs, and up to ``max_workers`` batches are sent
+    # at once. A worker sends all of a batch's coroutine jobs concurrently on
+    # its own event loop and HTTP session, after taking their rate limit
+    # tokens with one acquire per phone number. Plain function jobs run one
+    # after another on the worker.
+
+    def __init__(self, bucket_ms=100, batch_size=100, max_workers=20):
+        super().__init__()
+        self.bucket = bucket_ms / 1000.0
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self._pending = []
+        self._first_pending_at = None
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._pool = None
+        self._thread = None
+        self._in_flight = 0
+        # Each worker's {"loop", "session"}, kept between batches
+        self._local = threading.local()
+        self._workers = []
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self._stopped = False
+        self._pool = ThreadPoolExecutor(
+            self.max_workers, thread_name_prefix=f"batch-dispatch-{alias}"
+        )
+        self._thread = threading.Thread(
+            target=self._collect, name=f"batch-collector-{alias}", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            "Batch dispatch executor '%s' started: %sms buckets, batches of %s, %s workers",
+            alias,
+            int(self.bucket * 1000),
+            self.batch_size,
+            self.max_workers,
+        )
+
+    def shutdown(self, wait=True):
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+        self._pool.shutdown(wait)
+        if wait:
+            # Workers have exited, so their loops can be run from here
+            for worker in self._workers:
+                if worker["session"] is not None:
+                    worker["loop"].run_until_complete(worker["session"].close())
+                worker["loop"].close()
+        self._workers = []
+
+    @property
+    def in_flight(self):
+        return self._in_flight + len(self._pending)
+
+    def _do_submit_job(self, job, run_times):
+        with self._condition:
+            self._pending.append((job, run_times))
+            if len(self._pending) == 1:
+                # Opens a new bucket: the collector starts its timer
+                self._first_pending_at = time.monotonic()
+                self._condition.notify()
+            elif len(self._pending) >= self.batch_size:
+                # A full batch doesn't need to wait for the bucket to close
+                self._condition.notify()
+
+    def _collect(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if self._pending:
+                        remaining = self._first_pending_at + self.bucket - time.monotonic()
+                        if remaining <= 0 or len(self._pending) >= self.batch_size:
+                            break
+                        self._condition.wait(remaining)
+                    else:
+                        self._condition.wait()
+                pending, self._pending = self._pending, []
+                stopped = self._stopped
+
+            self._dispatch(pending)
+            if stopped:
+                return
+
+    def _dispatch(self, pending):
+        # Group by the bucket each job was due in, keeping submission order
+        groups = {}
+        for item in pending:
+            key = int(item[1][-1].timestamp() // self.bucket)
+            groups.setdefault(key, []).append(item)
+
+        for group in groups.values():
+            # As few batches as batch_size allows, split evenly
+            batches = -(-len(group) // self.batch_size)
+            size = -(-len(group) // batches)
+            for start in range(0, len(group), size):
+                batch = group[start : start + size]
+                with self._condition:
+                    self._in_flight += len(batch)
+                self._pool.submit(self._run_batch, batch)
+
+    def _worker(self):
+        worker = getattr(self._local, "worker", None)
+        if worker is None:
+            worker = self._local.worker = {"loop": asyncio.new_event_loop(), "session": None}
+            with self._condition:
+                self._workers.append(worker)
+        return worker
+
+    def _run_batch(self, batch):
+        started = time.time()
+        sends, others = [], []
+        for item in batch:
+            (sends if iscoroutinefunction_partial(item[0].func) else others).append(item)
+        results = []
+        if sends:
+            worker = self._worker()
+            try:
+                outcomes = worker["loop"].run_until_complete(self._send(worker, sends))
+            except BaseException as e:
+                outcomes = [e] * len(sends)
+            results.extend(zip(sends, outcomes))
+
+        for job, run_times in others:
+            try:
+                events = run_job(job, job._jobstore_alias, run_times, self._logger.name)
+            except BaseException as e:
+                events = e
+            results.append(((job, run_times), events))
+
+        failed = 0
+        for (job, run_times), outcome in results:
+            if isinstance(outcome, BaseException):
+                failed += 1
+                self._run_job_error(job.id, outcome, outcome.__traceback__)
+            else:
+                self._run_job_success(job.id, outcome)
+            with self._condition:
+                self._in_flight -= 1
+        logger.debug(
+            "Dispatched batch of %s jobs (%s failed) in %.3fs",
+            len(batch),
+            failed,
+            time.time() - started,
+        )
+
+    async def _send(self, worker, sends):
+        from app.services.http_client import new_async_session
+        from app.services.rate_limiter import rate_limiter
+
+        if worker["session"] is None or worker["session"].closed:
+            worker["session"] = new_async_session(self.batch_size)
+
+        # One limiter acquire per phone number for the whole batch
+        by_number = {}
+        for index, (job, _) in enumerate(sends):
+            by_number.setdefault(_phone_number_id(job), []).append(index)
+        prepaid = [None] * len(sends)
+        for phone_number_id, indexes in by_number.items():
+            if phone_number_id is None:
+                continue
+            granted = rate_limiter.acquire_many(phone_number_id, len(indexes))
+            for index, retry_after in zip(indexes, granted):
+                prepaid[index] = (phone_number_id, retry_after)
+
+        return await asyncio.gather(
+            *(
+                self._send_one(worker["session"], job, run_times, prepaid[index])
+                for index, (job, run_times) in enumerate(sends)
+            ),
+            return_exceptions=True,
+        )
+
+    async def _send_one(self, session, job, run_times, prepaid):
+        # Each send is its own task, so these only apply to it
+        from app.services.http_client import use_async_session
+        from app.services.rate_limiter import prepay
+
+        use_async_session(session)
+        if prepaid is not None:
+            prepay(*prepaid)
+        return await run_coroutine_job(job, job._jobstore_alias, run_times, self._logger.name)
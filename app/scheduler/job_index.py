@@ -0,0 +1,229 @@
+import base64
+import math
+import threading
+from bisect import bisect_left, bisect_right, insort
+from apscheduler.events import (
+    EVENT_ALL_JOBS_REMOVED,
+    EVENT_JOB_ADDED,
+    EVENT_JOB_MAX_INSTANCES,
+    EVENT_JOB_MODIFIED,
+    EVENT_JOB_REMOVED,
+    EVENT_JOB_SUBMITTED,
+)
+
+# Fields that get their own posting list for filtering
+INDEXED_FIELDS = ("phone_number", "phone_number_id", "campaign")
+
+# Submissions move a recurring job on to its next run without any other event
+INDEX_EVENTS = (
+    EVENT_JOB_ADDED | EVENT_JOB_MODIFIED | EVENT_JOB_REMOVED | EVENT_ALL_JOBS_REMOVED
+    | EVENT_JOB_SUBMITTED | EVENT_JOB_MAX_INSTANCES
+)
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(f"{key[0]!r}|{key[1]}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        run_ts, job_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return float(run_ts), job_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class JobIndex:
+    # Secondary index of MessageMeta records, ordered by (next run time, job
+    # id) with per-field posting lists, kept in sync from scheduler events so
+    # the listing endpoints never have to scan the job store.
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._order = []
+        self._postings = {field: {} for field in INDEXED_FIELDS}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, job_id):
+        return job_id in self._entries
+
+    def get(self, job_id):
+        return self._entries.get(job_id)
+
+    def add(self, entry):
+        with self._lock:
+            if entry.job_id in self._entries:
+                self._discard(entry.job_id)
+            key = (entry.run_ts, entry.job_id)
+            self._entries[entry.job_id] = entry
+            insort(self._order, key)
+            for field in INDEXED_FIELDS:
+                value = getattr(entry, field)
+                if value is not None:
+                    insort(self._postings[field].setdefault(value, []), key)
+
+    def remove(self, job_id):
+        with self._lock:
+            self._discard(job_id)
+
+    def update_many(self, entries=(), removed=()):
+        # Bulk add() and remove(): each affected sorted list is filtered once
+        # (only if something left it) and sorted once, which Timsort does as a
+        # merge of the existing run with the new keys, instead of a bisect and
+        # list shift per entry
+        entries = list(entries)
+        with self._lock:
+            stale = {job_id for job_id in removed if job_id in self._entries}
+            stale.update(entry.job_id for entry in entries if entry.job_id in self._entries)
+            touched = {field: {} for field in INDEXED_FIELDS}
+            for job_id in stale:
+                old = self._entries.pop(job_id)
+                for field in INDEXED_FIELDS:
+                    value = getattr(old, field)
+                    if value is not None:
+                        touched[field].setdefault(value, [])
+            for entry in entries:
+                self._entries[entry.job_id] = entry
+                key = (entry.run_ts, entry.job_id)
+                for field in INDEXED_FIELDS:
+                    value = getattr(entry, field)
+                    if value is not None:
+                        touched[field].setdefault(value, []).append(key)
+
+            if stale:
+                self._order = [key for key in self._order if key[1] not in stale]
+            self._order.extend((entry.run_ts, entry.job_id) for entry in entries)
+            self._order.sort()
+            for field, additions in touched.items():
+                postings = self._postings[field]
+                for value, keys in additions.items():
+                    current = postings.get(value, [])
+                    if stale:
+                        current = [key for key in current if key[1] not in stale]
+                    current.extend(keys)
+                    if current:
+                        current.sort()
+                        postings[value] = current
+                    else:
+                        postings.pop(value, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._order.clear()
+            for postings in self._postings.values():
+                postings.clear()
+
+    def rebuild(self, entries):
+        # Build the replacement off to the side so readers keep being served
+        # from the old contents until the swap
+        by_id = {entry.job_id: entry for entry in entries}
+        order = sorted((entry.run_ts, job_id) for job_id, entry in by_id.items())
+        postings = {field: {} for field in INDEXED_FIELDS}
+        for key in order:
+            entry = by_id[key[1]]
+            for field in INDEXED_FIELDS:
+                value = getattr(entry, field)
+                if value is not None:
+                    postings[field].setdefault(value, []).append(key)
+        with self._lock:
+            self._entries = by_id
+            self._order = order
+            self._postings = postings
+
+    def _discard(self, job_id):
+        entry = self._entries.pop(job_id, None)
+        if entry is None:
+            return
+        key = (entry.run_ts, entry.job_id)
+        self._remove_key(self._order, key)
+        for field in INDEXED_FIELDS:
+            value = getattr(entry, field)
+            keys = self._postings[field].get(value)
+            if keys is not None:
+                self._remove_key(keys, key)
+                if not keys:
+                    del self._postings[field][value]
+
+    @staticmethod
+    def _remove_key(keys, key):
+        position = bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+
+    def _candidates(self, filters):
+        # The narrowest sorted key list plus the filters it doesn't cover
+        keys = self._order
+        remaining = dict(filters)
+        for field, value in filters.items():
+            posting = self._postings[field].get(value, [])
+            if len(posting) <= len(keys):
+                keys = posting
+        for field, value in filters.items():
+            if keys is self._postings[field].get(value):
+                del remaining[field]
+                break
+        return keys, remaining
+
+    def _window(self, keys, start_ts, end_ts, after):
+        low = 0
+        if start_ts is not None:
+            low = bisect_left(keys, (start_ts,))
+        if after is not None:
+            low = max(low, bisect_right(keys, after))
+        high = len(keys)
+        if end_ts is not None:
+            high = bisect_left(keys, (math.nextafter(end_ts, math.inf),))
+        return low, high
+
+    def _matches(self, entry, remaining):
+        return all(getattr(entry, field) == value for field, value in remaining.items())
+
+    def count(self, filters=None, start_ts=None, end_ts=None):
+        with self._lock:
+            keys, remaining = self._candidates(filters or {})
+            low, high = self._window(keys, start_ts, end_ts, None)
+            if not remaining:
+                return max(high - low, 0)
+            return sum(
+                1
+                for _, job_id in keys[low:high]
+                if self._matches(self._entries[job_id], remaining)
+            )
+
+    def select(self, filters=None, start_ts=None, end_ts=None):
+        # Every entry matching the filters, in run time order
+        with self._lock:
+            keys, remaining = self._candidates(filters or {})
+            low, high = self._window(keys, start_ts, end_ts, None)
+            entries = [self._entries[job_id] for _, job_id in keys[low:high]]
+        if remaining:
+            entries = [entry for entry in entries if self._matches(entry, remaining)]
+        return entries
+
+    def page(self, filters=None, start_ts=None, end_ts=None, after=None, limit=100):
+        # Returns up to ``limit`` entries after the cursor key plus the cursor
+        # for the next page (None on the last page)
+        with self._lock:
+            keys, remaining = self._candidates(filters or {})
+            low, high = self._window(keys, start_ts, end_ts, after)
+            entries = []
+            for position in range(low, high):
+                entry = self._entries[keys[position][1]]
+                if self._matches(entry, remaining):
+                    entries.append(entry)
+                    if len(entries) > limit:
+                        break
+
+        next_cursor = None
+        if len(entries) > limit:
+            entries.pop()
+            next_cursor = encode_cursor((entries[-1].run_ts, entries[-1].job_id))
+        return entries, next_cursor
+
+
+job_index = JobIndex()
+
@@ -0,0 +1,241 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from app.config import DISPATCH_EXECUTORS, Config
+from app.scheduler.metadata import MessageMeta
+from app.services.broadcasts import broadcast_store, send_broadcast
+from app.services.circuit_breaker import CircuitOpenError, deferral_delay
+from app.services.credentials import token_vault
+from app.services.outcomes import outcome_store
+from app.services.rate_limiter import RateLimitedError, rate_limiter
+from app.services.whatsapp_service import (
+    send_whatsapp_message,
+    send_whatsapp_message_async,
+)
+from app.utils.logger import setup_logger
+from app.utils.metrics import dispatch_lateness
+
+logger = setup_logger(__name__)
+
+BROADCAST_JOB_PREFIX = "whatsapp_broadcast_"
+
+
+def _observe_lateness(meta):
+    # Returns the run time being sent, for the outcome record
+    if meta is None:
+        return None
+    now = time.time()
+    # A recurring job's meta keeps its first run time; measure against the
+    # occurrence being sent
+    run_ts = meta.recurrence.previous_fire_ts(now) if meta.recurrence else meta.run_ts
+    if run_ts is not None:
+        dispatch_lateness.observe(max(now - run_ts, 0.0))
+    return run_ts
+
+
+def _credential(phone_number_id, auth_token):
+    # Jobs carry a token reference only when their number had no credential
+    auth_token = token_vault.resolve(phone_number_id, auth_token)
+    if auth_token is None:
+        raise ValueError(f"No credential registered for phone_number_id {phone_number_id}")
+    return auth_token
+
+
+def _adopt(phone_number_id, auth_token, result):
+    # A token the API accepted becomes the number's credential if it has none
+    if not (isinstance(result, dict) and "error" in result):
+        token_vault.adopt(phone_number_id, auth_token)
+
+
+def _record_outcome(job_id, run_ts, phone_number_id, result, send, status=None):
+    # Jobs scheduled without an id (before ids were passed to jobs) aren't
+    # looked up later
+    if job_id is not None:
+        outcome_store.record(job_id, run_ts, phone_number_id, result, send, status)
+
+
+def _defer(func, args, job_id, meta, run_ts, error):
+    # Adds a one-off message refused by an open circuit back to run once the
+    # circuit's retry time (with jitter) has passed, and one refused by the
+    # rate limiter back at the slot the limiter gave it. Returns the new run
+    # date, or None when it can't be deferred: recurring messages keep their
+    # own schedule, and nothing waits on a circuit further than
+    # CIRCUIT_MAX_DEFER_SECONDS past its scheduled time.
+    if job_id is None or meta is None or meta.recurrence is not None:
+        return None
+    if isinstance(error, RateLimitedError):
+        run_at = time.time() + error.retry_after
+    else:
+        run_at = time.time() + deferral_delay(error.retry_after)
+        if run_ts is not None and run_at - run_ts > Config.CIRCUIT_MAX_DEFER_SECONDS:
+            return None
+    # Imported here: the scheduler module imports this one
+    from app.scheduler.scheduler import defer_job
+
+    run_date = datetime.fromtimestamp(run_at, timezone.utc)
+    defer_job(func, args, job_id, meta, run_date)
+    return run_date
+
+
+def _deferred(job_id, run_ts, phone_number_id, error, send, run_date):
+    _record_outcome(job_id, run_ts, phone_number_id, {"error": str(error)}, send, "deferred")
+    if run_date is None:
+        logger.error("Failed to execute scheduled message for job %s: %s", job_id, error)
+        return {"error": str(error)}
+    if isinstance(error, RateLimitedError):
+        logger.info("Deferred job %s to %s: %s", job_id, run_date.isoformat(), error)
+    else:
+        logger.warning("Deferred job %s to %s: %s", job_id, run_date.isoformat(), error)
+    return {"deferred": True, "run_date": run_date.isoformat()}
+
+
+def _not_sent(func, args, job_id, meta, run_ts, error, send):
+    # For a send refused by the rate limiter or an open circuit. The job is
+    # deferred if it can be; a recurring message can't be moved without
+    # losing this occurrence, so a rate-limited one waits in its sender's
+    # queue instead, off this worker, and is sent once a token is free.
+    run_date = _defer(func, args, job_id, meta, run_ts, error)
+    if run_date is None and isinstance(error, RateLimitedError):
+        rate_limiter.submit(args[3], _send_message, *args, job_id, meta, run_ts)
+        logger.info("Queued job %s until a token is free: %s", job_id, error)
+        return {"queued": True}
+    return _deferred(job_id, run_ts, args[3], error, send, run_date)
+
+
+def _send_message(
+    phone_number, message_data, auth_token, phone_number_id, job_id, meta, run_ts
+):
+    send = {}
+    try:
+        token = _credential(phone_number_id, auth_token)
+        result = send_whatsapp_message(
+            phone_number=phone_number,
+            message_data=message_data,
+            auth_token=token,
+            phone_number_id=phone_number_id,
+            outcome=send,
+        )
+        logger.info("Scheduled message executed for job %s: %s", job_id, result)
+        _record_outcome(job_id, run_ts, phone_number_id, result, send)
+        _adopt(phone_number_id, token, result)
+        return result
+    except (CircuitOpenError, RateLimitedError) as e:
+        args = (phone_number, message_data, auth_token, phone_number_id)
+        return _not_sent(send_scheduled_message, args, job_id, meta, run_ts, e, send)
+    except Exception as e:
+        logger.error("Failed to execute scheduled message for job %s: %s", job_id, e)
+        _record_outcome(job_id, run_ts, phone_number_id, {"error": str(e)}, send)
+        raise
+
+
+def send_scheduled_message(
+    phone_number, message_data, auth_token, phone_number_id, job_id=None, meta=None
+):
+    run_ts = _observe_lateness(meta)
+    return _send_message(
+        phone_number, message_data, auth_token, phone_number_id, job_id, meta, run_ts
+    )
+
+
+async def send_scheduled_message_async(
+    phone_number, message_data, auth_token, phone_number_id, job_id=None, meta=None
+):
+    run_ts = _observe_lateness(meta)
+    send = {}
+    try:
+        token = _credential(phone_number_id, auth_token)
+        result = await send_whatsapp_message_async(
+            phone_number=phone_number,
+            message_data=message_data,
+            auth_token=token,
+            phone_number_id=phone_number_id,
+            outcome=send,
+        )
+        logger.info("Scheduled message executed for job %s: %s", job_id, result)
+        _record_outcome(job_id, run_ts, phone_number_id, result, send)
+        _adopt(phone_number_id, token, result)
+        return result
+    except (CircuitOpenError, RateLimitedError) as e:
+        # Adding the job back touches the job store; keep it off the event
+        # loop. A queued occurrence is sent from the queue's threads.
+        args = (phone_number, message_data, auth_token, phone_number_id)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, _not_sent, send_scheduled_message_async, args, job_id, meta, run_ts, e, send
+        )
+    except Exception as e:
+        logger.error("Failed to execute scheduled message for job %s: %s", job_id, e)
+        _record_outcome(job_id, run_ts, phone_number_id, {"error": str(e)}, send)
+        raise
+
+
+def send_scheduled_broadcast(broadcast_id, job_id=None, meta=None):
+    _observe_lateness(meta)
+    try:
+        result = send_broadcast(broadcast_id)
+        logger.info("Scheduled broadcast executed for job %s: %s", job_id, result)
+        return result
+    except Exception as e:
+        logger.error("Failed to execute scheduled broadcast for job %s: %s", job_id, e)
+        raise
+
+
+def broadcast_job_def(
+    broadcast_id, run_date, phone_number_id, message_type, campaign=None, priority=None
+):
+    # The one job that sends a broadcast. Broadcasts are bulk sends unless
+    # asked otherwise.
+    job_id = f"{BROADCAST_JOB_PREFIX}{broadcast_id}"
+    meta = MessageMeta(
+        job_id,
+        run_date.timestamp(),
+        None,
+        phone_number_id,
+        message_type,
+        campaign=campaign,
+        priority=priority,
+    )
+    return {
+        "id": job_id,
+        "func": send_scheduled_broadcast,
+        "executor": lane_executor(priority or "bulk"),
+        "trigger": "date",
+        "run_date": run_date,
+        "name": f"WhatsApp broadcast {broadcast_id}",
+        "args": [broadcast_id],
+        "kwargs": {"job_id": job_id, "meta": meta},
+        "misfire_grace_time": 3600,
+        "coalesce": True,
+    }
+
+
+def cancel_broadcasts(job_ids):
+    # Marks the broadcasts of removed jobs cancelled, so they stop taking
+    # recipients and are never sent
+    broadcast_ids = [
+        job_id[len(BROADCAST_JOB_PREFIX):]
+        for job_id in job_ids
+        if job_id.startswith(BROADCAST_JOB_PREFIX)
+    ]
+    if broadcast_ids:
+        broadcast_store.cancel(broadcast_ids)
+
+
+def lane_executor(priority=None):
+    # Executor alias for a priority lane; normal priority uses the dispatch
+    # mode's own executor
+    priority = priority or Config.DEFAULT_PRIORITY
+    if priority in Config.SCHEDULER_EXECUTORS and priority in Config.PRIORITY_LANES:
+        return priority
+    return DISPATCH_EXECUTORS[Config.SCHEDULER_DISPATCH_MODE]
+
+
+def dispatch_options(priority=None):
+    # Job function and executor matching Config.SCHEDULER_DISPATCH_MODE. The
+    # asyncio and batch executors send on an event loop; the lanes' thread
+    # pools can't run a coroutine job.
+    executor = lane_executor(priority)
+    if executor in (DISPATCH_EXECUTORS["asyncio"], DISPATCH_EXECUTORS["batch"]):
+        func = send_scheduled_message_async
+    else:
+        func = send_scheduled_message
+    return {"func": func, "executor": executor}
@@ -0,0 +1,369 @@
+import os
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+from app.config import Config
+from app.scheduler.metadata import MessageMeta, meta_from_job
+from app.scheduler.sharding import shard_key
+
+# SQLite caps the number of bound parameters per statement
+MAX_SQL_PARAMS = 500
+# Due jobs handed to the scheduler per pass. With more due than this the
+# scheduler loops straight back, so a job that falls due during a large
+# burst waits for one pass rather than for the whole burst.
+MAX_DUE_JOBS = 1000
+# Where the job index's fields sit in the meta column (MessageMeta.dumps)
+META_POSITIONS = {"phone_number": 0, "phone_number_id": 1, "campaign": 5}
+
+
+def lane_rank(executor):
+    # Due jobs run in priority lane order; executors that aren't a lane of
+    # their own are normal priority
+    lanes = Config.PRIORITY_LANES
+    return lanes.index(executor if executor in lanes else Config.DEFAULT_PRIORITY)
+
+
+class SQLiteJobStore(BaseJobStore):
+    # Keeps pickled jobs in a local SQLite file. Only due jobs (and single
+    # lookups) are unpickled, so a large backlog is never loaded into memory
+    # as a whole. With ``shard`` set, only jobs whose shard key falls in that
+    # shard (of ``shards``) are ever due; lookups still see every job. Due
+    # jobs come back transactional first, then by run time.
+
+    def __init__(
+        self,
+        path="data/scheduler.db",
+        tablename="apscheduler_jobs",
+        pickle_protocol=pickle.HIGHEST_PROTOCOL,
+        shard=None,
+        shards=1,
+        shard_by="phone_number_id",
+    ):
+        super().__init__()
+        self.path = path
+        self.tablename = tablename
+        self.pickle_protocol = pickle_protocol
+        self.shard = shard
+        self.shards = shards
+        self.shard_by = shard_by
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.tablename} ("
+                "id TEXT NOT NULL PRIMARY KEY, "
+                "next_run_time REAL, "
+                "job_state BLOB NOT NULL, "
+                "meta TEXT, "
+                "shard_key INTEGER, "
+                f"lane INTEGER NOT NULL DEFAULT {lane_rank(None)})"
+            )
+            columns = {
+                row[1]
+                for row in self._conn.execute(f"PRAGMA table_info({self.tablename})")
+            }
+            if "meta" not in columns:
+                self._conn.execute(f"ALTER TABLE {self.tablename} ADD COLUMN meta TEXT")
+            if "shard_key" not in columns:
+                self._conn.execute(
+                    f"ALTER TABLE {self.tablename} ADD COLUMN shard_key INTEGER"
+                )
+            if "lane" not in columns:
+                self._conn.execute(
+                    f"ALTER TABLE {self.tablename} ADD COLUMN lane INTEGER NOT NULL "
+                    f"DEFAULT {lane_rank(None)}"
+                )
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS ix_{self.tablename}_next_run_time "
+                f"ON {self.tablename} (next_run_time)"
+            )
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS ix_{self.tablename}_lane_next_run_time "
+                f"ON {self.tablename} (lane, next_run_time)"
+            )
+            self._fill_shard_keys()
+
+    def lookup_job(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT job_state FROM {self.tablename} WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._reconstitute_job(row[0]) if row else None
+
+    def get_due_jobs(self, now):
+        if self._conn is None:
+            # The scheduler loop can still poll while the store is shut down
+            return []
+        timestamp = datetime_to_utc_timestamp(now)
+        shard_filter, shard_params = self._shard_filter()
+        return self._get_jobs(
+            f"WHERE next_run_time <= ?{shard_filter}",
+            (timestamp,) + shard_params,
+            order="lane, next_run_time",
+            limit=MAX_DUE_JOBS,
+        )
+
+    def count_due(self, lane, until_ts):
+        # Jobs of a lane (by lane_rank) due by ``until_ts``, in every shard
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM {self.tablename} WHERE lane = ? AND next_run_time <= ?",
+                (lane, until_ts),
+            ).fetchone()[0]
+
+    def get_next_run_time(self):
+        if self._conn is None:
+            return None
+        shard_filter, shard_params = self._shard_filter()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT next_run_time FROM {self.tablename} "
+                f"WHERE next_run_time IS NOT NULL{shard_filter} "
+                "ORDER BY next_run_time LIMIT 1",
+                shard_params,
+            ).fetchone()
+        return utc_timestamp_to_datetime(row[0]) if row else None
+
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def add_job(self, job):
+        with self._lock:
+            try:
+                self._conn.execute(
+                    f"INSERT INTO {self.tablename} "
+                    "(id, next_run_time, job_state, meta, shard_key, lane) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    self._job_row(job),
+                )
+            except sqlite3.IntegrityError:
+                raise ConflictingIdError(job.id)
+
+    def update_job(self, job):
+        job_id, next_run_time, job_state, meta, *_ = self._job_row(job)
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE {self.tablename} SET next_run_time = ?, job_state = ?, meta = ? "
+                "WHERE id = ?",
+                (next_run_time, job_state, meta, job_id),
+            )
+        if cursor.rowcount == 0:
+            raise JobLookupError(job.id)
+
+    def remove_job(self, job_id):
+        with self._lock:
+            cursor = self._conn.execute(
+                f"DELETE FROM {self.tablename} WHERE id = ?", (job_id,)
+            )
+        if cursor.rowcount == 0:
+            raise JobLookupError(job_id)
+
+    def remove_jobs(self, job_ids):
+        # Delete many jobs in one transaction; returns the ids that existed
+        with self.transaction():
+            removed = self._existing_ids(list(job_ids))
+            self._conn.executemany(
+                f"DELETE FROM {self.tablename} WHERE id = ?",
+                [(job_id,) for job_id in removed],
+            )
+        return removed
+
+    def modify_jobs(self, job_ids, modify):
+        # Load, change and write back many jobs in one transaction, a chunk
+        # at a time so they're never all in memory. ``modify`` changes the Job
+        # it's given and returns True, or False to leave it as it is. Returns
+        # the ids of the jobs that were changed.
+        job_ids = list(job_ids)
+        modified = []
+        with self.transaction():
+            for start in range(0, len(job_ids), MAX_SQL_PARAMS):
+                chunk = job_ids[start : start + MAX_SQL_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                rows = []
+                for (job_state,) in self._conn.execute(
+                    f"SELECT job_state FROM {self.tablename} WHERE id IN ({placeholders})",
+                    chunk,
+                ).fetchall():
+                    job = self._reconstitute_job(job_state)
+                    if modify(job):
+                        job_id, next_run_time, job_state, meta, *_ = self._job_row(job)
+                        rows.append((next_run_time, job_state, meta, job_id))
+                self._conn.executemany(
+                    f"UPDATE {self.tablename} SET next_run_time = ?, job_state = ?, meta = ? "
+                    "WHERE id = ?",
+                    rows,
+                )
+                modified.extend(row[3] for row in rows)
+        return modified
+
+    @contextmanager
+    def transaction(self):
+        # One write transaction for everything done in the block, including
+        # the batch methods above; writes from other processes wait for it.
+        # Nested blocks join the outer transaction.
+        with self._lock:
+            if self._conn.in_transaction:
+                yield
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def select_metadata(self, filters=None, start_ts=None, end_ts=None):
+        # MessageMeta of the stored jobs matching the same filters and run
+        # time window as JobIndex.select. Reads what every process has
+        # written, not one process's index of it.
+        conditions, params = [], []
+        for field, value in (filters or {}).items():
+            conditions.append(f"json_extract(meta, '$[{META_POSITIONS[field]}]') = ?")
+            params.append(value)
+        if conditions:
+            # Rows written before the meta column existed are checked below
+            conditions = [f"(meta IS NULL OR ({' AND '.join(conditions)}))"]
+        if start_ts is not None:
+            # Paused jobs have no run time and sort after every window start
+            conditions.append("(next_run_time >= ? OR next_run_time IS NULL)")
+            params.append(start_ts)
+        if end_ts is not None:
+            conditions.append("next_run_time <= ?")
+            params.append(end_ts)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return [
+            meta
+            for meta in self._iter_metadata(where, tuple(params))
+            if all(getattr(meta, field) == value for field, value in (filters or {}).items())
+        ]
+
+    def remove_all_jobs(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.tablename}")
+
+    def shutdown(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def iter_metadata(self):
+        # MessageMeta for every stored job, read from the meta column; only
+        # rows written before that column existed need unpickling
+        return self._iter_metadata()
+
+    def _iter_metadata(self, where="", params=()):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, next_run_time, meta FROM {self.tablename} {where} "
+                "ORDER BY next_run_time",
+                params,
+            ).fetchall()
+        for job_id, next_run_time, meta in rows:
+            if meta is not None:
+                yield MessageMeta.loads(job_id, next_run_time, meta)
+                continue
+            job = self.lookup_job(job_id)
+            if job is not None:
+                yield meta_from_job(job)
+
+    def _job_row(self, job):
+        meta = meta_from_job(job)
+        return (
+            job.id,
+            datetime_to_utc_timestamp(job.next_run_time),
+            pickle.dumps(job.__getstate__(), self.pickle_protocol),
+            meta.dumps(),
+            shard_key(meta, self.shard_by),
+            lane_rank(job.executor),
+        )
+
+    def _shard_filter(self):
+        if self.shard is None or self.shards <= 1:
+            return "", ()
+        return " AND shard_key % ? = ?", (self.shards, self.shard)
+
+    def _fill_shard_keys(self):
+        # Rows written before the shard_key column existed
+        rows = [
+            (shard_key(meta, self.shard_by), meta.job_id)
+            for meta in self._iter_metadata("WHERE shard_key IS NULL")
+        ]
+        if rows:
+            self._conn.executemany(
+                f"UPDATE {self.tablename} SET shard_key = ? WHERE id = ?", rows
+            )
+
+    def _existing_ids(self, job_ids):
+        existing = set()
+        for start in range(0, len(job_ids), MAX_SQL_PARAMS):
+            chunk = job_ids[start : start + MAX_SQL_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            existing.update(
+                row[0]
+                for row in self._conn.execute(
+                    f"SELECT id FROM {self.tablename} WHERE id IN ({placeholders})",
+                    chunk,
+                )
+            )
+        return existing
+
+    def _reconstitute_job(self, job_state):
+        job_state = pickle.loads(job_state)
+        job_state["jobstore"] = self
+        job = Job.__new__(Job)
+        job.__setstate__(job_state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _get_jobs(self, where="", params=(), order="next_run_time", limit=-1):
+        jobs = []
+        failed_job_ids = []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, job_state FROM {self.tablename} {where} "
+                f"ORDER BY {order} LIMIT ?",
+                params + (limit,),
+            ).fetchall()
+            for job_id, job_state in rows:
+                try:
+                    jobs.append(self._reconstitute_job(job_state))
+                except BaseException:
+                    self._logger.exception(
+                        'Unable to restore job "%s" -- removing it', job_id
+                    )
+                    failed_job_ids.append(job_id)
+
+            # Remove all the jobs we failed to restore
+            if failed_job_ids:
+                self._conn.executemany(
+                    f"DELETE FROM {self.tablename} WHERE id = ?",
+                    [(job_id,) for job_id in failed_job_ids],
+                )
+
+        return jobs
+
+    def __repr__(self):
+        if self.shard is not None:
+            return f"<{self.__class__.__name__} (path={self.path}, shard={self.shard}/{self.shards})>"
+        return f"<{self.__class__.__name__} (path={self.path})>"
@@ -0,0 +1,140 @@
+import json
+import math
+from app.scheduler.recurrence import Recurrence
+
+
+class MessageMeta:
+    # Compact description of a scheduled message, stored with its job (as the
+    # "meta" keyword argument) and in the job index, so listings never have
+    # to look at the message payload.
+    __slots__ = (
+        "job_id",
+        "run_ts",
+        "phone_number",
+        "phone_number_id",
+        "message_type",
+        "status",
+        "recurrence",
+        "campaign",
+        "priority",
+    )
+
+    def __init__(
+        self,
+        job_id,
+        run_ts,
+        phone_number,
+        phone_number_id,
+        message_type="Unknown",
+        status="scheduled",
+        recurrence=None,
+        campaign=None,
+        priority=None,
+    ):
+        self.job_id = job_id
+        self.run_ts = run_ts
+        self.phone_number = phone_number
+        self.phone_number_id = phone_number_id
+        self.message_type = message_type
+        self.status = status
+        self.recurrence = recurrence
+        self.campaign = campaign
+        self.priority = priority
+
+    def __reduce__(self):
+        return (
+            MessageMeta,
+            (
+                self.job_id,
+                self.run_ts,
+                self.phone_number,
+                self.phone_number_id,
+                self.message_type,
+                self.status,
+                self.recurrence,
+                self.campaign,
+                self.priority,
+            ),
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, MessageMeta) and self.__reduce__() == other.__reduce__()
+
+    def __repr__(self):
+        return f"<MessageMeta {self.job_id} to {self.phone_number}>"
+
+    def with_run_ts(self, run_ts):
+        return MessageMeta(
+            self.job_id,
+            run_ts,
+            self.phone_number,
+            self.phone_number_id,
+            self.message_type,
+            self.status,
+            self.recurrence,
+            self.campaign,
+            self.priority,
+        )
+
+    def dumps(self):
+        # Column value for job stores; job id and run time live in their own
+        # columns already. The optional schedule, campaign tag and priority
+        # are only written up to the last one that is set.
+        fields = [self.phone_number, self.phone_number_id, self.message_type, self.status]
+        optional = [
+            self.recurrence.key() if self.recurrence is not None else None,
+            self.campaign,
+            self.priority,
+        ]
+        while optional and optional[-1] is None:
+            optional.pop()
+        return json.dumps(fields + optional, separators=(",", ":"))
+
+    @classmethod
+    def loads(cls, job_id, run_ts, value):
+        phone_number, phone_number_id, message_type, status, *optional = json.loads(value)
+        recurrence, campaign, priority = (optional + [None, None, None])[:3]
+        return cls(
+            job_id,
+            math.inf if run_ts is None else run_ts,
+            phone_number,
+            phone_number_id,
+            message_type,
+            status,
+            Recurrence(*recurrence) if recurrence else None,
+            campaign,
+            priority,
+        )
+
+
+def build_meta(job_id, run_date, data):
+    message_data = data.get("message_data")
+    return MessageMeta(
+        job_id,
+        run_date.timestamp(),
+        data["phone_number"],
+        data["phone_number_id"],
+        message_data.get("type", "Unknown") if hasattr(message_data, "get") else "Unknown",
+        recurrence=data.get("recurrence"),
+        campaign=str(data["campaign"]) if data.get("campaign") is not None else None,
+        priority=data.get("priority"),
+    )
+
+
+def meta_from_job(job):
+    run_ts = job.next_run_time.timestamp() if job.next_run_time else math.inf
+    meta = job.kwargs.get("meta")
+    if isinstance(meta, MessageMeta):
+        return meta if meta.run_ts == run_ts else meta.with_run_ts(run_ts)
+
+    # Jobs scheduled without metadata (before MessageMeta existed) carry
+    # (phone_number, message_data, auth_token, phone_number_id) as arguments
+    args = job.args
+    message_data = args[1] if len(args) > 1 and hasattr(args[1], "get") else {}
+    return MessageMeta(
+        job.id,
+        run_ts,
+        args[0] if args else None,
+        args[3] if len(args) > 3 else None,
+        message_data.get("type", "Unknown"),
+    )
@@ -0,0 +1,207 @@
+from datetime import datetime
+from functools import lru_cache
+import pytz
+
+# Seconds per unit for {"interval": {"hours": 1, ...}}
+INTERVAL_UNITS = {"weeks": 604800, "days": 86400, "hours": 3600, "minutes": 60, "seconds": 1}
+CRON_FIELDS = ("minute", "hour", "day", "month", "day_of_week")
+# "count" is turned into an end date by walking the schedule once, so it is
+# bounded; longer schedules should give "end_date" instead
+MAX_COUNT = 2000
+# How far back a run can be late and still be matched to its occurrence;
+# the same as the misfire grace time jobs are scheduled with
+LATENESS_HORIZON = 3600
+# Crontab counts weekdays from Sunday (0 or 7); APScheduler's numbers start
+# at Monday, so the field is handed to it as names
+WEEKDAYS = ("sun", "mon", "tue", "wed", "thu", "fri", "sat")
+
+
+def _weekday(value):
+    if value.lower() in WEEKDAYS:
+        return WEEKDAYS.index(value.lower())
+    if not value.isdigit() or int(value) > 7:
+        raise ValueError(f"invalid day of week '{value}'")
+    return int(value) % 7
+
+
+def _crontab_day_of_week(field):
+    # A crontab day-of-week field ("1-5", "0,6", "*/2", "mon-fri") as the
+    # list of weekday names it selects
+    if field == "*":
+        return field
+    days = set()
+    for part in field.split(","):
+        part, _, step = part.partition("/")
+        if (step and not step.isdigit()) or step == "0":
+            raise ValueError(f"invalid step in day of week '{field}'")
+        if part == "*":
+            first, last = 0, 6
+        elif "-" in part:
+            first, last = part.split("-", 1)
+            # 7 is Sunday too, so "5-7" runs Friday to Sunday
+            first, last = _weekday(first), 7 if last == "7" else _weekday(last)
+        else:
+            first = last = _weekday(part)
+            if step:
+                last = 6
+        if first > last:
+            raise ValueError(f"invalid range in day of week '{field}'")
+        days.update(day % 7 for day in range(first, last + 1, int(step or 1)))
+    return ",".join(WEEKDAYS[day] for day in sorted(days))
+
+
+@lru_cache(maxsize=1024)
+def _build_trigger(kind, value, timezone, start_ts, end_ts):
+    # APScheduler's triggers are only loaded once a recurrence is used
+    from apscheduler.triggers.cron import CronTrigger
+    from apscheduler.triggers.interval import IntervalTrigger
+
+    zone = pytz.timezone(timezone)
+    start_date = datetime.fromtimestamp(start_ts, zone)
+    end_date = datetime.fromtimestamp(end_ts, zone) if end_ts is not None else None
+    if kind == "cron":
+        fields = dict(zip(CRON_FIELDS, value.split()))
+        fields["day_of_week"] = _crontab_day_of_week(fields["day_of_week"])
+        return CronTrigger(start_date=start_date, end_date=end_date, timezone=zone, **fields)
+    return IntervalTrigger(seconds=value, start_date=start_date, end_date=end_date, timezone=zone)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _interval_seconds(value):
+    if isinstance(value, dict):
+        if not value or set(value) - set(INTERVAL_UNITS) or not all(map(_is_number, value.values())):
+            raise ValueError(
+                f"recurrence interval must map units ({', '.join(INTERVAL_UNITS)}) to numbers"
+            )
+        value = sum(INTERVAL_UNITS[unit] * amount for unit, amount in value.items())
+    if not _is_number(value) or value <= 0:
+        raise ValueError("recurrence interval must be a positive number of seconds")
+    return value
+
+
+class Recurrence:
+    # A repeating schedule (cron expression or fixed interval, from a start
+    # to an optional end) kept as a few plain values. One job carries it and
+    # its trigger works out each next run on demand, so nothing is stored per
+    # occurrence.
+    __slots__ = ("kind", "value", "timezone", "start_ts", "end_ts")
+
+    def __init__(self, kind, value, timezone, start_ts, end_ts=None):
+        self.kind = kind
+        self.value = value
+        self.timezone = timezone
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+
+    @classmethod
+    def from_request(cls, spec, start_date, timezone):
+        # spec: {"cron": "0 9 * * *"} or {"interval": seconds | {"days": 1}},
+        # plus an optional "end_date" and/or "count"
+        if not isinstance(spec, dict) or ("cron" in spec) == ("interval" in spec):
+            raise ValueError("recurrence must give exactly one of 'cron' or 'interval'")
+
+        if "cron" in spec:
+            value = spec["cron"]
+            if not isinstance(value, str) or len(value.split()) != len(CRON_FIELDS):
+                raise ValueError("recurrence cron must be a five-field crontab expression")
+            kind, value = "cron", " ".join(value.split())
+        else:
+            kind, value = "interval", _interval_seconds(spec["interval"])
+
+        end_ts = None
+        if spec.get("end_date") is not None:
+            try:
+                end_date = datetime.fromisoformat(spec["end_date"])
+            except (TypeError, ValueError):
+                raise ValueError("recurrence end_date must be an ISO 8601 date-time")
+            if not end_date.tzinfo:
+                end_date = pytz.timezone(timezone).localize(end_date)
+            end_ts = end_date.timestamp()
+
+        try:
+            recurrence = cls(kind, value, timezone, start_date.timestamp(), end_ts)
+            first_ts = recurrence.next_fire_ts()
+        except ValueError as e:
+            raise ValueError(f"recurrence {kind} is invalid: {str(e)}")
+        if first_ts is None:
+            raise ValueError("recurrence has no occurrences between schedule_time and end_date")
+
+        count = spec.get("count")
+        if count is not None:
+            if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_COUNT:
+                raise ValueError(f"recurrence count must be between 1 and {MAX_COUNT}")
+            # The schedule ends at its count-th occurrence (or end_date if sooner)
+            last_ts = recurrence.occurrences(first_ts, count)[-1]
+            if end_ts is None or last_ts < end_ts:
+                recurrence = cls(kind, value, timezone, recurrence.start_ts, last_ts)
+        return recurrence
+
+    def key(self):
+        return (self.kind, self.value, self.timezone, self.start_ts, self.end_ts)
+
+    def __reduce__(self):
+        return (Recurrence, self.key())
+
+    def __eq__(self, other):
+        return isinstance(other, Recurrence) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return f"<Recurrence {self.kind} {self.value}>"
+
+    def trigger(self):
+        return _build_trigger(*self.key())
+
+    def next_fire_ts(self, previous_ts=None, now_ts=None):
+        # Same rule the scheduler applies after each run; None once it's over
+        trigger = self.trigger()
+        zone = trigger.timezone
+        previous = datetime.fromtimestamp(previous_ts, zone) if previous_ts is not None else None
+        now = datetime.fromtimestamp(
+            now_ts if now_ts is not None else (previous_ts or self.start_ts), zone
+        )
+        fire_time = trigger.get_next_fire_time(previous, now)
+        return fire_time.timestamp() if fire_time else None
+
+    def occurrences(self, first_ts, count):
+        # first_ts (a run time of this schedule) and the ones after it
+        occurrences = [first_ts]
+        while len(occurrences) < count:
+            next_ts = self.next_fire_ts(occurrences[-1])
+            if next_ts is None:
+                break
+            occurrences.append(next_ts)
+        return occurrences
+
+    def previous_fire_ts(self, now_ts):
+        # The latest run time at or before now_ts, for measuring how late a
+        # run started. Looks back over windows that double in size, so a run
+        # on time costs one trigger evaluation.
+        window = 1.0
+        while window <= LATENESS_HORIZON * 2:
+            fire_ts = self.next_fire_ts(None, max(now_ts - window, self.start_ts))
+            if fire_ts is not None and fire_ts <= now_ts:
+                next_ts = self.next_fire_ts(fire_ts)
+                while next_ts is not None and next_ts <= now_ts:
+                    fire_ts, next_ts = next_ts, self.next_fire_ts(next_ts)
+                return fire_ts
+            window *= 2
+        return None
+
+    def to_dict(self):
+        zone = pytz.timezone(self.timezone)
+        return {
+            self.kind: self.value,
+            "timezone": self.timezone,
+            "start": datetime.fromtimestamp(self.start_ts, zone).isoformat(),
+            "end_date": (
+                datetime.fromtimestamp(self.end_ts, zone).isoformat()
+                if self.end_ts is not None
+                else None
+            ),
+        }
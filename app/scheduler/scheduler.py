@@ -1,27 +1,440 @@
+import math
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
 from flask_apscheduler import APScheduler
-from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+from apscheduler.events import (
+    EVENT_ALL_JOBS_REMOVED,
+    EVENT_JOB_ADDED,
+    EVENT_JOB_EXECUTED,
+    EVENT_JOB_ERROR,
+    EVENT_JOB_MAX_INSTANCES,
+    EVENT_JOB_MISSED,
+    EVENT_JOB_REMOVED,
+    EVENT_JOB_SUBMITTED,
+)
+from apscheduler.jobstores.base import ConflictingIdError, JobLookupError
+from apscheduler.schedulers.base import STATE_RUNNING, STATE_STOPPED
+from apscheduler.triggers.date import DateTrigger
+from app.config import Config
+from app.scheduler.job_index import INDEX_EVENTS, job_index
+from app.scheduler.jobs import broadcast_job_def, lane_executor
+from app.scheduler.jobstores import lane_rank
+from app.scheduler.metadata import MessageMeta, meta_from_job
+from app.scheduler.sharding import shard_key, start_poller
+from app.services.broadcasts import broadcast_store
+from app.services.cache import TTLCache
+from app.services.outcomes import outcome_store
 from app.utils.logger import setup_logger
+from app.utils.metrics import Counter, Gauge
+from app.utils.profiling import TimedLock
 
-logger = setup_logger()
+logger = setup_logger(__name__)
 scheduler = APScheduler()
 
+jobs_scheduled = Counter("whatsapp_jobs_scheduled_total", "Jobs added to the scheduler")
+jobs_executed = Counter(
+    "whatsapp_jobs_executed_total", "Job runs that completed without an error"
+)
+jobs_failed = Counter(
+    "whatsapp_jobs_failed_total",
+    "Job runs that raised or got an error back from the send path",
+)
+jobs_misfired = Counter(
+    "whatsapp_jobs_misfired_total", "Job runs skipped after missing their grace time"
+)
+jobs_deferred = Counter(
+    "whatsapp_jobs_deferred_total",
+    "One-off jobs pushed back because their endpoint's circuit was open",
+)
+admission_rejected = Counter(
+    "whatsapp_admission_rejected_total",
+    "Messages refused because their priority lane's backlog was full",
+    ("lane",),
+)
+
+SCHEDULER_ROLES = ("all", "api", "dispatcher")
+SCHEDULER_STARTS = ("eager", "lazy")
+
+_start_lock = threading.Lock()
+_start_config = None
+
 def init_scheduler(app):
     try:
+        role = app.config["SCHEDULER_ROLE"]
+        if role not in SCHEDULER_ROLES:
+            raise ValueError(f"SCHEDULER_ROLE must be one of: {', '.join(SCHEDULER_ROLES)}")
+        if role != "all" and app.config["SCHEDULER_JOBSTORE"] == "memory":
+            raise ValueError(f"The '{role}' role needs the shared sqlite job store")
+        start = app.config["SCHEDULER_START"]
+        if start not in SCHEDULER_STARTS:
+            raise ValueError(f"SCHEDULER_START must be one of: {', '.join(SCHEDULER_STARTS)}")
+
         # Initialize scheduler with app config
         scheduler.init_app(app)
-        
+        if app.config["REQUEST_TIMING"]:
+            # Requests that add or change jobs wait for this lock while the
+            # scheduler processes due jobs
+            base = scheduler.scheduler
+            base._jobstores_lock = TimedLock(base._jobstores_lock, "jobstore_lock")
+
         # Add event listeners
         scheduler.add_listener(job_executed_event, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
-        
-        # Start the scheduler
-        scheduler.start()
-        logger.info("Scheduler started successfully")
+        scheduler.add_listener(job_index_event, INDEX_EVENTS)
+        scheduler.add_listener(
+            job_metrics_event,
+            EVENT_JOB_ADDED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED,
+        )
+
+        global _start_config
+        _start_config = app.config
+        if start == "eager":
+            start_scheduler()
+        else:
+            logger.info("Scheduler start deferred until first use in '%s' role", role)
     except Exception as e:
-        logger.error(f"Error initializing scheduler: {str(e)}", exc_info=True)
+        logger.error("Error initializing scheduler: %s", e, exc_info=True)
         raise e
 
+def start_scheduler():
+    # Starts the scheduler initialized by init_scheduler, once; later calls
+    # return straight away. With SCHEDULER_START=lazy the scheduling routes
+    # call it on their first request, so an API process that never schedules
+    # anything never opens the job store or starts its threads.
+    if scheduler.running:
+        return
+    with _start_lock:
+        if scheduler.running:
+            return
+        config = _start_config
+        role = config["SCHEDULER_ROLE"]
+        started = time.perf_counter()
+
+        # Start the scheduler. API workers only add jobs to the shared store,
+        # so theirs never processes jobs; dispatchers run them
+        scheduler.start(paused=role == "api")
+
+        # Jobs already in a persistent store don't produce add events
+        rebuild_job_index()
+        logger.info("Indexed %s scheduled jobs", len(job_index))
+
+        if role != "api":
+            resume_broadcasts()
+
+        if role == "dispatcher":
+            start_poller(
+                scheduler.scheduler.wakeup,
+                config["SCHEDULER_POLL_SECONDS"],
+                "scheduler-poller",
+            )
+        elif role == "api":
+            # Jobs run (and removed) by dispatchers, or added by other API
+            # workers, only show up in this process's index after a reload
+            start_poller(
+                rebuild_job_index,
+                config["SCHEDULER_INDEX_REFRESH_SECONDS"],
+                "job-index-refresh",
+            )
+        logger.info(
+            "Scheduler started successfully in '%s' role in %.0fms",
+            role, (time.perf_counter() - started) * 1000,
+        )
+
+def resume_broadcasts():
+    # Broadcasts a stopped process left sending are marked interrupted and
+    # scheduled again to run now, carrying on after the last recipient
+    # recorded. Runs when a process that runs jobs starts. A dispatcher only
+    # takes the broadcasts of its own shard: it holds the shard's lock, so
+    # the process that was sending them has exited.
+    options = Config.SCHEDULER_JOBSTORES["default"]
+    shard, shards = options.get("shard"), options.get("shards", 1)
+    run_date = datetime.now(timezone.utc)
+    for broadcast_id in broadcast_store.unfinished():
+        broadcast = broadcast_store.get(broadcast_id, with_payload=True)
+        job_def = broadcast_job_def(
+            broadcast_id,
+            run_date,
+            broadcast["phone_number_id"],
+            broadcast["message_data"].get("type", "Unknown"),
+        )
+        meta = job_def["kwargs"]["meta"]
+        if shard is not None and shard_key(meta, options["shard_by"]) % shards != shard:
+            continue
+        broadcast_store.interrupt(broadcast_id)
+        try:
+            scheduler.add_job(**job_def)
+        except ConflictingIdError:
+            # Resumed at an earlier start and not run yet
+            continue
+        logger.warning("Resuming interrupted broadcast %s", broadcast_id)
+
+# Set on the thread running add_jobs while it adds its batch
+_batch = threading.local()
+
+def add_jobs(job_defs, jobstore="default"):
+    # Add many jobs with the scheduler's own add_job() under a single job
+    # store lock and, where the store supports it, in one transaction, so a
+    # batch is committed to disk once. The jobs are indexed in one pass
+    # before the lock is released, so none can run first. Returns one entry
+    # per definition: the added Job or the exception that kept it out of the
+    # job store.
+    base = scheduler.scheduler
+    results = []
+    added = []
+    with base._jobstores_lock:
+        store = base._lookup_jobstore(jobstore)
+        if base.state != STATE_STOPPED and hasattr(store, "transaction"):
+            transaction = store.transaction()
+        else:
+            transaction = nullcontext()
+        _batch.adding = True
+        try:
+            with transaction:
+                for job_def in job_defs:
+                    try:
+                        job = base.add_job(jobstore=jobstore, **job_def)
+                    except Exception as e:
+                        results.append(e)
+                        continue
+                    results.append(job)
+                    added.append(job)
+        finally:
+            _batch.adding = False
+        if base.state != STATE_STOPPED:
+            # Jobs added while stopped are only stored (and indexed) on start
+            job_index.update_many(meta_from_job(job) for job in added)
+
+    logger.info("Added %s jobs to job store '%s' in one batch", len(added), jobstore)
+    return results
+
+def rescheduled_changes(job, run_date, trigger=None):
+    # Job changes that move a one-off job to run_date. The stored metadata
+    # moves with it so lateness is still measured from the new time.
+    changes = {"trigger": trigger or DateTrigger(run_date), "next_run_time": run_date}
+    meta = job.kwargs.get("meta")
+    if isinstance(meta, MessageMeta):
+        changes["kwargs"] = {**job.kwargs, "meta": meta.with_run_ts(run_date.timestamp())}
+    return changes
+
+def defer_job(func, args, job_id, meta, run_date):
+    # Adds a message job that was just run back under its own id, so it can
+    # still be looked up, cancelled or moved. Called from the job itself; the
+    # scheduler has removed it by the time the job store lock is free. The
+    # metadata keeps the original run time, which lateness is measured from.
+    scheduler.add_job(
+        id=job_id,
+        name=f"WhatsApp message to {meta.phone_number}",
+        func=func,
+        trigger="date",
+        run_date=run_date,
+        args=list(args),
+        kwargs={"job_id": job_id, "meta": meta},
+        executor=lane_executor(meta.priority),
+        misfire_grace_time=3600,
+        coalesce=True,
+        replace_existing=True,
+    )
+    jobs_deferred.inc()
+
+@contextmanager
+def select_jobs(filters=None, start_ts=None, end_ts=None, jobstore="default"):
+    # Yields the MessageMeta of the jobs matching the filters and run time
+    # window, holding the job store lock and, where the store supports it,
+    # one transaction until the block ends. remove_jobs and reschedule_jobs
+    # called in the block join both, so a bulk change acts on the jobs as
+    # they are in the shared store, not as this process last indexed them.
+    base = scheduler.scheduler
+    with base._jobstores_lock:
+        store = base._lookup_jobstore(jobstore)
+        if hasattr(store, "select_metadata"):
+            with store.transaction():
+                yield store.select_metadata(filters, start_ts, end_ts)
+        else:
+            # Only this process writes to the store, so its index is current
+            yield job_index.select(filters, start_ts, end_ts)
+
+def remove_jobs(job_ids, jobstore="default"):
+    # Remove many jobs under a single job store lock, in one transaction
+    # where the store supports it. The index is updated in one pass instead
+    # of through a removal event per job. Returns the ids that were removed.
+    base = scheduler.scheduler
+    with base._jobstores_lock:
+        store = base._lookup_jobstore(jobstore)
+        if hasattr(store, "remove_jobs"):
+            removed = store.remove_jobs(job_ids)
+        else:
+            removed = []
+            for job_id in job_ids:
+                try:
+                    store.remove_job(job_id)
+                except JobLookupError:
+                    continue
+                removed.append(job_id)
+        job_index.update_many(removed=removed)
+
+    logger.info("Removed %s jobs from job store '%s' in one batch", len(removed), jobstore)
+    return removed
+
+def reschedule_jobs(run_dates, jobstore="default"):
+    # Move many one-off jobs, {job_id: new run date}, the same way: one
+    # transaction where the store supports it and one index update. Recurring
+    # jobs are left alone. Returns the ids that were moved.
+    base = scheduler.scheduler
+    triggers = {}
+
+    def modify(job):
+        if not isinstance(job.trigger, DateTrigger):
+            return False
+        run_date = run_dates[job.id]
+        trigger = triggers.get(run_date)
+        if trigger is None:
+            trigger = triggers[run_date] = DateTrigger(run_date)
+        changes = rescheduled_changes(job, run_date, trigger)
+        # Passing kwargs to _modify() re-inspects the function signature of
+        # every job; only the meta entry changes
+        if "kwargs" in changes:
+            job.kwargs["meta"] = changes.pop("kwargs")["meta"]
+        job._modify(**changes)
+        return True
+
+    with base._jobstores_lock:
+        store = base._lookup_jobstore(jobstore)
+        if hasattr(store, "modify_jobs"):
+            moved = store.modify_jobs(run_dates, modify)
+        else:
+            moved = []
+            for job_id in run_dates:
+                job = store.lookup_job(job_id)
+                if job is not None and modify(job):
+                    store.update_job(job)
+                    moved.append(job_id)
+        entries = []
+        for job_id in moved:
+            entry = job_index.get(job_id)
+            if entry is not None:
+                entries.append(entry.with_run_ts(run_dates[job_id].timestamp()))
+        job_index.update_many(entries)
+
+    logger.info("Rescheduled %s jobs in job store '%s' in one batch", len(moved), jobstore)
+    if moved and base.state == STATE_RUNNING:
+        base.wakeup()
+    return moved
+
+def rebuild_job_index():
+    store = scheduler.scheduler._lookup_jobstore("default")
+    if hasattr(store, "iter_metadata"):
+        # Read the metadata columns only, without unpickling every job
+        job_index.rebuild(store.iter_metadata())
+    else:
+        job_index.rebuild(meta_from_job(job) for job in scheduler.get_jobs())
+
 def job_executed_event(event):
     if event.exception:
-        logger.error(f'Job {event.job_id} failed: {str(event.exception)}')
+        logger.error('Job %s failed: %s', event.job_id, event.exception)
+    else:
+        logger.info('Job %s completed successfully', event.job_id)
+
+def job_metrics_event(event):
+    if event.code == EVENT_JOB_ADDED:
+        jobs_scheduled.inc()
+    elif event.code == EVENT_JOB_MISSED:
+        jobs_misfired.inc()
+        # Never sent, so the job function never recorded anything
+        entry = job_index.get(event.job_id)
+        outcome_store.record(
+            event.job_id,
+            event.scheduled_run_time.timestamp(),
+            entry.phone_number_id if entry is not None else None,
+            None,
+            status="missed",
+        )
+    elif isinstance(event.retval, dict) and event.retval.get("deferred"):
+        # Counted in jobs_deferred; it runs again later
+        return
+    elif event.exception is not None or (
+        isinstance(event.retval, dict) and "error" in event.retval
+    ):
+        jobs_failed.inc()
+    else:
+        jobs_executed.inc()
+
+def _executor_capacity(executor):
+    for attribute in ("max_workers", "max_concurrency"):
+        if hasattr(executor, attribute):
+            return getattr(executor, attribute)
+    # APScheduler's own thread and process pool executors
+    return getattr(getattr(executor, "_pool", None), "_max_workers", 0)
+
+# Due job counts per lane executor, for API workers
+_due_counts = TTLCache(len(Config.PRIORITY_LANES), Config.ADMISSION_REFRESH_SECONDS)
+
+def _count_due(alias):
+    store = scheduler.scheduler._lookup_jobstore("default")
+    return store.count_due(lane_rank(alias), time.time() + Config.ADMISSION_WINDOW_SECONDS)
+
+def lane_backlog(priority):
+    # Runs of the lane waiting on a dispatcher. A process that dispatches
+    # counts runs submitted to the lane's executor and not finished yet; a
+    # one-off job has at most one run in flight, so this is the size of the
+    # executor's per-job instance map rather than a sum over it. API
+    # workers dispatch nothing and count the lane's jobs in the shared
+    # store due within ADMISSION_WINDOW_SECONDS instead.
+    alias = lane_executor(priority)
+    if Config.SCHEDULER_ROLE == "api":
+        return _due_counts.get_or_load(alias, lambda: _count_due(alias))
+    executor = scheduler.scheduler._executors.get(alias)
+    return len(executor._instances) if executor is not None else 0
+
+def lane_is_full(priority):
+    priority = priority or Config.DEFAULT_PRIORITY
+    return lane_backlog(priority) >= Config.LANE_MAX_BACKLOG.get(priority, math.inf)
+
+def _executor_load():
+    # Submitted but unfinished runs per executor, against how many it can
+    # work on at once; the rest are waiting in its queue
+    for alias, executor in list(scheduler.scheduler._executors.items()):
+        in_flight = sum(list(executor._instances.values()))
+        yield alias, in_flight, _executor_capacity(executor)
+
+Gauge(
+    "whatsapp_executor_queue_depth",
+    "Job runs submitted to an executor and waiting for a free worker",
+    ("executor",),
+    lambda: {(alias,): max(in_flight - capacity, 0) for alias, in_flight, capacity in _executor_load()},
+)
+Gauge(
+    "whatsapp_executor_busy_workers",
+    "Executor workers currently running a job",
+    ("executor",),
+    lambda: {(alias,): min(in_flight, capacity) for alias, in_flight, capacity in _executor_load()},
+)
+Gauge(
+    "whatsapp_jobs_pending",
+    "Scheduled jobs waiting to run",
+    collect=lambda: {(): len(job_index)},
+)
+
+def job_index_event(event):
+    if event.code == EVENT_ALL_JOBS_REMOVED:
+        job_index.clear()
+    elif event.code == EVENT_JOB_REMOVED:
+        job_index.remove(event.job_id)
+    elif event.code == EVENT_JOB_ADDED and getattr(_batch, "adding", False):
+        # add_jobs indexes its whole batch in one pass
+        return
+    elif event.code in (EVENT_JOB_SUBMITTED, EVENT_JOB_MAX_INSTANCES):
+        # After a run the scheduler stores a recurring job's next run time
+        # with update_job(), which sends no event. Work out the same next run
+        # from the schedule instead of loading the job back.
+        entry = job_index.get(event.job_id)
+        if entry is not None and entry.recurrence is not None:
+            next_ts = entry.recurrence.next_fire_ts(
+                event.scheduled_run_times[-1].timestamp(), time.time()
+            )
+            if next_ts is not None:
+                job_index.add(entry.with_run_ts(next_ts))
     else:
-        logger.info(f'Job {event.job_id} completed successfully')
\ No newline at end of file
+        job = scheduler.get_job(event.job_id, event.jobstore)
+        if job is not None:
+            job_index.add(meta_from_job(job))
@@ -0,0 +1,91 @@
+import fcntl
+import glob
+import os
+import threading
+import zlib
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def shard_key(meta, shard_by="phone_number_id"):
+    # Stable hash stored with each job; a dispatcher owning shard i of N
+    # runs the jobs whose key % N == i. Hashing by phone_number_id keeps
+    # every sender's jobs (and so its rate limit bucket) in one process.
+    value = getattr(meta, shard_by, None) if shard_by != "job_id" else None
+    if value is None:
+        value = meta.job_id
+    return zlib.crc32(str(value).encode("utf-8"))
+
+
+def _lock_path(db_path, shard):
+    return f"{db_path}.shard{shard}.lock"
+
+
+def _layout_path(db_path):
+    return f"{db_path}.layout.lock"
+
+
+def _is_locked(path):
+    with open(path, "a+") as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(handle, fcntl.LOCK_UN)
+        return False
+
+
+def acquire_shard(db_path, shard, shards):
+    # Take the exclusive lock for this shard, so no two dispatchers ever
+    # run the same jobs. The lock is held until the process exits.
+    if not 0 <= shard < shards:
+        raise ValueError(f"Shard must be between 0 and {shards - 1}")
+
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # Starting dispatchers check the layout and take their shard one at a
+    # time, so two started together with different shard counts can't both
+    # pass the check before either has written its count
+    with open(_layout_path(db_path), "a+") as layout_lock:
+        fcntl.flock(layout_lock, fcntl.LOCK_EX)
+
+        # Dispatchers started with a different shard count would own
+        # overlapping slices of the jobs
+        for path in glob.glob(_lock_path(db_path, "*")):
+            with open(path) as handle:
+                layout = handle.read().strip()
+            if layout and layout != str(shards) and _is_locked(path):
+                raise RuntimeError(
+                    f"A dispatcher using {layout} shards is still running ({path})"
+                )
+
+        handle = open(_lock_path(db_path, shard), "a+")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            raise RuntimeError(f"Shard {shard} is already owned by another dispatcher")
+        handle.truncate(0)
+        handle.write(str(shards))
+        handle.flush()
+    logger.info("Acquired shard %s of %s", shard, shards)
+    return handle
+
+
+def start_poller(callback, interval, name):
+    # Other processes add jobs to the shared job store without waking this
+    # one, so check back periodically
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                callback()
+            except Exception as e:
+                logger.error("%s failed: %s", name, e, exc_info=True)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return stop
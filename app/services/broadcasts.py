@@ -0,0 +1,442 @@
+import codecs
+import csv
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from app.config import Config
+from app.services.circuit_breaker import CircuitOpenError, deferral_delay
+from app.services.credentials import token_vault
+from app.services.outcomes import outcome_store
+from app.services.rate_limiter import RateLimitedError, rate_limiter
+from app.services.whatsapp_service import send_whatsapp_message
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# E.164 allows at most 15 digits; anything under 8 can't be a mobile number
+MIN_PHONE_DIGITS = 8
+MAX_PHONE_DIGITS = 15
+_SEPARATORS = str.maketrans("", "", " -().\t")
+# Recipients inserted per statement during an upload, and sent per page
+UPLOAD_BATCH_SIZE = 10000
+SEND_PAGE_SIZE = 1000
+# Sends between progress records; at most this many (plus those in flight)
+# go out twice when an interrupted broadcast is resumed
+PROGRESS_EVERY = 100
+MAX_INVALID_SAMPLES = 10
+
+
+class BroadcastClosedError(ValueError):
+    # Recipients can't be added once a broadcast has started sending
+    pass
+
+
+def normalize_phone(value):
+    # Digits-only international number, as the WhatsApp API expects it,
+    # returned as an int so it is stored compactly; None if it can't be one
+    if isinstance(value, str):
+        number = value[1:] if value.startswith("+") else value
+        if not (number.isdigit() and number.isascii()) or number.startswith("0"):
+            # Separators people write numbers with, and a "00" exit code
+            number = value.translate(_SEPARATORS)
+            if number.startswith("+"):
+                number = number[1:]
+            elif number.startswith("00"):
+                number = number[2:]
+            if not (number.isdigit() and number.isascii()):
+                return None
+    elif isinstance(value, int) and not isinstance(value, bool):
+        number = str(value)
+    else:
+        return None
+    if not MIN_PHONE_DIGITS <= len(number) <= MAX_PHONE_DIGITS or number[0] == "0":
+        return None
+    return int(number)
+
+
+def _iter_lines(stream, chunk_size=64 * 1024):
+    # Decoded lines (with their line endings) read a chunk at a time, so an
+    # upload is never held in memory as a whole
+    reader = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    while True:
+        chunk = stream.read(chunk_size)
+        text = pending + reader.decode(chunk, final=not chunk)
+        if not chunk:
+            if text:
+                yield text
+            return
+        lines = text.splitlines(keepends=True)
+        # A line is only complete once its "\n" is in; this also keeps a
+        # "\r\n" split across two chunks together
+        pending = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        yield from lines
+
+
+def iter_csv_recipients(stream, column="phone_number"):
+    # (line number, raw value) for each row. The first row is a header when
+    # it names ``column``; otherwise every row is a number in its first cell.
+    rows = csv.reader(_iter_lines(stream))
+    first = next(rows, None)
+    if first is None:
+        return
+    header = [cell.strip().lower() for cell in first]
+    if column.lower() in header:
+        position = header.index(column.lower())
+    elif first and normalize_phone(first[0]) is not None:
+        position = 0
+        yield 1, first[0]
+    else:
+        raise ValueError(f"CSV header has no '{column}' column")
+    for row in rows:
+        yield rows.line_num, row[position] if len(row) > position else None
+
+
+def iter_ndjson_recipients(stream, column="phone_number"):
+    # One number (a JSON string or integer) or object per line
+    for line_number, line in enumerate(_iter_lines(stream), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            yield line_number, line
+            continue
+        yield line_number, value.get(column) if isinstance(value, dict) else value
+
+
+class BroadcastStore:
+    # Broadcasts in a local SQLite file: one row with the shared payload and
+    # credentials per broadcast, and a (broadcast, phone number) row per
+    # recipient whose primary key does the deduplication.
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @property
+    def conn(self):
+        with self._lock:
+            if self._conn is None:
+                conn = self._connect()
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS broadcasts ("
+                    "seq INTEGER PRIMARY KEY, "
+                    "id TEXT NOT NULL UNIQUE, "
+                    "created_ts REAL NOT NULL, "
+                    "run_ts REAL NOT NULL, "
+                    "phone_number_id TEXT NOT NULL, "
+                    "auth_token TEXT NOT NULL, "
+                    "message_data BLOB NOT NULL, "
+                    "status TEXT NOT NULL, "
+                    "recipients INTEGER NOT NULL DEFAULT 0, "
+                    "sent INTEGER NOT NULL DEFAULT 0, "
+                    "failed INTEGER NOT NULL DEFAULT 0, "
+                    "last_recipient INTEGER NOT NULL DEFAULT 0)"
+                )
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(broadcasts)")}
+                if "last_recipient" not in columns:
+                    conn.execute(
+                        "ALTER TABLE broadcasts ADD COLUMN last_recipient INTEGER NOT NULL DEFAULT 0"
+                    )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS broadcast_recipients ("
+                    "broadcast INTEGER NOT NULL, "
+                    "phone_number INTEGER NOT NULL, "
+                    "PRIMARY KEY (broadcast, phone_number)) WITHOUT ROWID"
+                )
+                self._conn = conn
+            return self._conn
+
+    def create(self, broadcast_id, run_ts, phone_number_id, auth_token, message_data):
+        # ``auth_token`` is what token_vault.reference() gave for the token:
+        # None for the phone number's credential, or a reference
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO broadcasts (id, created_ts, run_ts, phone_number_id, "
+                "auth_token, message_data, status) VALUES (?, ?, ?, ?, ?, ?, 'scheduled')",
+                (
+                    broadcast_id,
+                    time.time(),
+                    run_ts,
+                    phone_number_id,
+                    # The column predates the token vault and can't be NULL
+                    auth_token or "",
+                    pickle.dumps(message_data, pickle.HIGHEST_PROTOCOL),
+                ),
+            )
+
+    def get(self, broadcast_id, with_payload=False):
+        columns = (
+            "seq, id, created_ts, run_ts, phone_number_id, status, recipients, sent, failed, "
+            "last_recipient"
+        )
+        if with_payload:
+            columns += ", auth_token, message_data"
+        with self._lock:
+            cursor = self.conn.execute(f"SELECT {columns} FROM broadcasts WHERE id = ?", (broadcast_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        broadcast = dict(zip((column[0] for column in cursor.description), row))
+        if with_payload:
+            broadcast["message_data"] = pickle.loads(broadcast["message_data"])
+        return broadcast
+
+    def add_recipients(self, broadcast_id, values):
+        # Normalizes, deduplicates and stores (line number, value) pairs in
+        # one transaction on its own connection, so a long upload doesn't hold
+        # up other requests. Recipients can only be added before sending.
+        # Numbers are appended to a temporary table as they stream in, then
+        # merged in key order with one INSERT, which is far cheaper than
+        # inserting them into the primary key in upload order.
+        received = added = invalid = 0
+        samples = []
+        self.conn  # creates the tables on first use
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT seq, status FROM broadcasts WHERE id = ?", (broadcast_id,)
+            ).fetchone()
+            if row is None:
+                raise LookupError(broadcast_id)
+            seq, status = row
+            if status != "scheduled":
+                raise BroadcastClosedError(f"Broadcast is already {status}")
+
+            conn.execute("CREATE TEMP TABLE upload (phone_number INTEGER NOT NULL)")
+            batch = []
+            for line_number, value in values:
+                received += 1
+                number = normalize_phone(value)
+                if number is None:
+                    invalid += 1
+                    if len(samples) < MAX_INVALID_SAMPLES:
+                        samples.append({"line": line_number, "value": str(value)[:64]})
+                    continue
+                batch.append(number)
+                if len(batch) >= UPLOAD_BATCH_SIZE:
+                    self._stage(conn, batch)
+                    batch = []
+            if batch:
+                self._stage(conn, batch)
+            added = conn.execute(
+                "INSERT OR IGNORE INTO broadcast_recipients (broadcast, phone_number) "
+                "SELECT ?, phone_number FROM temp.upload ORDER BY phone_number",
+                (seq,),
+            ).rowcount
+
+            conn.execute(
+                "UPDATE broadcasts SET recipients = recipients + ? WHERE seq = ?", (added, seq)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return {
+            "received": received,
+            "added": added,
+            "duplicates": received - invalid - added,
+            "invalid": invalid,
+            "invalid_samples": samples,
+        }
+
+    @staticmethod
+    def _stage(conn, numbers):
+        # One statement per batch; json_each unpacks it inside SQLite
+        conn.execute(
+            "INSERT INTO temp.upload SELECT value FROM json_each(?)", (json.dumps(numbers),)
+        )
+
+    def start(self, broadcast_id):
+        # Marks a scheduled or interrupted broadcast as sending and returns it
+        # with its payload; None if it doesn't exist, was cancelled or is
+        # already being sent
+        with self._lock:
+            cursor = self.conn.execute(
+                "UPDATE broadcasts SET status = 'sending' "
+                "WHERE id = ? AND status IN ('scheduled', 'interrupted')",
+                (broadcast_id,),
+            )
+        if cursor.rowcount == 0:
+            return None
+        return self.get(broadcast_id, with_payload=True)
+
+    def cancel(self, broadcast_ids):
+        # Broadcasts whose job was cancelled before it ran
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE broadcasts SET status = 'cancelled' WHERE id = ? AND status = 'scheduled'",
+                [(broadcast_id,) for broadcast_id in broadcast_ids],
+            )
+
+    def unfinished(self):
+        # Broadcasts left sending by a process that stopped, and those
+        # already marked interrupted but not resumed yet
+        with self._lock:
+            return [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT id FROM broadcasts WHERE status IN ('sending', 'interrupted')"
+                )
+            ]
+
+    def interrupt(self, broadcast_id):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE broadcasts SET status = 'interrupted' WHERE id = ? AND status = 'sending'",
+                (broadcast_id,),
+            )
+
+    def iter_recipient_pages(self, seq, after=0, page_size=SEND_PAGE_SIZE):
+        # Recipients in number order, starting after ``after``
+        while True:
+            with self._lock:
+                page = [
+                    row[0]
+                    for row in self.conn.execute(
+                        "SELECT phone_number FROM broadcast_recipients "
+                        "WHERE broadcast = ? AND phone_number > ? "
+                        "ORDER BY phone_number LIMIT ?",
+                        (seq, after, page_size),
+                    )
+                ]
+            if not page:
+                return
+            yield page
+            after = page[-1]
+
+    def record_progress(self, seq, sent, failed, last_recipient=None, status=None):
+        # Counts and the last recipient they cover are written together, so
+        # a resumed broadcast carries on from a consistent point
+        with self._lock:
+            self.conn.execute(
+                "UPDATE broadcasts SET sent = sent + ?, failed = failed + ?, "
+                "last_recipient = COALESCE(?, last_recipient), "
+                "status = COALESCE(?, status) WHERE seq = ?",
+                (sent, failed, last_recipient, status, seq),
+            )
+
+
+broadcast_store = BroadcastStore(Config.BROADCAST_DB_PATH)
+
+
+def _outcome(future):
+    # Follows a send that was queued again until it has a result
+    result = future.result()
+    while isinstance(result, Future):
+        result = result.result()
+    return result
+
+
+def send_broadcast(broadcast_id):
+    # Sends the broadcast's payload to every recipient, a page at a time.
+    # Each page's recipients wait in the rate limiter's queue for their
+    # phone_number_id and are sent by its workers as tokens free up, so no
+    # thread sleeps on the rate limit. An interrupted broadcast carries on
+    # after the last recipient recorded. Each recipient's send is recorded in
+    # the outcome history under "<broadcast_id>:<number>".
+    broadcast = broadcast_store.start(broadcast_id)
+    if broadcast is None:
+        logger.warning("Broadcast %s not found, cancelled or already started", broadcast_id)
+        return {"broadcast_id": broadcast_id, "sent": 0, "failed": 0}
+
+    seq = broadcast["seq"]
+    message_data = broadcast["message_data"]
+    auth_token = broadcast["auth_token"]
+    phone_number_id = broadcast["phone_number_id"]
+    # Recipients can't be handed back to the scheduler one by one, so sends
+    # refused by an open circuit go back in the queue until it should have
+    # closed. Once the circuit has refused everything for
+    # CIRCUIT_MAX_DEFER_SECONDS, the remaining sends fail instead.
+    blocked_since = [None]
+
+    def failed(number, error, outcome):
+        logger.error("Broadcast %s send to %s failed: %s", broadcast_id, number, error)
+        record(number, {"error": str(error)}, outcome)
+        return False
+
+    def record(number, result, outcome):
+        # Buffered by the outcome store and written in batches
+        outcome_store.record(f"{broadcast_id}:{number}", None, phone_number_id, result, outcome)
+
+    def send(number):
+        # True or False, or the Future of the send queued again
+        # Looked up per send, so a rotation applies mid-broadcast
+        token = token_vault.resolve(phone_number_id, auth_token)
+        outcome = {}
+        try:
+            result = send_whatsapp_message(
+                str(number), message_data, token, phone_number_id, outcome=outcome
+            )
+        except RateLimitedError:
+            # A retry found no token
+            return rate_limiter.submit(phone_number_id, send, number)
+        except CircuitOpenError as e:
+            now = time.monotonic()
+            if blocked_since[0] is None:
+                blocked_since[0] = now
+            delay = deferral_delay(e.retry_after)
+            if now + delay - blocked_since[0] > Config.CIRCUIT_MAX_DEFER_SECONDS:
+                return failed(number, e, outcome)
+            return rate_limiter.submit(phone_number_id, send, number, delay=delay)
+        except Exception as e:
+            return failed(number, e, outcome)
+        blocked_since[0] = None
+        record(number, result, outcome)
+        if isinstance(result, dict) and "error" in result:
+            return False
+        # A broadcast created with a token the number had no credential
+        # for registers it once the API accepts it
+        token_vault.adopt(phone_number_id, token)
+        return True
+
+    after = broadcast["last_recipient"]
+    if after:
+        logger.info(
+            "Resuming broadcast %s after %s of %s recipients",
+            broadcast_id, broadcast["sent"] + broadcast["failed"], broadcast["recipients"],
+        )
+    else:
+        logger.info("Sending broadcast %s to %s recipients", broadcast_id, broadcast["recipients"])
+    sent = failed = 0
+    for page in broadcast_store.iter_recipient_pages(seq, after):
+        futures = [rate_limiter.submit(phone_number_id, send, number) for number in page]
+        # Outcomes are collected in recipient order, so a recorded recipient
+        # never has an earlier one still in flight
+        step_sent = step_failed = 0
+        for position, future in enumerate(futures, 1):
+            if _outcome(future):
+                step_sent += 1
+            else:
+                step_failed += 1
+            if position % PROGRESS_EVERY == 0 or position == len(page):
+                broadcast_store.record_progress(seq, step_sent, step_failed, page[position - 1])
+                sent += step_sent
+                failed += step_failed
+                step_sent = step_failed = 0
+    broadcast_store.record_progress(seq, 0, 0, status="completed")
+
+    logger.info("Broadcast %s finished: %s sent, %s failed", broadcast_id, sent, failed)
+    return {"broadcast_id": broadcast_id, "sent": sent, "failed": failed}
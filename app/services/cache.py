@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Load:
+    __slots__ = ("event", "value", "error", "stale")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False
+
+
+class TTLCache:
+    # Size-bounded LRU cache whose entries expire after ``ttl`` seconds.
+    # Concurrent misses for the same key are coalesced: one caller runs the
+    # loader and the others wait for its result.
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._loads = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get_or_load(self, key, loader, cacheable=lambda value: True):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+
+            self.misses += 1
+            load = self._loads.get(key)
+            leader = load is None
+            if leader:
+                load = self._loads[key] = _Load()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            load.event.wait()
+            if load.error is not None:
+                raise load.error
+            return load.value
+
+        try:
+            load.value = loader()
+        except BaseException as e:
+            load.error = e
+            raise
+        finally:
+            with self._lock:
+                self._loads.pop(key, None)
+                if load.error is None and not load.stale and cacheable(load.value):
+                    self._data[key] = (time.monotonic() + self.ttl, load.value)
+                    self._data.move_to_end(key)
+                    while len(self._data) > self.maxsize:
+                        self._data.popitem(last=False)
+                        self.evictions += 1
+            load.event.set()
+        return load.value
+
+    def invalidate(self, predicate):
+        # Drop every key matching ``predicate``, including loads still in
+        # flight, whose results will not be cached
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+                self.invalidations += 1
+            for key, load in self._loads.items():
+                if predicate(key):
+                    load.stale = True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,214 @@
+import random
+import threading
+import time
+from collections import deque
+from app.config import Config
+from app.utils.logger import setup_logger
+from app.utils.metrics import Counter, Gauge
+
+logger = setup_logger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+# Gauge values, so dashboards can graph the state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breaker_transitions = Counter(
+    "whatsapp_circuit_transitions_total",
+    "Circuit breaker state changes, by endpoint and the state entered",
+    ("endpoint", "state"),
+)
+breaker_rejected = Counter(
+    "whatsapp_circuit_rejected_total",
+    "Sends refused without calling the WhatsApp API because the endpoint's circuit was open",
+    ("endpoint",),
+)
+retries_denied = Counter(
+    "whatsapp_send_retries_denied_total",
+    "Retries skipped because the endpoint's retry budget was spent",
+    ("endpoint",),
+)
+
+
+class CircuitOpenError(Exception):
+    # The send was not made (or was refused by the API) and should be tried
+    # again after ``retry_after`` seconds
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"Circuit open for {endpoint}, retry in {retry_after:.1f}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    # Tracks the last ``window`` requests to one endpoint. Once at least
+    # ``min_calls`` of them are in and ``failure_ratio`` failed, the circuit
+    # opens and sends fail fast for ``open_seconds``. Then a single probe is
+    # let through (half open): success closes the circuit, failure opens it
+    # again for twice as long, up to ``max_open_seconds``. A Retry-After from
+    # the API opens it for at least that long.
+    #
+    # Retries draw on a budget in the same lock, as in gRPC's retry
+    # throttling: every failure costs a token, every success earns back
+    # ``retry_ratio`` of one, and retrying is allowed while more than half of
+    # ``retry_tokens`` are left. A healthy endpoint keeps its retries; at a
+    # high error rate they stop long before the circuit opens.
+
+    def __init__(self, endpoint, window=50, min_calls=20, failure_ratio=0.5,
+                 open_seconds=15, max_open_seconds=300, retry_tokens=10, retry_ratio=0.1):
+        self.endpoint = endpoint
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.max_tokens = float(retry_tokens)
+        self.retry_ratio = retry_ratio
+        self.state = CLOSED
+        self._results = deque(maxlen=window)
+        self._failures = 0
+        self._open_seconds = open_seconds
+        self._opened_until = 0.0
+        self._probing = False
+        self._tokens = self.max_tokens
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        self.state = state
+        breaker_transitions.inc(self.endpoint, state)
+        logger.warning("Circuit for %s is now %s", self.endpoint, state)
+
+    def _open(self, seconds):
+        self._opened_until = max(self._opened_until, time.monotonic() + seconds)
+        self._probing = False
+        self._results.clear()
+        self._failures = 0
+        if self.state != OPEN:
+            self._transition(OPEN)
+
+    def before_send(self):
+        # Raises CircuitOpenError unless a request may go out now
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN:
+                remaining = self._opened_until - time.monotonic()
+                if remaining > 0:
+                    breaker_rejected.inc(self.endpoint)
+                    raise CircuitOpenError(self.endpoint, remaining)
+                self._transition(HALF_OPEN)
+            if self._probing:
+                # Only the probe goes out; the rest wait for its result
+                breaker_rejected.inc(self.endpoint)
+                raise CircuitOpenError(self.endpoint, self._open_seconds)
+            self._probing = True
+
+    def record(self, ok, retry_after=None):
+        # One request's result; ``ok`` is False for connection errors,
+        # timeouts, 5xx, 408 and 429
+        with self._lock:
+            if ok:
+                self._tokens = min(self.max_tokens, self._tokens + self.retry_ratio)
+            else:
+                self._tokens = max(0.0, self._tokens - 1)
+
+            if retry_after:
+                self._open(retry_after)
+            elif self.state == HALF_OPEN and self._probing:
+                if ok:
+                    self._open_seconds = self.base_open_seconds
+                    self._probing = False
+                    self._transition(CLOSED)
+                else:
+                    self._open_seconds = min(self._open_seconds * 2, self.max_open_seconds)
+                    self._open(self._open_seconds)
+            elif self.state == CLOSED:
+                if len(self._results) == self._results.maxlen and not self._results[0]:
+                    self._failures -= 1
+                self._results.append(ok)
+                self._failures += not ok
+                if (
+                    len(self._results) >= self.min_calls
+                    and self._failures >= self.failure_ratio * len(self._results)
+                ):
+                    self._open(self._open_seconds)
+
+    def allow_retry(self):
+        with self._lock:
+            allowed = self.state == CLOSED and self._tokens > self.max_tokens / 2
+        if not allowed:
+            retries_denied.inc(self.endpoint)
+        return allowed
+
+    def retry_after(self):
+        # Seconds until requests may go out again, 0 if they may now
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(self._opened_until - time.monotonic(), 0.0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self._failures,
+                "window": len(self._results),
+                "retry_tokens": round(self._tokens, 2),
+                "open_seconds": (
+                    round(max(self._opened_until - time.monotonic(), 0.0), 3)
+                    if self.state == OPEN
+                    else 0.0
+                ),
+            }
+
+
+class CircuitBreakers:
+    # One breaker per WhatsApp business phone number (phone_number_id): each
+    # has its own messages endpoint, and its own limits at Meta's end
+
+    def __init__(self, **options):
+        self.options = options
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(endpoint)
+                if breaker is None:
+                    breaker = self._breakers[endpoint] = CircuitBreaker(str(endpoint), **self.options)
+        return breaker
+
+    def states(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {(breaker.endpoint,): STATE_VALUES[breaker.state] for breaker in breakers}
+
+    def stats(self):
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {str(key): breaker.stats() for key, breaker in breakers}
+
+
+def deferral_delay(retry_after):
+    # Spread the jobs refused by an open circuit over as long again, so they
+    # don't all come back the moment it closes
+    return retry_after * (1 + random.random())
+
+
+circuit_breakers = CircuitBreakers(
+    window=Config.CIRCUIT_WINDOW,
+    min_calls=Config.CIRCUIT_MIN_CALLS,
+    failure_ratio=Config.CIRCUIT_FAILURE_RATIO,
+    open_seconds=Config.CIRCUIT_OPEN_SECONDS,
+    max_open_seconds=Config.CIRCUIT_MAX_OPEN_SECONDS,
+    retry_tokens=Config.RETRY_BUDGET_TOKENS,
+    retry_ratio=Config.RETRY_BUDGET_RATIO,
+)
+
+Gauge(
+    "whatsapp_circuit_state",
+    "Circuit breaker state per endpoint: 0 closed, 1 half open, 2 open",
+    ("endpoint",),
+    circuit_breakers.states,
+)
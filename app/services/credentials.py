@@ -0,0 +1,237 @@
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from app.config import Config
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+# What a job carries in place of a token the number has no credential for:
+# this prefix and the token's fingerprint, looked up in the vault on send
+REFERENCE_PREFIX = "vault:"
+
+
+def token_fingerprint(auth_token):
+    # Identifies a token in responses and logs without revealing it
+    return hashlib.sha256(auth_token.encode("utf-8")).hexdigest()[:16]
+
+
+class CredentialChangedError(Exception):
+    # The stored credential isn't the one a rotation or removal was checked
+    # against any more
+    pass
+
+
+class TokenVault:
+    # One WhatsApp access token per business phone number (phone_number_id),
+    # in a local SQLite file readable only by this user. Jobs never store a
+    # token: those for a number with a credential carry nothing, and those
+    # scheduled before it has one carry a reference to their token, kept here
+    # once however many jobs use it. The registered credential wins over a
+    # referenced token, so rotating it takes effect for every pending job at
+    # once.
+    #
+    # Lookups are served from memory. SQLite's data_version changes whenever
+    # another connection (e.g. another process) commits, which clears the
+    # cache, so a rotation elsewhere is seen on the next lookup.
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.RLock()
+        self._tokens = {}
+        # (phone_number_id, fingerprint) -> token, for referenced tokens
+        self._referenced = {}
+        self._data_version = None
+
+    @property
+    def conn(self):
+        with self._lock:
+            if self._conn is None:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.exists(directory):
+                    os.makedirs(directory, exist_ok=True)
+                conn = sqlite3.connect(
+                    self.path, check_same_thread=False, isolation_level=None, timeout=30
+                )
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS credentials ("
+                    "phone_number_id TEXT NOT NULL PRIMARY KEY, "
+                    "auth_token TEXT NOT NULL, "
+                    "updated_ts REAL NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS referenced_tokens ("
+                    "phone_number_id TEXT NOT NULL, "
+                    "fingerprint TEXT NOT NULL, "
+                    "auth_token TEXT NOT NULL, "
+                    "created_ts REAL NOT NULL, "
+                    "PRIMARY KEY (phone_number_id, fingerprint))"
+                )
+                # The WAL holds recent tokens as well
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(self.path + suffix):
+                        os.chmod(self.path + suffix, 0o600)
+                self._conn = conn
+            return self._conn
+
+    def _refresh(self):
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._tokens.clear()
+            self._referenced.clear()
+            self._data_version = version
+
+    def get(self, phone_number_id):
+        phone_number_id = str(phone_number_id)
+        with self._lock:
+            self._refresh()
+            if phone_number_id not in self._tokens:
+                row = self.conn.execute(
+                    "SELECT auth_token FROM credentials WHERE phone_number_id = ?",
+                    (phone_number_id,),
+                ).fetchone()
+                self._tokens[phone_number_id] = row[0] if row else None
+            return self._tokens[phone_number_id]
+
+    def matches(self, phone_number_id, auth_token):
+        # Whether ``auth_token`` is the registered credential, compared in
+        # constant time
+        registered = self.get(phone_number_id)
+        if registered is None or not auth_token:
+            return False
+        return hmac.compare_digest(registered.encode("utf-8"), auth_token.encode("utf-8"))
+
+    def reference(self, phone_number_id, auth_token):
+        # What a new job should carry for this token: None when the number
+        # has a credential, which the job then sends with, else a reference
+        # to the token. The token itself isn't registered: a number's first
+        # credential is only stored once the API has accepted it (see
+        # adopt()), so a stale or wrong one is never pinned for the jobs that
+        # come after it.
+        if self.get(phone_number_id) is not None:
+            return None
+        key = (str(phone_number_id), token_fingerprint(auth_token))
+        with self._lock:
+            self._refresh()
+            if key not in self._referenced:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO referenced_tokens "
+                    "(phone_number_id, fingerprint, auth_token, created_ts) VALUES (?, ?, ?, ?)",
+                    (*key, auth_token, time.time()),
+                )
+                self._referenced[key] = auth_token
+        return REFERENCE_PREFIX + key[1]
+
+    def _referenced_token(self, phone_number_id, fingerprint):
+        key = (str(phone_number_id), fingerprint)
+        with self._lock:
+            self._refresh()
+            if key not in self._referenced:
+                row = self.conn.execute(
+                    "SELECT auth_token FROM referenced_tokens "
+                    "WHERE phone_number_id = ? AND fingerprint = ?",
+                    key,
+                ).fetchone()
+                self._referenced[key] = row[0] if row else None
+            return self._referenced[key]
+
+    def _registered(self, phone_number_id):
+        # Once a number has a credential its jobs send with that, so the
+        # tokens they referenced are never read again. Called holding the lock.
+        self.conn.execute(
+            "DELETE FROM referenced_tokens WHERE phone_number_id = ?", (str(phone_number_id),)
+        )
+        self._referenced = {
+            key: token for key, token in self._referenced.items() if key[0] != str(phone_number_id)
+        }
+
+    def adopt(self, phone_number_id, auth_token):
+        # Registers a token the API has just accepted, if the number has no
+        # credential yet; its pending jobs send with it from then on
+        if not auth_token or self.get(phone_number_id) is not None:
+            return
+        with self._lock:
+            added = self.conn.execute(
+                "INSERT OR IGNORE INTO credentials (phone_number_id, auth_token, updated_ts) "
+                "VALUES (?, ?, ?)",
+                (str(phone_number_id), auth_token, time.time()),
+            ).rowcount
+            if added:
+                self._registered(phone_number_id)
+            # This connection's own writes don't change data_version
+            self._tokens.pop(str(phone_number_id), None)
+        if added:
+            logger.info("Registered credential for %s after a successful send", phone_number_id)
+
+    def resolve(self, phone_number_id, auth_token=None):
+        # The token to send with for what a job carries: the number's
+        # credential if it has one, else the token the job referenced. Jobs
+        # scheduled before references existed may carry the token itself.
+        registered = self.get(phone_number_id)
+        if registered is not None or not auth_token:
+            return registered
+        if auth_token.startswith(REFERENCE_PREFIX):
+            return self._referenced_token(phone_number_id, auth_token[len(REFERENCE_PREFIX):])
+        return auth_token
+
+    def rotate(self, phone_number_id, auth_token, current=None):
+        # Replaces the credential ``current`` with ``auth_token``, or adds it
+        # when ``current`` is None. Raises CredentialChangedError if the
+        # stored credential is no longer ``current``. Returns the previous
+        # one's fingerprint, or None.
+        with self._lock:
+            if current is None:
+                changed = self.conn.execute(
+                    "INSERT OR IGNORE INTO credentials (phone_number_id, auth_token, updated_ts) "
+                    "VALUES (?, ?, ?)",
+                    (str(phone_number_id), auth_token, time.time()),
+                ).rowcount
+            else:
+                changed = self.conn.execute(
+                    "UPDATE credentials SET auth_token = ?, updated_ts = ? "
+                    "WHERE phone_number_id = ? AND auth_token = ?",
+                    (auth_token, time.time(), str(phone_number_id), current),
+                ).rowcount
+            if not changed:
+                self._tokens.pop(str(phone_number_id), None)
+                raise CredentialChangedError(phone_number_id)
+            if current is None:
+                self._registered(phone_number_id)
+            self._tokens[str(phone_number_id)] = auth_token
+        logger.info("Rotated credential for %s", phone_number_id)
+        return token_fingerprint(current) if current else None
+
+    def remove(self, phone_number_id, current):
+        # Removes the credential if it is still ``current``
+        with self._lock:
+            removed = self.conn.execute(
+                "DELETE FROM credentials WHERE phone_number_id = ? AND auth_token = ?",
+                (str(phone_number_id), current),
+            ).rowcount
+            self._tokens.pop(str(phone_number_id), None)
+        return bool(removed)
+
+    def list(self):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT phone_number_id, auth_token, updated_ts FROM credentials "
+                "ORDER BY phone_number_id"
+            ).fetchall()
+        return [
+            {
+                "phone_number_id": phone_number_id,
+                "fingerprint": token_fingerprint(auth_token),
+                "updated_ts": updated_ts,
+            }
+            for phone_number_id, auth_token, updated_ts in rows
+        ]
+
+
+token_vault = TokenVault(Config.CREDENTIALS_DB_PATH)
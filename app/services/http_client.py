@@ -0,0 +1,198 @@
+import threading
+import time
+import weakref
+from contextvars import ContextVar
+from app.config import DISPATCH_EXECUTORS, Config
+from app.utils.logger import setup_logger
+from app.utils.metrics import LATENCY_BUCKETS, Counter, Histogram
+
+logger = setup_logger(__name__)
+
+# (connection timeout, read timeout)
+REQUEST_TIMEOUT = (5, 15)
+
+send_latency = Histogram(
+    "whatsapp_send_latency_seconds",
+    "WhatsApp API round trip per send, including retries, by response status",
+    LATENCY_BUCKETS,
+    ("status",),
+)
+send_retries = Counter(
+    "whatsapp_send_retries_total",
+    "Requests to the WhatsApp API retried after an error or a retryable status",
+    ("reason",),
+)
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def record_checkout(self, waited, wait_time):
+        with self._lock:
+            self.requests += 1
+            if waited:
+                self.waits += 1
+                self.wait_time += wait_time
+
+    def record_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                # Every checkout that didn't have to open a connection reused one
+                "hits": self.requests - self.new_connections,
+                "new_connections": self.new_connections,
+                "waits": self.waits,
+                "wait_time_seconds": round(self.wait_time, 6),
+            }
+
+
+pool_stats = PoolStats()
+
+
+class _CountingPoolMixin:
+    def _get_conn(self, timeout=None):
+        # An empty queue means every connection is checked out and, since the
+        # pool blocks, this thread has to wait for one to be returned
+        waited = self.pool is not None and self.pool.empty()
+        started = time.perf_counter()
+        conn = super()._get_conn(timeout)
+        pool_stats.record_checkout(waited, time.perf_counter() - started)
+        return conn
+
+    def _new_conn(self):
+        pool_stats.record_new_connection()
+        return super()._new_conn()
+
+
+def _pool_size():
+    # A connection for every worker that can send at the same time, across
+    # all priority lanes and the rate limiter's send queue, so a burst on one
+    # lane never leaves another waiting for the pool
+    executors = Config.SCHEDULER_EXECUTORS
+    aliases = {DISPATCH_EXECUTORS[Config.SCHEDULER_DISPATCH_MODE]}
+    aliases.update(lane for lane in Config.PRIORITY_LANES if lane in executors)
+    workers = sum(executors[alias].get("max_workers", 10) for alias in aliases)
+    return workers + Config.SEND_QUEUE_WORKERS
+
+
+def _build_session():
+    # requests and urllib3 are imported with the first session, so modules
+    # that never send (CLI tools, importers) don't load them
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+        pass
+
+    class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+        pass
+
+    class PooledHTTPAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": CountingHTTPConnectionPool,
+                "https": CountingHTTPSConnectionPool,
+            }
+
+    # No retries at this level: send_whatsapp_message() retries within its
+    # endpoint's retry budget and circuit breaker
+    pool_size = _pool_size()
+    adapter = PooledHTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=pool_size,
+        pool_block=True,
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    logger.info("Created shared WhatsApp HTTP session with pool size %s", pool_size)
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def get_pool_stats():
+    stats = pool_stats.snapshot()
+    stats["pool_maxsize"] = _pool_size()
+    return stats
+
+
+# aiohttp sessions only work on the event loop they were created on, and
+# each asyncio lane runs a loop of its own: one shared session per loop
+_async_sessions = weakref.WeakKeyDictionary()
+_async_sessions_lock = threading.Lock()
+# A session set for the current context with use_async_session()
+_context_session = ContextVar("async_session", default=None)
+
+
+def new_async_session(limit):
+    # aiohttp is only needed by the asyncio and batch dispatch modes. Must be
+    # called on the event loop the session will be used from.
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=limit, keepalive_timeout=60)
+    session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(
+            sock_connect=REQUEST_TIMEOUT[0], sock_read=REQUEST_TIMEOUT[1]
+        ),
+    )
+    logger.info("Created async WhatsApp HTTP session with limit %s", limit)
+    return session
+
+
+def use_async_session(session):
+    # Async sends in the current context (e.g. one task of a batch) go
+    # through ``session`` instead of the shared one
+    _context_session.set(session)
+
+
+def get_async_session():
+    # The running loop's shared session, unless one was set for this context
+    import asyncio
+
+    session = _context_session.get()
+    if session is not None:
+        return session
+    loop = asyncio.get_running_loop()
+    with _async_sessions_lock:
+        session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        session = new_async_session(Config.ASYNC_DISPATCH_CONCURRENCY)
+        with _async_sessions_lock:
+            _async_sessions[loop] = session
+    return session
+
+
+async def close_async_session():
+    # Closes the running loop's session; other loops keep theirs
+    import asyncio
+
+    with _async_sessions_lock:
+        session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
@@ -0,0 +1,138 @@
+import json
+import sys
+import threading
+from functools import lru_cache
+
+# Component types that take positional text parameters, in the order they
+# appear in the rendered message
+TEMPLATE_COMPONENTS = ("header", "body")
+
+_keys = {}
+_keys_lock = threading.Lock()
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _intern_key(name, language, layout):
+    # One shared key tuple per distinct template, so in-memory jobs for a
+    # campaign all point at the same object
+    key = (sys.intern(name), sys.intern(language), layout)
+    shared = _keys.get(key)
+    if shared is None:
+        with _keys_lock:
+            shared = _keys.setdefault(key, key)
+    return shared
+
+
+class CompiledTemplate:
+    # JSON skeleton of a template message split around its parameter slots:
+    # rendering is a join of precomputed fragments and the encoded values.
+    __slots__ = ("fragments", "slots")
+
+    def __init__(self, name, language, layout):
+        fragments = ['{"messaging_product":"whatsapp","to":']
+        pending = (
+            ',"type":"template","template":{"name":'
+            + _dumps(name)
+            + ',"language":{"code":'
+            + _dumps(language)
+            + "}"
+        )
+        if layout:
+            pending += ',"components":['
+        for component_index, (component, count) in enumerate(layout):
+            if component_index:
+                pending += ","
+            pending += '{"type":' + _dumps(component) + ',"parameters":['
+            for position in range(count):
+                if position:
+                    pending += ","
+                pending += '{"type":"text","text":'
+                fragments.append(pending)
+                pending = "}"
+            pending += "]}"
+        if layout:
+            pending += "]"
+        pending += "}}"
+        fragments.append(pending)
+
+        self.fragments = tuple(fragment.encode("utf-8") for fragment in fragments)
+        self.slots = sum(count for _, count in layout)
+
+    def render(self, phone_number, params):
+        # fragments[0] precedes the recipient, every later fragment follows
+        # one value: the recipient first, then each parameter in order
+        values = (phone_number,) + tuple(params)
+        parts = [self.fragments[0]]
+        for value, fragment in zip(values, self.fragments[1:]):
+            parts.append(_dumps(value).encode("utf-8"))
+            parts.append(fragment)
+        return b"".join(parts)
+
+
+@lru_cache(maxsize=1024)
+def compile_template(key):
+    name, language, layout = key
+    return CompiledTemplate(name, language, layout)
+
+
+class TemplateMessage:
+    # Message content for a template send: a reference to the shared
+    # template plus this recipient's parameters. Pickles to just those.
+    __slots__ = ("key", "params")
+
+    def __init__(self, name, language, layout, params):
+        self.key = _intern_key(name, language, tuple(layout))
+        self.params = tuple(params)
+
+    @classmethod
+    def from_request(cls, template, parameters):
+        if not isinstance(template, dict) or not template.get("name"):
+            raise ValueError("template must be an object with a name")
+        language = template.get("language", "en_US")
+        if isinstance(language, dict):
+            language = language.get("code", "en_US")
+
+        parameters = parameters or {}
+        if not isinstance(parameters, dict):
+            raise ValueError("parameters must be an object keyed by component")
+        unknown = set(parameters) - set(TEMPLATE_COMPONENTS)
+        if unknown:
+            raise ValueError(f"Unsupported template components: {', '.join(sorted(unknown))}")
+
+        layout = []
+        params = []
+        for component in TEMPLATE_COMPONENTS:
+            values = parameters.get(component)
+            if not values:
+                continue
+            if not isinstance(values, list):
+                raise ValueError(f"parameters.{component} must be a list")
+            layout.append((component, len(values)))
+            params.extend(str(value) for value in values)
+        return cls(template["name"], str(language), layout, params)
+
+    def __reduce__(self):
+        name, language, layout = self.key
+        return (TemplateMessage, (name, language, layout, self.params))
+
+    def get(self, key, default=None):
+        # Lets code that reads message_data["type"] treat both kinds alike
+        return "template" if key == "type" else default
+
+    def render(self, phone_number):
+        return compile_template(self.key).render(phone_number, self.params)
+
+    def to_dict(self):
+        name, language, layout = self.key
+        params = iter(self.params)
+        return {
+            "type": "template",
+            "template": {"name": name, "language": language},
+            "parameters": {
+                component: [next(params) for _ in range(count)]
+                for component, count in layout
+            },
+        }
@@ -0,0 +1,213 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from app.config import Config
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+MAX_ERROR_LENGTH = 200
+# Retention pruning runs from the writer thread at most this often
+PRUNE_INTERVAL = 3600
+COLUMNS = (
+    "job_id", "finished_ts", "run_ts", "phone_number_id", "wamid",
+    "status", "error", "latency_ms", "attempts",
+)
+
+
+def _wamid(result):
+    # The message id WhatsApp returns for an accepted send
+    try:
+        return result["messages"][0]["id"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def _error_text(result):
+    error = result.get("error") if isinstance(result, dict) else None
+    if error is None:
+        return None
+    if isinstance(error, dict):
+        # Graph API errors: {"message": ..., "type": ..., "code": ...}
+        error = error.get("message") or json.dumps(error, separators=(",", ":"))
+    return str(error)[:MAX_ERROR_LENGTH]
+
+
+class OutcomeStore:
+    # Append-only history of what happened to each job run, in a local SQLite
+    # file: one narrow row per send with the WhatsApp message id, status,
+    # latency and attempt count. Jobs only add rows to an in-memory buffer; a
+    # writer thread inserts them in batches, and prunes rows older than the
+    # retention period.
+
+    def __init__(self, path, retention_days=90, flush_seconds=1.0, batch_size=500):
+        self.path = path
+        self.retention = retention_days * 86400
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self._conn = None
+        self._lock = threading.RLock()
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._last_prune = 0.0
+
+    @property
+    def conn(self):
+        with self._lock:
+            if self._conn is None:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.exists(directory):
+                    os.makedirs(directory, exist_ok=True)
+                conn = sqlite3.connect(
+                    self.path, check_same_thread=False, isolation_level=None, timeout=30
+                )
+                # Only takes effect on a new file; lets pruning hand freed
+                # pages back to the filesystem
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS outcomes ("
+                    "job_id TEXT NOT NULL, "
+                    "finished_ts REAL NOT NULL, "
+                    "run_ts REAL, "
+                    "phone_number_id TEXT, "
+                    "wamid TEXT, "
+                    "status TEXT NOT NULL, "
+                    "error TEXT, "
+                    "latency_ms REAL, "
+                    "attempts INTEGER)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS outcomes_job ON outcomes (job_id)")
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS outcomes_wamid ON outcomes (wamid) "
+                    "WHERE wamid IS NOT NULL"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS outcomes_finished ON outcomes (finished_ts)"
+                )
+                # find() by sender, usually within a time window
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS outcomes_sender_finished "
+                    "ON outcomes (phone_number_id, finished_ts)"
+                )
+                self._conn = conn
+            return self._conn
+
+    def record(self, job_id, run_ts, phone_number_id, result, send=None, status=None):
+        # Called from job functions: only appends to the buffer. ``send`` is
+        # the outcome dict filled in by send_whatsapp_message().
+        send = send or {}
+        latency = send.get("latency")
+        row = (
+            job_id,
+            time.time(),
+            run_ts,
+            phone_number_id,
+            _wamid(result),
+            status or send.get("status") or "error",
+            _error_text(result),
+            round(latency * 1000, 3) if latency is not None else None,
+            send.get("attempts"),
+        )
+        with self._condition:
+            self._pending.append(row)
+            if self._thread is None:
+                self._start()
+            elif len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="outcome-writer", daemon=True)
+        self._thread.start()
+        # Whatever is still buffered when the process exits
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._pending) < self.batch_size:
+                    self._condition.wait(self.flush_seconds)
+            try:
+                self.flush()
+                if time.time() - self._last_prune >= PRUNE_INTERVAL:
+                    self.prune()
+            except Exception as e:
+                logger.error("Error writing delivery outcomes: %s", e, exc_info=True)
+                time.sleep(self.flush_seconds)
+
+    def flush(self):
+        # Writes the buffer in one transaction. Lookups flush first, so they
+        # see everything recorded in this process.
+        with self._lock:
+            with self._condition:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return
+            conn = self.conn
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    f"INSERT INTO outcomes ({', '.join(COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                    rows,
+                )
+            except BaseException:
+                conn.execute("ROLLBACK")
+                with self._condition:
+                    self._pending[:0] = rows
+                raise
+            conn.execute("COMMIT")
+
+    def prune(self, now=None):
+        # Drops rows past the retention period and compacts the file
+        now = time.time() if now is None else now
+        with self._lock:
+            removed = self.conn.execute(
+                "DELETE FROM outcomes WHERE finished_ts < ?", (now - self.retention,)
+            ).rowcount
+            if removed:
+                # execute() would only step it once, freeing a single page
+                self.conn.executescript("PRAGMA incremental_vacuum")
+                logger.info("Pruned %s delivery outcomes past retention", removed)
+        self._last_prune = now
+        return removed
+
+    def _select(self, where, params, limit):
+        self.flush()
+        with self._lock:
+            cursor = self.conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM outcomes WHERE {where} "
+                "ORDER BY finished_ts DESC LIMIT ?",
+                (*params, limit),
+            )
+            return [dict(zip(COLUMNS, row)) for row in cursor]
+
+    def get(self, job_id, limit=100):
+        # Runs of one job, newest first; more than one for recurring jobs
+        return self._select("job_id = ?", (job_id,), limit)
+
+    def find(self, wamid=None, phone_number_id=None, start_ts=None, end_ts=None, limit=100):
+        conditions, params = [], []
+        for condition, value in (
+            ("wamid = ?", wamid),
+            ("phone_number_id = ?", phone_number_id),
+            ("finished_ts >= ?", start_ts),
+            ("finished_ts < ?", end_ts),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        return self._select(" AND ".join(conditions) or "1", params, limit)
+
+
+outcome_store = OutcomeStore(
+    Config.OUTCOME_DB_PATH,
+    Config.OUTCOME_RETENTION_DAYS,
+    Config.OUTCOME_FLUSH_SECONDS,
+    Config.OUTCOME_BATCH_SIZE,
+)
@@ -0,0 +1,260 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar
+from app.config import Config
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# (phone_number_id, retry_after) for a send whose token was taken up front
+# with the rest of its batch; that send's first acquire() uses it
+_prepaid = ContextVar("rate_limit_prepaid", default=None)
+
+
+class RateLimitedError(Exception):
+    # No token was free for the send, which was not made; try again after
+    # ``retry_after`` seconds
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"Rate limit reached for {endpoint}, retry in {retry_after:.3f}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    # Token bucket that never makes a caller wait: a send either takes a
+    # token that is free now, or takes nothing and is told when to come
+    # back. Those retry times are handed out at the bucket's rate, one slot
+    # after another, so a burst of refused sends returns spread out at the
+    # pace the bucket can serve instead of all at once.
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._retry_horizon = 0.0
+        self._lock = threading.Lock()
+
+        self.acquired = 0
+        self.limited = 0
+
+    def try_acquire(self):
+        # 0 once a token is taken, else the seconds until the caller's slot
+        return self.try_acquire_many(1)[0]
+
+    def try_acquire_many(self, count):
+        # try_acquire() for ``count`` sends under one hold of the lock
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            results = []
+            for _ in range(count):
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.acquired += 1
+                    results.append(0.0)
+                    continue
+                retry_at = max(
+                    now + (1 - self._tokens) / self.rate, self._retry_horizon + 1 / self.rate
+                )
+                self._retry_horizon = retry_at
+                self.limited += 1
+                results.append(retry_at - now)
+            return results
+
+    def take(self):
+        # For the send queue: takes a token and returns 0 if one is free,
+        # else the seconds until one will be, without handing out a slot
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.acquired += 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "burst": self.capacity,
+                "acquired": self.acquired,
+                "limited": self.limited,
+            }
+
+
+class SendQueue:
+    # One sender's sends waiting in memory for a token: (queued at, not
+    # before, func, args, future) in the order they were submitted
+    def __init__(self):
+        self.items = deque()
+        self.drained = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self, now):
+        return {
+            "queued": len(self.items),
+            "oldest_wait_seconds": round(now - self.items[0][0], 6) if self.items else 0.0,
+            "avg_wait_seconds": round(self.total_wait / self.drained, 6) if self.drained else 0.0,
+            "max_wait_seconds": round(self.max_wait, 6),
+        }
+
+
+class RateLimiter:
+    # One token bucket per WhatsApp business phone number (phone_number_id).
+    #
+    # Sends that can't be handed back to the scheduler (occurrences of
+    # recurring messages, broadcast recipients) are submit()ted instead:
+    # they wait in their sender's queue in memory, and a single drainer
+    # thread hands each to one of ``workers`` threads as soon as its sender
+    # has a token. No thread sleeps waiting for one.
+
+    def __init__(self, default_rate, default_burst, overrides=None, workers=20):
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self.overrides = overrides or {}
+        self.workers = workers
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._condition = threading.Condition()
+        self._drainer = None
+        self._pool = None
+
+    def bucket(self, phone_number_id):
+        bucket = self._buckets.get(phone_number_id)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(phone_number_id)
+                if bucket is None:
+                    limits = self.overrides.get(str(phone_number_id), {})
+                    bucket = TokenBucket(
+                        limits.get("rate", self.default_rate),
+                        limits.get("burst", self.default_burst),
+                    )
+                    self._buckets[phone_number_id] = bucket
+        return bucket
+
+    def acquire(self, phone_number_id):
+        # Takes a token for one request to the API, or raises
+        # RateLimitedError without sending
+        prepaid = _prepaid.get()
+        if prepaid is not None and prepaid[0] == phone_number_id:
+            _prepaid.set(None)
+            retry_after = prepaid[1]
+        else:
+            retry_after = self.bucket(phone_number_id).try_acquire()
+        if retry_after:
+            raise RateLimitedError(phone_number_id, retry_after)
+
+    def acquire_many(self, phone_number_id, count):
+        # Tokens for ``count`` sends at once: 0 for each send that got one,
+        # else the seconds until that send's slot. Pass each send its result
+        # with prepay().
+        return self.bucket(phone_number_id).try_acquire_many(count)
+
+    def submit(self, phone_number_id, func, *args, delay=0.0):
+        # Queues ``func(*args)`` to run on a queue worker, no sooner than
+        # ``delay`` seconds from now, once ``phone_number_id`` has a token.
+        # The token is prepaid for the call's first acquire(). Returns a
+        # Future of its result.
+        future = Future()
+        self.bucket(phone_number_id)
+        now = time.monotonic()
+        with self._condition:
+            if self._drainer is None:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="send-queue")
+                self._drainer = threading.Thread(
+                    target=self._drain, name="send-queue-drainer", daemon=True
+                )
+                self._drainer.start()
+            queue = self._queues.get(phone_number_id)
+            if queue is None:
+                queue = self._queues[phone_number_id] = SendQueue()
+            queue.items.append((now, now + delay, func, args, future))
+            self._condition.notify()
+        return future
+
+    def _drain(self):
+        while True:
+            ready = []
+            with self._condition:
+                while not ready:
+                    wait = None
+                    now = time.monotonic()
+                    for phone_number_id, queue in self._queues.items():
+                        bucket = self.bucket(phone_number_id)
+                        while queue.items:
+                            queued_at, not_before, func, args, future = queue.items[0]
+                            # Sends go in order: a later one never passes
+                            # one held back by its not-before time
+                            delay = not_before - now
+                            if delay <= 0:
+                                delay = bucket.take()
+                            if delay > 0:
+                                wait = delay if wait is None else min(wait, delay)
+                                break
+                            queue.items.popleft()
+                            queue.drained += 1
+                            queue.total_wait += now - queued_at
+                            queue.max_wait = max(queue.max_wait, now - queued_at)
+                            ready.append((phone_number_id, func, args, future))
+                    if not ready:
+                        self._condition.wait(wait)
+            for item in ready:
+                self._pool.submit(self._run, *item)
+
+    def _run(self, phone_number_id, func, args, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        # A context of its own, so the prepaid token can't outlive the call
+        try:
+            result = contextvars.Context().run(_prepaid_call, phone_number_id, func, args)
+        except BaseException as e:
+            logger.error("Queued send for %s failed: %s", phone_number_id, e)
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def stats(self):
+        # Each sender's bucket, and its queue: how many sends are waiting,
+        # how long the oldest has, and how long drained ones waited
+        with self._lock:
+            buckets = list(self._buckets.items())
+        now = time.monotonic()
+        with self._condition:
+            queues = {key: queue.stats(now) for key, queue in self._queues.items()}
+        empty = SendQueue().stats(now)
+        return {
+            str(key): {**bucket.stats(), **queues.get(key, empty)} for key, bucket in buckets
+        }
+
+
+def prepay(phone_number_id, retry_after):
+    # Makes the next acquire() for ``phone_number_id`` in the current context
+    # (e.g. one task of a batch) use a result of acquire_many()
+    _prepaid.set((phone_number_id, retry_after))
+
+
+def _prepaid_call(phone_number_id, func, args):
+    prepay(phone_number_id, 0.0)
+    return func(*args)
+
+
+rate_limiter = RateLimiter(
+    Config.WHATSAPP_RATE_LIMIT,
+    Config.WHATSAPP_RATE_BURST,
+    Config.WHATSAPP_RATE_LIMITS,
+    Config.SEND_QUEUE_WORKERS,
+)
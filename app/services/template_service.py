@@ -1,8 +1,17 @@
-import requests
 from app.config import Config
+from app.services.cache import TTLCache
+from app.services.credentials import token_fingerprint
+from app.services.http_client import REQUEST_TIMEOUT, get_session
 from app.utils.logger import setup_logger
 
-logger = setup_logger()
+logger = setup_logger(__name__)
+
+# Template listings keyed by (phone_number_id, token fingerprint)
+template_cache = TTLCache(Config.TEMPLATE_CACHE_SIZE, Config.TEMPLATE_CACHE_TTL)
+
+
+def _is_cacheable(response_data):
+    return isinstance(response_data, dict) and "error" not in response_data
 
 
 def create_whatsapp_template(auth_token, phone_number_id, template_data):
@@ -14,23 +23,37 @@ def create_whatsapp_template(auth_token, phone_number_id, template_data):
             "Content-Type": "application/json",
         }
 
-        logger.info(f"Creating new WhatsApp template: {template_data.get('name')}")
-        logger.debug(f"Template data: {template_data}")
+        logger.info("Creating new WhatsApp template: %s", template_data.get('name'))
+        logger.debug("Template data: %s", template_data)
 
-        response = requests.post(url, json=template_data, headers=headers)
+        response = get_session().post(
+            url, json=template_data, headers=headers, timeout=REQUEST_TIMEOUT
+        )
         response_data = response.json()
 
-        logger.info(f"Template creation response status: {response.status_code}")
-        logger.debug(f"Template creation response: {response_data}")
+        logger.info("Template creation response status: %s", response.status_code)
+        logger.debug("Template creation response: %s", response_data)
+
+        if response.ok:
+            # The cached listing for this number no longer has every template
+            template_cache.invalidate(lambda key: key[0] == phone_number_id)
 
         return response_data
 
     except Exception as e:
-        logger.error(f"Error creating template: {str(e)}", exc_info=True)
+        logger.error("Error creating template: %s", e, exc_info=True)
         return None
 
 
 def get_whatsapp_templates(auth_token, phone_number_id):
+    return template_cache.get_or_load(
+        (phone_number_id, token_fingerprint(auth_token)),
+        lambda: _fetch_whatsapp_templates(auth_token, phone_number_id),
+        cacheable=_is_cacheable,
+    )
+
+
+def _fetch_whatsapp_templates(auth_token, phone_number_id):
     try:
         url = f"{Config.WHATSAPP_API_URL}/{Config.WHATSAPP_API_VERSION}/{phone_number_id}/message_templates"
 
@@ -41,14 +64,14 @@ def get_whatsapp_templates(auth_token, phone_number_id):
 
         logger.info("Fetching WhatsApp templates")
 
-        response = requests.get(url, headers=headers)
+        response = get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT)
         response_data = response.json()
 
-        logger.info(f"Template fetch response status: {response.status_code}")
-        logger.debug(f"Templates fetched: {response_data}")
+        logger.info("Template fetch response status: %s", response.status_code)
+        logger.debug("Templates fetched: %s", response_data)
 
         return response_data
 
     except Exception as e:
-        logger.error(f"Error fetching templates: {str(e)}", exc_info=True)
+        logger.error("Error fetching templates: %s", e, exc_info=True)
         return None
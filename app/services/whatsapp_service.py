@@ -1,11 +1,178 @@
-import requests
+import json
+import time
+from email.utils import parsedate_to_datetime
 from app.config import Config
+from app.services.circuit_breaker import CircuitOpenError, circuit_breakers
+from app.services.http_client import (
+    REQUEST_TIMEOUT,
+    get_async_session,
+    get_session,
+    send_latency,
+    send_retries,
+)
+from app.services.message_templates import TemplateMessage
+from app.services.rate_limiter import RateLimitedError, rate_limiter
 from app.utils.logger import setup_logger
 
-logger = setup_logger()
+logger = setup_logger(__name__)
 
 
-def send_whatsapp_message(phone_number, message_data, auth_token, phone_number_id):
+def _request_body(phone_number, message_data):
+    # Template messages render straight from their precompiled skeleton;
+    # anything else is merged into a payload dict as before
+    if isinstance(message_data, TemplateMessage):
+        return message_data.render(phone_number)
+    payload = {"messaging_product": "whatsapp", "to": phone_number, **message_data}
+    return json.dumps(payload).encode("utf-8")
+
+
+# Statuses the API answers without having taken the request, so it can be
+# retried (while the endpoint's retry budget lasts) or deferred without
+# sending it twice. A 429 or 503 carrying Retry-After isn't retried: it holds
+# the endpoint's circuit open for that long and the job is deferred.
+NOT_TAKEN_STATUSES = frozenset((408, 429, 503))
+BACKOFF_FACTOR = 0.5
+
+
+def _report(outcome, status, started, attempts):
+    latency = time.perf_counter() - started
+    send_latency.observe(latency, status)
+    if outcome is not None:
+        outcome.update(status=status, latency=latency, attempts=attempts)
+
+
+def _succeeded(status_code):
+    # What the circuit breaker counts as a failure: the API not coping, as
+    # opposed to a request it rejected (bad number, expired token, ...)
+    return status_code < 500 and status_code not in (408, 429)
+
+
+def _retry_after(status_code, headers):
+    if status_code not in (429, 503):
+        return None
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt):
+    return BACKOFF_FACTOR * (2**attempt)
+
+
+# What the sync and async send loops do after each request is decided here,
+# so the two can't drift apart. A failed request the API is known not to
+# have taken is retried, or once out of retries deferred (by raising
+# CircuitOpenError) if it left the circuit open. Any other failure may have
+# delivered the message, and sends aren't idempotent: it is returned as is.
+
+
+def _retry_delay(breaker, phone_number_id, attempt, reason, taken):
+    # Seconds to wait before retrying a failed request, or None to give up
+    if taken:
+        return None
+    if attempt < Config.SEND_MAX_RETRIES and breaker.allow_retry():
+        send_retries.inc(reason)
+        return _backoff(attempt)
+    retry_after = breaker.retry_after()
+    if retry_after:
+        raise CircuitOpenError(phone_number_id, retry_after)
+    return None
+
+
+def _after_error(breaker, phone_number_id, attempt, status, message, taken):
+    # For a request that got no response: the seconds to wait before
+    # retrying it, or None when ``message`` is the send's result
+    breaker.record(False)
+    delay = _retry_delay(breaker, phone_number_id, attempt, status, taken)
+    if delay is None:
+        logger.error("WhatsApp API request for %s failed: %s", phone_number_id, message)
+    return delay
+
+
+def _after_response(breaker, phone_number_id, attempt, status_code, headers):
+    # For a response: the seconds to wait before retrying the request, or
+    # None when the response is the send's result
+    ok = _succeeded(status_code)
+    retry_after = _retry_after(status_code, headers)
+    breaker.record(ok, retry_after)
+    if retry_after is not None:
+        logger.warning(
+            "WhatsApp API answered %s for %s, retry after %.1fs",
+            status_code, phone_number_id, retry_after,
+        )
+        raise CircuitOpenError(phone_number_id, retry_after)
+    if ok:
+        return None
+    return _retry_delay(
+        breaker, phone_number_id, attempt, str(status_code), status_code not in NOT_TAKEN_STATUSES
+    )
+
+
+def _request_error(error):
+    # (status, message, whether the API may have taken the request) for a
+    # requests exception. requests reports a dropped keep-alive connection
+    # as a ConnectionError too, after the request went out.
+    import requests
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return "timeout", "Connection timeout occurred", False
+    if isinstance(error, requests.exceptions.Timeout):
+        return "timeout", "Read timeout occurred", True
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, "reason", reason)
+    connected = not isinstance(reason, (ConnectTimeoutError, NewConnectionError))
+    return "connection_error", "Connection error occurred", connected
+
+
+def _aiohttp_error(error):
+    # (status, message, whether the API may have taken the request) for an
+    # aiohttp exception or timeout
+    import aiohttp
+
+    if isinstance(error, aiohttp.ClientConnectorError):
+        return "connection_error", "Connection error occurred", False
+    # aiohttp 3.10+ tells connection timeouts apart from read timeouts
+    if isinstance(error, getattr(aiohttp, "ConnectionTimeoutError", ())):
+        return "timeout", "Connection timeout occurred", False
+    return "timeout", "Read timeout occurred", True
+
+
+def verify_token(phone_number_id, auth_token):
+    # Whether the API accepts ``auth_token`` for the phone number, by reading
+    # the number itself; None if the API couldn't be reached
+    import requests
+
+    url = f"{Config.WHATSAPP_API_URL}/{Config.WHATSAPP_API_VERSION}/{phone_number_id}"
+    try:
+        response = get_session().get(
+            url,
+            headers={"Authorization": f"Bearer {auth_token}"},
+            params={"fields": "id"},
+            timeout=REQUEST_TIMEOUT,
+        )
+    except requests.RequestException as e:
+        logger.error("Error verifying token for %s: %s", phone_number_id, e)
+        return None
+    logger.info("Token check for %s answered %s", phone_number_id, response.status_code)
+    return response.status_code == 200
+
+
+def send_whatsapp_message(phone_number, message_data, auth_token, phone_number_id, outcome=None):
+    # ``outcome``, if given, is a dict filled in with the response status,
+    # latency and attempt count for the delivery history. Raises
+    # CircuitOpenError, without sending, while the endpoint's circuit is open,
+    # and RateLimitedError when its rate limit leaves no token for a request.
+    import requests
+
     try:
         url = f"{Config.WHATSAPP_API_URL}/{Config.WHATSAPP_API_VERSION}/{phone_number_id}/messages"
 
@@ -14,55 +181,139 @@ def send_whatsapp_message(phone_number, message_data, auth_token, phone_number_i
             "Content-Type": "application/json",
         }
 
-        payload = {"messaging_product": "whatsapp", "to": phone_number, **message_data}
-
-        logger.info(f"Sending WhatsApp message to {phone_number}")
-        logger.debug(f"Request payload: {payload}")
-
-        # Configure request timeout and retries
-        timeout = (5, 15)  # (connection timeout, read timeout)
-        retry_strategy = requests.adapters.Retry(
-            total=3,  # total number of retries
-            backoff_factor=0.5,  # wait 0.5s * (2 ** retry) between retries
-            status_forcelist=[
-                408,
-                429,
-                500,
-                502,
-                503,
-                504,
-            ],  # retry on these status codes
-        )
+        body = _request_body(phone_number, message_data)
 
-        # Create session with retry strategy
-        session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(max_retries=retry_strategy)
-        session.mount("https://", adapter)
+        logger.info("Sending WhatsApp message to %s", phone_number)
+        logger.debug("Request payload: %s", body)
 
+        # Every request to the API takes a token, retries included; with none
+        # free this raises RateLimitedError and the caller tries again later.
+        # Taken before the circuit check, so a half-open probe always goes out.
+        rate_limiter.acquire(phone_number_id)
+        breaker = circuit_breakers.breaker(phone_number_id)
+        breaker.before_send()
+
+        session = get_session()
+        status = "error"
+        attempt = 0
+        started = time.perf_counter()
         try:
-            response = session.post(url, json=payload, headers=headers, timeout=timeout)
-            response_data = response.json()
+            for attempt in range(Config.SEND_MAX_RETRIES + 1):
+                if attempt:
+                    rate_limiter.acquire(phone_number_id)
+                try:
+                    response = session.post(
+                        url, data=body, headers=headers, timeout=REQUEST_TIMEOUT
+                    )
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    status, message, taken = _request_error(e)
+                    delay = _after_error(breaker, phone_number_id, attempt, status, message, taken)
+                    if delay is None:
+                        return {"error": message}
+                    time.sleep(delay)
+                    continue
 
-            logger.info(f"WhatsApp API Response status: {response.status_code}")
-            logger.debug(f"WhatsApp API Response: {response_data}")
+                except BaseException:
+                    breaker.record(False)
+                    raise
 
-            return response_data
+                status = str(response.status_code)
+                delay = _after_response(
+                    breaker, phone_number_id, attempt, response.status_code, response.headers
+                )
+                if delay is not None:
+                    response.close()
+                    time.sleep(delay)
+                    continue
 
-        except requests.exceptions.ConnectTimeout:
-            logger.error("Connection timeout while connecting to WhatsApp API")
-            return {"error": "Connection timeout occurred"}
+                response_data = response.json()
 
-        except requests.exceptions.ReadTimeout:
-            logger.error("Read timeout while waiting for WhatsApp API response")
-            return {"error": "Read timeout occurred"}
+                logger.info("WhatsApp API Response status: %s", response.status_code)
+                logger.debug("WhatsApp API Response: %s", response_data)
 
-        except requests.exceptions.ConnectionError:
-            logger.error("Connection error occurred while connecting to WhatsApp API")
-            return {"error": "Connection error occurred"}
+                return response_data
 
         finally:
-            session.close()
+            _report(outcome, status, started, attempt + 1)
+
+    except (CircuitOpenError, RateLimitedError):
+        raise
+
+    except Exception as e:
+        logger.error("Error sending WhatsApp message: %s", e, exc_info=True)
+        return {"error": str(e)}
+
+
+async def send_whatsapp_message_async(
+    phone_number, message_data, auth_token, phone_number_id, outcome=None
+):
+    # Only the asyncio and batch dispatch modes send from here
+    import asyncio
+    import aiohttp
+
+    try:
+        url = f"{Config.WHATSAPP_API_URL}/{Config.WHATSAPP_API_VERSION}/{phone_number_id}/messages"
+
+        headers = {
+            "Authorization": f"Bearer {auth_token}",
+            "Content-Type": "application/json",
+        }
+
+        body = _request_body(phone_number, message_data)
+
+        logger.info("Sending WhatsApp message to %s", phone_number)
+        logger.debug("Request payload: %s", body)
+
+        # Every request to the API takes a token, retries included; with none
+        # free this raises RateLimitedError and the caller tries again later.
+        # Taken before the circuit check, so a half-open probe always goes out.
+        rate_limiter.acquire(phone_number_id)
+        breaker = circuit_breakers.breaker(phone_number_id)
+        breaker.before_send()
+
+        session = get_async_session()
+        status = "error"
+        attempt = 0
+        started = time.perf_counter()
+        try:
+            for attempt in range(Config.SEND_MAX_RETRIES + 1):
+                if attempt:
+                    rate_limiter.acquire(phone_number_id)
+                try:
+                    async with session.post(url, data=body, headers=headers) as response:
+                        status_code, response_headers = response.status, response.headers
+                        response_data = await response.json(content_type=None)
+
+                except (aiohttp.ClientConnectorError, asyncio.TimeoutError) as e:
+                    status, message, taken = _aiohttp_error(e)
+                    delay = _after_error(breaker, phone_number_id, attempt, status, message, taken)
+                    if delay is None:
+                        return {"error": message}
+                    await asyncio.sleep(delay)
+                    continue
+
+                except BaseException:
+                    breaker.record(False)
+                    raise
+
+                status = str(status_code)
+                delay = _after_response(
+                    breaker, phone_number_id, attempt, status_code, response_headers
+                )
+                if delay is not None:
+                    await asyncio.sleep(delay)
+                    continue
+
+                logger.info("WhatsApp API Response status: %s", status)
+                logger.debug("WhatsApp API Response: %s", response_data)
+
+                return response_data
+        finally:
+            _report(outcome, status, started, attempt + 1)
+
+    except (CircuitOpenError, RateLimitedError):
+        raise
 
     except Exception as e:
-        logger.error(f"Error sending WhatsApp message: {str(e)}", exc_info=True)
+        logger.error("Error sending WhatsApp message: %s", e, exc_info=True)
         return {"error": str(e)}
@@ -0,0 +1,55 @@
+import hashlib
+import os
+import threading
+import time
+
+# ULID-style identifiers: 48 bits of millisecond timestamp followed by 80
+# random bits, written as 26 Crockford base32 characters. IDs from one
+# process are strictly increasing; the random part keeps IDs from different
+# processes apart.
+ENCODING = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+# Two base32 characters per lookup (10 bits)
+_PAIRS = [a + b for a in ENCODING for b in ENCODING]
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+_lock = threading.Lock()
+_last_ms = 0
+_last_random = 0
+_last_prefix = ""
+
+
+def _encode_timestamp(ms):
+    return "".join(_PAIRS[(ms >> shift) & 0x3FF] for shift in (40, 30, 20, 10, 0))
+
+
+def _encode_random(value):
+    return "".join(
+        _PAIRS[(value >> shift) & 0x3FF] for shift in (70, 60, 50, 40, 30, 20, 10, 0)
+    )
+
+
+def new_id():
+    global _last_ms, _last_random, _last_prefix
+    with _lock:
+        ms = time.time_ns() // 1_000_000
+        if ms > _last_ms:
+            _last_ms = ms
+            _last_random = int.from_bytes(os.urandom(10), "big") >> 1
+            _last_prefix = _encode_timestamp(ms)
+        else:
+            # Same millisecond (or the clock went back): bump the random part
+            # so ordering is kept
+            _last_random += 1
+            if _last_random > _RANDOM_MAX:
+                _last_ms += 1
+                _last_random = 0
+                _last_prefix = _encode_timestamp(_last_ms)
+        return _last_prefix + _encode_random(_last_random)
+
+
+def idempotent_id(scope, key):
+    # Stable ID for a client-supplied idempotency key, so the same key always
+    # maps to the same job
+    digest = hashlib.sha256(f"{scope}:{key}".encode("utf-8")).hexdigest()
+    return f"idem_{digest[:32]}"
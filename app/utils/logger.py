@@ -1,20 +1,48 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import threading
 from datetime import datetime
 
+LOGGER_NAME = "whatsapp_scheduler"
+_lock = threading.Lock()
+_configured = False
+_listener = None
 
-def setup_logger():
-    # Create logs directory if it doesn't exist
-    if not os.path.exists("logs"):
-        os.makedirs("logs")
 
-    # Configure logging
-    logger = logging.getLogger("whatsapp_scheduler")
-    logger.setLevel(logging.DEBUG)
+def _parse_levels(value):
+    # "routes=DEBUG,services.whatsapp_service=WARNING" -> {name: level}
+    levels = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class _StartingQueueHandler(logging.handlers.QueueHandler):
+    # Starts the listener (and with it the log file) on the first record, so
+    # importing a module that never logs doesn't touch the filesystem
+    def enqueue(self, record):
+        if _listener is None:
+            with _lock:
+                if _listener is None:
+                    _start_listener(self.queue)
+        super().enqueue(record)
+
+
+def _start_listener(log_queue):
+    global _listener
+    from app.config import Config
+
+    # Create logs directory if it doesn't exist
+    if not os.path.exists(Config.LOG_DIR):
+        os.makedirs(Config.LOG_DIR, exist_ok=True)
 
     # File handler for all logs
     file_handler = logging.FileHandler(
-        f'logs/scheduler_{datetime.now().strftime("%Y%m%d")}.log'
+        os.path.join(Config.LOG_DIR, f'scheduler_{datetime.now().strftime("%Y%m%d")}.log')
     )
     file_handler.setLevel(logging.DEBUG)
 
@@ -29,8 +57,43 @@ def setup_logger():
     file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
 
-    # Add the handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+    _listener = listener
+
+
+def _configure():
+    global _configured
+    from app.config import Config
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(Config.LOG_LEVEL)
+    logger.propagate = False
+
+    # Callers only enqueue records; a background thread does the formatting
+    # and the file/console writes
+    logger.addHandler(_StartingQueueHandler(queue.SimpleQueue()))
+
+    # Per-module levels, e.g. LOG_LEVELS="services=WARNING"
+    for name, level in _parse_levels(Config.LOG_LEVELS).items():
+        logging.getLogger(f"{LOGGER_NAME}.{name}").setLevel(level)
+    _configured = True
+
+
+def setup_logger(name=None):
+    # Safe to call from every module: handlers are only installed once.
+    # ``name`` (usually __name__) gives a child logger whose level can be set
+    # on its own through LOG_LEVELS.
+    if not _configured:
+        with _lock:
+            if not _configured:
+                _configure()
 
-    return logger
+    if not name:
+        return logging.getLogger(LOGGER_NAME)
+    if name.startswith("app."):
+        name = name[len("app."):]
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
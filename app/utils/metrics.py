@@ -0,0 +1,237 @@
+import math
+import threading
+import weakref
+from bisect import bisect_left
+
+# Upper bounds in seconds, suited to schedule-to-send lateness
+LATENESS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# Upper bounds in seconds for WhatsApp API round trips
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30)
+# Upper bounds in seconds for the phases of an API request
+REQUEST_PHASE_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+)
+
+# Every metric created, in creation order, for the /metrics endpoint
+registry = []
+
+
+class _Metric:
+    # Values are kept in one dict per thread, so recording never takes a
+    # lock or contends with other threads; reads merge the shards. A thread's
+    # shard is folded into a retired total once the thread is gone, so a
+    # server starting a thread per request doesn't pile them up.
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = {}
+        self._retired = {}
+        # Shards of finished threads, appended by their finalizers; folded
+        # under the lock by the next reader or new shard
+        self._dead = []
+        self._shards_lock = threading.Lock()
+        registry.append(self)
+
+    def _shard(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._shards_lock:
+                self._fold_dead()
+                self._shards[id(values)] = values
+            # The finalizer only appends: it can run during garbage
+            # collection on any thread, even one holding the lock
+            weakref.finalize(threading.current_thread(), self._dead.append, values)
+            return values
+
+    def _fold_dead(self):
+        while self._dead:
+            values = self._dead.pop()
+            del self._shards[id(values)]
+            self._merge(self._retired, values)
+
+    def _merged(self):
+        with self._shards_lock:
+            self._fold_dead()
+            merged = self._merge({}, self._retired)
+            # dict.copy() runs without releasing the GIL, so a shard is never
+            # read halfway through its owner adding a new label set
+            shards = [shard.copy() for shard in self._shards.values()]
+        for shard in shards:
+            self._merge(merged, shard)
+        return merged
+
+    def _merge(self, total, shard):
+        # Adds a shard's values into ``total`` per label set; metrics that
+        # keep more than a number per label set override this
+        for key, value in shard.items():
+            total[key] = total.get(key, 0) + value
+        return total
+
+    def _labels(self, key):
+        if not key:
+            return ""
+        pairs = ",".join(
+            f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)
+        )
+        return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self):
+        merged = self._merged()
+        if not self.labelnames:
+            # An unlabelled counter reads 0 before its first increment
+            merged.setdefault((), 0)
+        return merged
+
+    def total(self):
+        return sum(self.values().values())
+
+    def expose(self):
+        return [
+            f"{self.name}{self._labels(key)} {_format(value)}"
+            for key, value in sorted(self.values().items())
+        ]
+
+
+class Gauge(_Metric):
+    # Read at scrape time from ``collect``, which returns {label tuple: value}
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def values(self):
+        return self.collect() if self.collect else {}
+
+    def expose(self):
+        return [
+            f"{self.name}{self._labels(key)} {_format(value)}"
+            for key, value in sorted(self.values().items())
+        ]
+
+
+class Histogram(_Metric):
+    # Fixed-bucket histogram; each observation lands in the first bucket whose
+    # upper bound it doesn't exceed, with a final +Inf bucket for the rest.
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        row = shard.get(labels)
+        if row is None:
+            # Per-bucket counts followed by the sum and count of observations
+            row = shard[labels] = [0] * (len(self.bounds) + 2)
+        row[bisect_left(self.bounds, value)] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def _merge(self, total, shard):
+        for key, row in shard.items():
+            merged = total.setdefault(key, [0] * len(row))
+            for position, value in enumerate(row):
+                merged[position] += value
+        return total
+
+    def values(self):
+        return self._merged()
+
+    def _quantile(self, counts, count, q):
+        # Upper bound of the bucket holding the q-th observation
+        rank = q * count
+        seen = 0
+        for bound, bucket_count in zip(self.bounds, counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def snapshot(self, *labels):
+        # Summary across all label sets, or those starting with ``labels``,
+        # for the JSON status endpoints
+        rows = [row for key, row in self.values().items() if key[:len(labels)] == labels]
+        counts = [sum(column) for column in zip(*rows)] or [0] * (len(self.bounds) + 2)
+        total, count = counts[-2], counts[-1]
+        counts = counts[:-2]
+
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip(self.bounds, counts):
+            cumulative += bucket_count
+            buckets[_format(bound)] = cumulative
+
+        def quantile(q):
+            value = self._quantile(counts, count, q) if count else None
+            return None if value == math.inf else value
+
+        return {
+            "count": count,
+            "sum": round(total, 6),
+            "avg": round(total / count, 6) if count else None,
+            "p50": quantile(0.5),
+            "p99": quantile(0.99),
+            "buckets": buckets,
+        }
+
+    def expose(self):
+        lines = []
+        for key, row in sorted(self.values().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.bounds, row):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._bucket_labels(key, bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format(row[-2])}")
+            lines.append(f"{self.name}_count{self._labels(key)} {row[-1]}")
+        return lines
+
+    def _bucket_labels(self, key, bound):
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        pairs.append(f'le="{_format(bound)}"')
+        return "{" + ",".join(pairs) + "}"
+
+
+def render():
+    # Prometheus text exposition format (version 0.0.4)
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+# Actual send start minus scheduled run time, for every dispatched message
+dispatch_lateness = Histogram(
+    "whatsapp_dispatch_lateness_seconds",
+    "Time between a message's scheduled run time and the start of its send",
+    LATENESS_BUCKETS,
+)
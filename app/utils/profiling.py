@@ -0,0 +1,280 @@
+import os
+import re
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from app.config import Config
+from app.utils.logger import LOGGER_NAME, setup_logger
+from app.utils.metrics import REQUEST_PHASE_BUCKETS, Histogram
+
+logger = setup_logger(__name__)
+
+request_phase_seconds = Histogram(
+    "http_request_phase_seconds",
+    "Time spent in each phase of an API request, when REQUEST_TIMING is on",
+    REQUEST_PHASE_BUCKETS,
+    ("endpoint", "phase"),
+)
+
+# Phase name -> seconds for the request being handled in this context; None
+# outside an instrumented request, which makes phase() a no-op
+_timings = ContextVar("request_timings", default=None)
+_request_started = ContextVar("request_started", default=0.0)
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+class _Phase:
+    __slots__ = ("timings", "name", "started")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        # A phase entered more than once in a request (e.g. every log call)
+        # adds up
+        elapsed = time.perf_counter() - self.started
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+def phase(name):
+    # ``with phase("parse"): ...`` times a step of the current request. With
+    # REQUEST_TIMING off no request is instrumented and this returns a shared
+    # do-nothing context manager.
+    timings = _timings.get()
+    if timings is None:
+        return _NO_PHASE
+    return _Phase(timings, name)
+
+
+class TimedLock:
+    # Wraps a lock so the time spent acquiring it during a request shows up
+    # as its own phase, e.g. waits on the scheduler's job store lock
+    def __init__(self, lock, name):
+        self._lock = lock
+        self._name = name
+
+    def acquire(self, *args, **kwargs):
+        with phase(self._name):
+            return self._lock.acquire(*args, **kwargs)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+def _start_request():
+    _timings.set({})
+    _request_started.set(time.perf_counter())
+
+
+def _finish_request(response):
+    from flask import request
+
+    timings = _timings.get()
+    if timings is None:
+        return response
+    _timings.set(None)
+    timings["total"] = time.perf_counter() - _request_started.get()
+    endpoint = request.endpoint or "unknown"
+    for name, seconds in timings.items():
+        request_phase_seconds.observe(seconds, endpoint, name)
+    # Durations in ms, per https://www.w3.org/TR/server-timing/
+    response.headers["Server-Timing"] = ", ".join(
+        f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items()
+    )
+    return response
+
+
+def _clear_request(exc=None):
+    _timings.set(None)
+
+
+def init_request_timing(app, *blueprints):
+    # Times the requests of ``blueprints`` when REQUEST_TIMING is on. Each
+    # response gets a Server-Timing header with its phases and the total,
+    # and every phase is recorded in http_request_phase_seconds. Off, no hook
+    # is installed. Must run before the blueprints are registered.
+    if not app.config["REQUEST_TIMING"]:
+        return
+    for blueprint in blueprints:
+        blueprint.before_request(_start_request)
+        blueprint.after_request(_finish_request)
+        blueprint.teardown_request(_clear_request)
+
+    # Formatting and queueing log records happens on the request thread
+    import logging
+
+    for handler in logging.getLogger(LOGGER_NAME).handlers:
+        handle = handler.handle
+
+        def timed_handle(record, handle=handle):
+            with phase("log"):
+                return handle(record)
+
+        handler.handle = timed_handle
+    logger.info("Request timing enabled for %s", ", ".join(b.name for b in blueprints))
+
+
+def timing_snapshot():
+    # Per endpoint and phase summaries, for the /timings endpoint
+    endpoints = {}
+    for endpoint, name in sorted(request_phase_seconds.values()):
+        summary = request_phase_seconds.snapshot(endpoint, name)
+        del summary["buckets"]
+        endpoints.setdefault(endpoint, {})[name] = summary
+    return endpoints
+
+
+# Threads the profiler samples unless asked for all of them: the scheduler
+# loop, its executors' workers, broadcasts, the rate limiter's send queue,
+# pollers and the outcome writer
+SCHEDULER_THREADS = (
+    "APScheduler",
+    "ThreadPoolExecutor",
+    "asyncio-dispatch",
+    "batch-",
+    "broadcast",
+    "send-queue",
+    "outcome-writer",
+    "scheduler-poller",
+    "job-index-refresh",
+)
+
+
+def _thread_group(name):
+    # Workers of one pool share a stack root: ThreadPoolExecutor-0_3 and
+    # ThreadPoolExecutor-0_7 are both ThreadPoolExecutor
+    return re.sub(r"[-_]\d+", "", name)
+
+
+class SamplingProfiler:
+    # Takes a stack sample of the scheduler's threads every ``interval``
+    # seconds until stopped or ``seconds`` have passed, then writes the
+    # counts of identical stacks to a file in the collapsed ("folded")
+    # format read by flamegraph.pl and speedscope. Nothing runs while no
+    # profile is being taken.
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.last_profile = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = None
+        self._run_info = None
+
+    def start(self, seconds, interval, all_threads=False):
+        with self._lock:
+            if self._thread is not None:
+                raise RuntimeError("A profile is already being taken")
+            stop = threading.Event()
+            self._run_info = {
+                "started_at": datetime.now().isoformat(),
+                "seconds": seconds,
+                "interval_ms": interval * 1000,
+                "threads": "all" if all_threads else "scheduler",
+                "samples": 0,
+            }
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(stop, seconds, interval, all_threads),
+                name="sampling-profiler",
+                daemon=True,
+            )
+            self._stop = stop
+            self._thread.start()
+        logger.info("Profiling %s threads for up to %ss", self._run_info["threads"], seconds)
+
+    def stop(self):
+        # Ends the running profile early; returns the file written, or None
+        # if no profile was running
+        with self._lock:
+            thread, stop = self._thread, self._stop
+        if thread is None:
+            return None
+        stop.set()
+        thread.join()
+        return self.last_profile
+
+    def status(self):
+        with self._lock:
+            running = dict(self._run_info) if self._thread is not None else None
+        return {"running": running, "last_profile": self.last_profile}
+
+    def _sample(self, counts, all_threads):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        me = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            name = names.get(ident)
+            if ident == me or name is None:
+                continue
+            if not all_threads and not name.startswith(SCHEDULER_THREADS):
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            stack.append(_thread_group(name))
+            key = ";".join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+
+    def _run(self, stop, seconds, interval, all_threads):
+        counts = {}
+        deadline = time.monotonic() + seconds
+        try:
+            while not stop.wait(interval) and time.monotonic() < deadline:
+                self._sample(counts, all_threads)
+                self._run_info["samples"] += 1
+            path = self._write(counts)
+            logger.info(
+                "Profile of %s samples written to %s", self._run_info["samples"], path
+            )
+        except Exception as e:
+            path = None
+            logger.error("Profiling failed: %s", e, exc_info=True)
+        with self._lock:
+            self.last_profile = path
+            self._thread = None
+            self._stop = None
+
+    def _write(self, counts):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(
+            self.directory, f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.folded"
+        )
+        with open(path, "w") as f:
+            for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+profiler = SamplingProfiler(Config.PROFILE_DIR)
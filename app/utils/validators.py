@@ -1,57 +1,257 @@
+import time
 from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import pytz
 from app.config import Config
+from app.scheduler.recurrence import Recurrence
+from app.services.message_templates import TemplateMessage
 from app.utils.logger import setup_logger
 
-logger = setup_logger()
+logger = setup_logger(__name__)
 
+# Allowed zone names as a set, and each zone object resolved on first use
+# and kept, so a request never scans pytz.all_timezones or calls
+# pytz.timezone() again. The set itself is built on first use too: listing
+# the zones checks a file per zone.
+_zone_names = None
+_zones = {}
+_wall_clocks = {}
 
-def validate_request_data(data):
+
+class ValidationError(ValueError):
+    # Carries one message per offending field, e.g.
+    # {"schedule_time": "schedule_time must be in the future"}
+    def __init__(self, errors, missing=()):
+        self.errors = errors
+        self.missing = list(missing)
+        if self.missing:
+            message = f"Missing required fields: {', '.join(self.missing)}"
+        else:
+            message = "; ".join(errors.values())
+        super().__init__(message)
+
+
+def get_zone(name):
+    global _zone_names
+    zone = _zones.get(name)
+    if zone is None:
+        if _zone_names is None:
+            _zone_names = frozenset(Config.ALLOWED_TIMEZONES or pytz.all_timezones)
+        if name not in _zone_names:
+            return None
+        zone = _zones[name] = pytz.timezone(name)
+    return zone
+
+
+def localize(value, name):
+    # Same result as pytz's localize() for a naive local time, at a fraction
+    # of the cost: zoneinfo finds the UTC offset, and the result is converted
+    # to the pytz zone the rest of the app works with
+    wall_clock = _wall_clocks.get(name)
+    if wall_clock is None:
+        try:
+            wall_clock = _wall_clocks[name] = ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            wall_clock = _wall_clocks[name] = False
+    zone = get_zone(name)
+    if wall_clock is False:
+        return zone.localize(value)
+    local = value.replace(tzinfo=wall_clock)
+    if local.dst():
+        # A time repeated when the clocks go back: pytz takes the standard
+        # time one (is_dst=False), zoneinfo the first unless fold is set
+        later = local.replace(fold=1)
+        if not later.dst():
+            local = later
+    return local.astimezone(zone)
+
+
+def resolve_timezone(name=None):
+    # (name, zone) for a requested timezone, falling back to the default one
+    if name and name != Config.DEFAULT_TIMEZONE:
+        zone = get_zone(name)
+        if zone is not None:
+            return name, zone
+        logger.warning(
+            "Invalid timezone provided: %s, falling back to %s", name, Config.DEFAULT_TIMEZONE
+        )
+    return Config.DEFAULT_TIMEZONE, get_zone(Config.DEFAULT_TIMEZONE)
+
+
+def _text(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError("must be a non-empty string")
+    return value
+
+
+def _object(value):
+    if not isinstance(value, dict):
+        raise ValueError("must be a JSON object")
+    return value
+
+
+def _timezone(value):
+    if not isinstance(value, str) or get_zone(value) is None:
+        raise ValueError("must be a known timezone name")
+    return value
+
+
+def _seconds(value):
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise ValueError("must be a number of seconds")
+    return value
+
+
+def _priority(value):
+    if value not in Config.PRIORITY_LANES:
+        raise ValueError(f"must be one of: {', '.join(Config.PRIORITY_LANES)}")
+    return value
+
+
+def _datetime(value):
+    if not isinstance(value, str):
+        raise ValueError("must be an ISO 8601 date-time string")
     try:
-        # Check required fields
-        required_fields = [
-            "schedule_time",
-            "phone_number",
-            "message_data",
-            "auth_token",
-            "phone_number_id",
-        ]
-        missing_fields = [field for field in required_fields if field not in data]
-
-        if missing_fields:
-            logger.error(f"Missing required fields: {missing_fields}")
-            return False, f"Missing required fields: {', '.join(missing_fields)}"
-
-        # Use Dar es Salaam timezone by default if not specified
-        timezone = data.get("timezone", Config.DEFAULT_TIMEZONE)
-        if timezone not in Config.ALLOWED_TIMEZONES:
-            logger.warning(
-                f"Invalid timezone: {timezone}, using default: {Config.DEFAULT_TIMEZONE}"
-            )
-            timezone = Config.DEFAULT_TIMEZONE
+        return datetime.fromisoformat(value)
+    except ValueError as e:
+        raise ValueError(f"must be an ISO 8601 date-time ({str(e)})")
+
+
+def compile_schema(fields):
+    # fields: {name: (required, check)}, compiled once into the tuple of
+    # (name, required, check) the validation loop walks
+    return tuple((name, required, check) for name, (required, check) in fields.items())
 
-        # Validate schedule time format and ensure it's in the future
+
+COMMON_FIELDS = {
+    "schedule_time": (True, _datetime),
+    "phone_number": (True, _text),
+    "auth_token": (True, _text),
+    "phone_number_id": (True, _text),
+    "timezone": (False, _timezone),
+    "recurrence": (False, _object),
+    # Free-form tag for cancelling or moving a whole campaign at once
+    "campaign": (False, _text),
+    "priority": (False, _priority),
+}
+MESSAGE_SCHEMA = compile_schema({**COMMON_FIELDS, "message_data": (True, _object)})
+# Template messages give "template" (and "parameters") instead of message_data
+TEMPLATE_SCHEMA = compile_schema(
+    {**COMMON_FIELDS, "template": (True, _object), "parameters": (False, _object)}
+)
+# Broadcasts give everything a single message does except the recipient
+BROADCAST_FIELDS = {
+    name: field for name, field in COMMON_FIELDS.items() if name not in ("phone_number", "recurrence")
+}
+BROADCAST_SCHEMA = compile_schema({**BROADCAST_FIELDS, "message_data": (True, _object)})
+BROADCAST_TEMPLATE_SCHEMA = compile_schema(
+    {**BROADCAST_FIELDS, "template": (True, _object), "parameters": (False, _object)}
+)
+
+# Moving scheduled messages: a new schedule_time, or (in bulk) a number of
+# seconds to shift each one by
+RESCHEDULE_SCHEMA = compile_schema({
+    "schedule_time": (False, _datetime),
+    "shift_seconds": (False, _seconds),
+    "timezone": (False, _timezone),
+})
+
+CREDENTIAL_SCHEMA = compile_schema({"auth_token": (True, _text)})
+
+
+def validate_schema(schema, data):
+    # Returns the checked values, or raises ValidationError listing every
+    # missing and invalid field at once
+    values = {}
+    errors = {}
+    missing = []
+    for name, required, check in schema:
+        if name not in data:
+            if required:
+                missing.append(name)
+                errors[name] = f"{name} is required"
+            continue
         try:
-            tz = pytz.timezone(timezone)
-            schedule_time = datetime.fromisoformat(
-                data["schedule_time"].replace("Z", "+00:00")
-            )
-            schedule_time = schedule_time.astimezone(tz)
+            values[name] = check(data[name])
+        except ValueError as e:
+            errors[name] = f"{name} {e}"
+    if errors:
+        raise ValidationError(errors, missing)
+    return values
+
+
+def validate_message(data, now=None):
+    # Validates one message to schedule and returns its timezone-aware run
+    # date. Template messages get their compact TemplateMessage stored as
+    # data["message_data"], and recurring ones their Recurrence as
+    # data["recurrence"].
+    return _validate(data, now, MESSAGE_SCHEMA, TEMPLATE_SCHEMA)
+
+
+def validate_broadcast(data, now=None):
+    # The same for a broadcast's shared message definition
+    return _validate(data, now, BROADCAST_SCHEMA, BROADCAST_TEMPLATE_SCHEMA)
 
-            current_time = datetime.now(tz)
-            if schedule_time <= current_time:
-                logger.error(f"Schedule time {schedule_time} is in the past")
-                return False, "Schedule time must be in the future"
 
+def _validate(data, now, message_schema, template_schema):
+    if not isinstance(data, dict):
+        raise ValidationError({"body": "Message must be a JSON object"})
+
+    template = "template" in data
+    values = validate_schema(template_schema if template else message_schema, data)
+    timezone = values.get("timezone", Config.DEFAULT_TIMEZONE)
+    run_date = _run_date(values, timezone, now)
+
+    if "recurrence" in values:
+        # schedule_time is where the repeating schedule starts
+        try:
+            data["recurrence"] = Recurrence.from_request(values["recurrence"], run_date, timezone)
         except ValueError as e:
-            logger.error(f"Invalid schedule time format: {e}")
-            return (
-                False,
-                "Invalid schedule_time format. Use ISO format (e.g., 2025-01-20T15:30:00+03:00)",
+            raise ValidationError({"recurrence": str(e)})
+
+    if template:
+        # Jobs keep only a reference to the shared template and this
+        # recipient's parameters; the payload is rendered at send time
+        try:
+            data["message_data"] = TemplateMessage.from_request(
+                values["template"], values.get("parameters")
             )
+        except ValueError as e:
+            raise ValidationError({"template": str(e)})
+
+    return run_date
+
+
+def _run_date(values, timezone, now):
+    # Naive times are local to the requested (or default) timezone
+    run_date = values["schedule_time"]
+    if not run_date.tzinfo:
+        run_date = localize(run_date, timezone)
+    if run_date.timestamp() <= (time.time() if now is None else now):
+        raise ValidationError({"schedule_time": "schedule_time must be in the future"})
+    return run_date
+
+
+def validate_credential(data):
+    if not isinstance(data, dict):
+        raise ValidationError({"body": "Request body must be a JSON object"})
+    return validate_schema(CREDENTIAL_SCHEMA, data)["auth_token"]
 
-        return True, None
 
-    except Exception as e:
-        logger.error(f"Validation error: {str(e)}", exc_info=True)
-        return False, str(e)
+def validate_reschedule(data, now=None, allow_shift=False):
+    # (run date, None) for a new schedule_time, or (None, seconds) for a
+    # shift_seconds where allowed
+    if not isinstance(data, dict):
+        raise ValidationError({"body": "Request body must be a JSON object"})
+    values = validate_schema(RESCHEDULE_SCHEMA, data)
+    if allow_shift and ("schedule_time" in values) == ("shift_seconds" in values):
+        raise ValidationError({"body": "Give exactly one of schedule_time or shift_seconds"})
+    if "shift_seconds" in values:
+        if not allow_shift:
+            raise ValidationError({"shift_seconds": "shift_seconds is only accepted for bulk moves"})
+        return None, values["shift_seconds"]
+    if "schedule_time" not in values:
+        raise ValidationError({"schedule_time": "schedule_time is required"}, ["schedule_time"])
+    return _run_date(values, values.get("timezone", Config.DEFAULT_TIMEZONE), now), None
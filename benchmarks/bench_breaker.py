@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_graph_api
+
+workdir = tempfile.mkdtemp()
+# 503s: the API didn't take the requests, so they are retried where allowed
+base_url, state, server = fake_graph_api.start(
+    latency_ms=50, jitter_ms=0, error_rate=1.0, error_status=503
+)
+os.environ["WHATSAPP_API_URL"] = base_url
+os.environ.setdefault("LOG_DIR", workdir)
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+# Only the breaker and retry budget should hold sends back here
+os.environ.setdefault("WHATSAPP_RATE_LIMIT", "1000000")
+os.environ.setdefault("WHATSAPP_RATE_BURST", "1000000")
+
+from app.config import Config
+from app.services.circuit_breaker import CircuitOpenError, circuit_breakers
+from app.services.whatsapp_service import send_whatsapp_message
+
+WORKERS = 20
+BREAKER = dict(circuit_breakers.options)
+# What every send did before: three retries, and no circuit to open
+FIXED_RETRIES = dict(BREAKER, min_calls=10**9, retry_tokens=10**9)
+
+
+def run(count, options):
+    # ``count`` sends from WORKERS threads against an API failing every request
+    circuit_breakers.options = options
+    circuit_breakers._breakers.clear()
+    state.reset()
+    busy = []
+    lock = threading.Lock()
+
+    def worker(n):
+        for _ in range(n):
+            started = time.perf_counter()
+            try:
+                send_whatsapp_message(
+                    "255700000000", {"type": "text", "text": {"body": "hi"}}, "token", "1"
+                )
+            except CircuitOpenError:
+                pass
+            with lock:
+                busy.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(count // WORKERS,)) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    calls = state.stats()["counts"].get("messages_503", 0)
+    busy.sort()
+    return (
+        f"{len(busy)} sends in {elapsed:.1f}s, {calls} API calls, worker time per send "
+        f"p50 {busy[len(busy) // 2] * 1000:.0f}ms p99 {busy[int(len(busy) * 0.99)] * 1000:.0f}ms"
+    )
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"Graph API failing every request, {WORKERS} workers, {Config.SEND_MAX_RETRIES} retries")
+    print("fixed retries:  ", run(count, FIXED_RETRIES))
+    print("breaker, budget:", run(count, BREAKER))
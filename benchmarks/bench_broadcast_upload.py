@@ -0,0 +1,51 @@
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+workdir = tempfile.mkdtemp()
+os.environ.setdefault("LOG_DIR", workdir)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["BROADCAST_DB_PATH"] = os.path.join(workdir, "broadcasts.db")
+
+from app.services.broadcasts import broadcast_store, iter_csv_recipients
+
+
+def rss_mb():
+    with open("/proc/self/statm") as handle:
+        return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def recipient_csv(count):
+    # Header plus formatted numbers in random order, 5% of them repeated
+    numbers = list(range(255700000000, 255700000000 + count))
+    random.Random(1).shuffle(numbers)
+    numbers += numbers[: count // 20]
+    return io.BytesIO(
+        ("name,phone_number\n" + "".join(f"customer,+{number}\n" for number in numbers)).encode()
+    )
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    broadcast_store.create("bench", time.time() + 3600, "1234", "token", {"type": "text"})
+
+    upload = recipient_csv(count)
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    result = broadcast_store.add_recipients("bench", iter_csv_recipients(upload))
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"{result['received']:,} rows -> {result['added']:,} recipients "
+        f"({result['duplicates']:,} duplicates) in {elapsed:.2f}s, "
+        f"{result['received'] / elapsed:,.0f} rows/sec"
+    )
+    print(
+        f"database {os.path.getsize(os.environ['BROADCAST_DB_PATH']) / 2**20:.1f} MB, "
+        f"RSS growth during the upload {rss_mb() - rss_before:.1f} MB"
+    )
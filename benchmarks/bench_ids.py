@@ -0,0 +1,42 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.ids import new_id
+
+
+def bench_single(count):
+    started = time.perf_counter()
+    ids = [new_id() for _ in range(count)]
+    elapsed = time.perf_counter() - started
+    assert len(set(ids)) == count, "duplicate IDs generated"
+    assert ids == sorted(ids), "IDs are not monotonic"
+    return count / elapsed
+
+
+def bench_threads(count, threads):
+    results = [None] * threads
+
+    def worker(slot):
+        results[slot] = [new_id() for _ in range(count // threads)]
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    ids = [job_id for chunk in results for job_id in chunk]
+    assert len(set(ids)) == len(ids), "duplicate IDs generated across threads"
+    return len(ids) / elapsed
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"single thread: {bench_single(count):,.0f} ids/sec")
+    print(f"8 threads:     {bench_threads(count, 8):,.0f} ids/sec")
@@ -0,0 +1,83 @@
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Log calls made for one scheduled and sent message
+PAYLOAD = {
+    "messaging_product": "whatsapp",
+    "to": "255700000000",
+    "type": "template",
+    "template": {"name": "reminder", "language": {"code": "en_US"}},
+}
+
+
+def log_message_eager(logger):
+    logger.info(f"Received schedule message request")
+    logger.debug(f"Request data: {PAYLOAD}")
+    logger.info(f"Scheduling message with job ID: whatsapp_msg_1 for 2025-01-01")
+    logger.info(f"Message scheduled successfully: {PAYLOAD}")
+    logger.info(f"Sending WhatsApp message to {PAYLOAD['to']}")
+    logger.debug(f"Request payload: {PAYLOAD}")
+    logger.info(f"WhatsApp API Response status: 200")
+    logger.debug(f"WhatsApp API Response: {PAYLOAD}")
+
+
+def log_message_lazy(logger):
+    logger.info("Received schedule message request")
+    logger.debug("Request data: %s", PAYLOAD)
+    logger.info("Scheduling message with job ID: %s for %s", "whatsapp_msg_1", "2025-01-01")
+    logger.info("Message scheduled successfully: %s", "whatsapp_msg_1")
+    logger.info("Sending WhatsApp message to %s", PAYLOAD["to"])
+    logger.debug("Request payload: %s", PAYLOAD)
+    logger.info("WhatsApp API Response status: %s", 200)
+    logger.debug("WhatsApp API Response: %s", PAYLOAD)
+
+
+def legacy_logger(log_dir, copies=5):
+    # What the old setup_logger() produced after being imported by five
+    # modules: a DEBUG logger with five file/console handler pairs
+    logger = logging.getLogger("bench_legacy")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    formatter = logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s"
+    )
+    for _ in range(copies):
+        file_handler = logging.FileHandler(os.path.join(log_dir, "legacy.log"))
+        file_handler.setFormatter(formatter)
+        console_handler = logging.StreamHandler(open(os.devnull, "w"))
+        console_handler.setLevel(logging.INFO)
+        console_handler.setFormatter(formatter)
+        logger.addHandler(file_handler)
+        logger.addHandler(console_handler)
+    return logger
+
+
+def bench(logger, log_message, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        log_message(logger)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    log_dir = tempfile.mkdtemp()
+    os.environ.setdefault("LOG_DIR", log_dir)
+
+    legacy = bench(legacy_logger(log_dir), log_message_eager, count)
+
+    # Keep the console quiet while measuring; the file handler still writes
+    sys.stderr = open(os.devnull, "w")
+    from app.utils.logger import setup_logger
+
+    current = bench(setup_logger("bench"), log_message_lazy, count)
+    sys.stderr = sys.__stderr__
+
+    print(f"legacy setup:  {legacy:8.1f} us per message")
+    print(f"queued setup:  {current:8.1f} us per message (caller side)")
+    print(f"ratio:         {current / legacy:8.2%}")
@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+workdir = tempfile.mkdtemp()
+os.environ.setdefault("LOG_DIR", workdir)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["OUTCOME_DB_PATH"] = os.path.join(workdir, "outcomes.db")
+
+from app.services.outcomes import outcome_store
+
+
+def database_mb():
+    path = os.environ["OUTCOME_DB_PATH"]
+    # WAL contents count until they are checkpointed into the main file
+    return sum(
+        os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix)
+    ) / 2**20
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    send = {"status": "200", "latency": 0.0831, "attempts": 1}
+    now = time.time()
+
+    started = time.perf_counter()
+    for i in range(count):
+        result = {"messages": [{"id": f"wamid.HBgMMjU1NzAwMDAwMDAwFQIAERgSQ0Y{i:012d}"}]}
+        outcome_store.record(f"whatsapp_msg_{i:026d}", now, "104857600123456", result, send)
+    recorded = time.perf_counter() - started
+    outcome_store.flush()
+    written = time.perf_counter() - started
+
+    print(
+        f"record(): {recorded / count * 1e6:.2f}us per call on the job thread; "
+        f"{count:,} outcomes on disk after {written:.2f}s ({count / written:,.0f}/sec)"
+    )
+    outcome_store.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    size = database_mb()
+    print(f"database {size:.1f} MB, {size * 2**20 / count:.0f} bytes per outcome")
+
+    started = time.perf_counter()
+    lookups = 1000
+    for i in range(0, count, max(count // lookups, 1)):
+        outcome_store.get(f"whatsapp_msg_{i:026d}")
+    print(f"lookup by job id: {(time.perf_counter() - started) / lookups * 1e6:.0f}us")
+
+    # The older half of the history past retention
+    outcome_store.conn.execute(
+        "UPDATE outcomes SET finished_ts = finished_ts - ? WHERE rowid <= ?",
+        (outcome_store.retention + 1, count // 2),
+    )
+    started = time.perf_counter()
+    removed = outcome_store.prune()
+    outcome_store.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    print(
+        f"pruned {removed:,} in {time.perf_counter() - started:.2f}s, "
+        f"database {database_mb():.1f} MB after compaction"
+    )
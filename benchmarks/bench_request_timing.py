@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run(count):
+    # ``count`` POST /schedule-message and GET /scheduled-messages requests
+    # through the Flask test client, in a process whose REQUEST_TIMING is set
+    # by the parent
+    workdir = tempfile.mkdtemp()
+    os.environ.update(
+        LOG_DIR=workdir,
+        LOG_LEVEL="WARNING",
+        SCHEDULER_DB_PATH=os.path.join(workdir, "scheduler.db"),
+        OUTCOME_DB_PATH=os.path.join(workdir, "outcomes.db"),
+        CREDENTIALS_DB_PATH=os.path.join(workdir, "credentials.db"),
+    )
+    from app import create_app
+    from app.utils.profiling import phase
+
+    client = create_app().test_client()
+    body = {
+        "phone_number": "255700000000",
+        "phone_number_id": "1",
+        "auth_token": "token",
+        "message_data": {"type": "text", "text": {"body": "hi"}},
+        "schedule_time": "2099-01-01T00:00:00",
+        "timezone": "UTC",
+    }
+    client.post("/schedule-message", json=body)
+
+    started = time.perf_counter()
+    for _ in range(count):
+        client.post("/schedule-message", json=body)
+    schedule = (time.perf_counter() - started) / count
+    started = time.perf_counter()
+    for _ in range(count):
+        client.get("/scheduled-messages?limit=10")
+    listing = (time.perf_counter() - started) / count
+
+    def timed():
+        with phase("x"):
+            pass
+
+    per_phase = min(timeit.repeat(timed, number=100000, repeat=3)) / 100000
+    print(
+        f"schedule {schedule * 1e6:7.0f}us  list {listing * 1e6:7.0f}us  "
+        f"phase() outside a timed request {per_phase * 1e9:.0f}ns"
+    )
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    if os.environ.get("BENCH_CHILD"):
+        run(count)
+    else:
+        for enabled in ("0", "1"):
+            print(f"REQUEST_TIMING={enabled}: ", end="", flush=True)
+            subprocess.run(
+                [sys.executable, __file__, str(count)],
+                env=dict(os.environ, BENCH_CHILD="1", REQUEST_TIMING=enabled),
+                check=True,
+            )
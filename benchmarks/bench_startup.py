@@ -0,0 +1,135 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Tracked with the code, so a change that slows startup down shows up
+# against it. Refresh it with --update-baseline when startup gets faster or
+# the reference machine changes.
+BASELINE = os.path.join(ROOT, "benchmarks", "startup_baseline.json")
+
+# What each entry point costs to import in a fresh interpreter, and modules
+# it must not pull in. Light entry points are what CLI tools, bulk importers
+# and the dispatcher's argument parsing load.
+ENTRY_POINTS = {
+    "app": ("import app", ("flask", "apscheduler", "requests", "pytz")),
+    "app.config": ("import app.config", ("flask", "apscheduler", "requests", "pytz")),
+    "app.dispatcher": ("import app.dispatcher", ("flask", "apscheduler", "requests")),
+    "app.services.broadcasts": (
+        "import app.services.broadcasts", ("flask", "apscheduler", "requests"),
+    ),
+    "app.services.whatsapp_service": (
+        "import app.services.whatsapp_service", ("flask", "apscheduler", "requests", "aiohttp"),
+    ),
+    "app.utils.validators": ("import app.utils.validators", ("flask", "apscheduler", "requests")),
+    "create_app": ("from app import create_app; create_app()", ()),
+    # An API worker, whose scheduler waits for the first scheduling request
+    "create_app (api)": (
+        "import os; os.environ['SCHEDULER_ROLE'] = 'api'\n"
+        "from app import create_app; create_app()",
+        (),
+    ),
+}
+# A run slower than the baseline by more than TOLERANCE is reported, and
+# by more than FAIL_RATIO fails, along with forbidden imports. The failure
+# threshold is generous: timings vary between runs and machines, but not
+# by twice over.
+TOLERANCE = 1.5
+FAIL_RATIO = 2.0
+# Differences below this are noise, whatever the ratio
+SLACK_MS = 15
+TOP_MODULES = 8
+
+
+def import_times(code, env):
+    # Runs ``code`` in a fresh interpreter under -X importtime. Returns its
+    # wall time in ms (which for create_app() includes more than imports),
+    # the self time in ms of what it imported, per app module and per
+    # third-party or stdlib package, and the modules it loaded.
+    timed = (
+        "import sys, time; preloaded = set(sys.modules); started = time.perf_counter()\n"
+        f"{code}\n"
+        "elapsed = time.perf_counter() - started\n"
+        "print(elapsed * 1000); print(' '.join(set(sys.modules) - preloaded))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", timed],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    elapsed, modules = out.stdout.splitlines()[-2:]
+    modules = set(modules.split())
+    self_ms = {}
+    for line in out.stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            self_us, _, name = line[len("import time:"):].split("|")
+            name = name.strip()
+            if name in modules:
+                key = name if name.startswith("app.") else name.split(".")[0]
+                self_ms[key] = self_ms.get(key, 0.0) + int(self_us) / 1000
+    return float(elapsed), self_ms, modules
+
+
+def measure(runs):
+    workdir = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        LOG_DIR=workdir,
+        LOG_LEVEL="CRITICAL",
+        SCHEDULER_DB_PATH=os.path.join(workdir, "scheduler.db"),
+        OUTCOME_DB_PATH=os.path.join(workdir, "outcomes.db"),
+        BROADCAST_DB_PATH=os.path.join(workdir, "broadcasts.db"),
+        CREDENTIALS_DB_PATH=os.path.join(workdir, "credentials.db"),
+    )
+    results = {}
+    for name, (code, forbidden) in ENTRY_POINTS.items():
+        # Best of ``runs``: the first run also warms the bytecode cache
+        samples = [import_times(code, env) for _ in range(runs)]
+        elapsed, self_ms, modules = min(samples, key=lambda sample: sample[0])
+        loaded = sorted(module for module in forbidden if module in modules)
+        results[name] = {"ms": round(elapsed, 1), "modules": self_ms, "forbidden": loaded}
+    return results
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 5
+    update = "--update-baseline" in sys.argv
+    results = measure(runs)
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+
+    failed = []
+    slower = []
+    too_slow = []
+    print(f"{'entry point':32} {'ms':>8} {'baseline':>9}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        print(f"{name:32} {result['ms']:8.1f} {before if before is not None else '-':>9}")
+        slowest = sorted(result["modules"].items(), key=lambda item: -item[1])[:TOP_MODULES]
+        for module, ms in slowest:
+            print(f"    {module:40} {ms:7.1f}")
+        if result["forbidden"]:
+            failed.append(f"{name} imports {', '.join(result['forbidden'])}")
+        if before is None:
+            continue
+        if result["ms"] > max(before * FAIL_RATIO, before + SLACK_MS):
+            too_slow.append(f"{name} took {result['ms']}ms, baseline {before}ms")
+        elif result["ms"] > max(before * TOLERANCE, before + SLACK_MS):
+            slower.append(f"{name} took {result['ms']}ms, baseline {before}ms")
+
+    if slower:
+        print("\n".join(["", "Slower than the baseline:"] + slower))
+    if update or not baseline:
+        with open(BASELINE, "w") as f:
+            json.dump({name: result["ms"] for name, result in results.items()}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {BASELINE}")
+    if too_slow and not update:
+        print("\n".join(["", f"More than {FAIL_RATIO:g}x slower than the baseline:"] + too_slow))
+    if failed:
+        print("\n".join(["", "Forbidden imports:"] + failed))
+    if (too_slow and not update) or failed:
+        sys.exit(1)
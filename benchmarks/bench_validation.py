@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("LOG_DIR", tempfile.mkdtemp())
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("SCHEDULER_JOBSTORE", "memory")
+
+import pytz
+
+from app.config import Config
+from app.utils.validators import resolve_timezone, validate_message
+
+REQUIRED_FIELDS = ["schedule_time", "phone_number", "message_data", "auth_token", "phone_number_id"]
+
+
+def request_body(timezone="Africa/Nairobi"):
+    return {
+        "schedule_time": (datetime.now() + timedelta(days=1)).replace(microsecond=0).isoformat(),
+        "phone_number": "255700000000",
+        "message_data": {"type": "text", "text": {"body": "hello"}},
+        "auth_token": "token",
+        "phone_number_id": "1234",
+        "timezone": timezone,
+    }
+
+
+def validate_previous(data):
+    # What a request used to pay: a scan of pytz.all_timezones, a fresh
+    # pytz.timezone() and a required-field list built per call
+    missing = [field for field in REQUIRED_FIELDS if field not in data]
+    if missing:
+        raise ValueError(f"Missing required fields: {', '.join(missing)}")
+    timezone = data.get("timezone", Config.DEFAULT_TIMEZONE)
+    if timezone not in pytz.all_timezones:
+        timezone = Config.DEFAULT_TIMEZONE
+    tz = pytz.timezone(timezone)
+    schedule_time = datetime.fromisoformat(data["schedule_time"])
+    if not schedule_time.tzinfo:
+        schedule_time = tz.localize(schedule_time)
+    if schedule_time <= datetime.now(tz):
+        raise ValueError("Schedule time must be in the future")
+    return schedule_time
+
+
+def validate_current(data):
+    run_date = validate_message(data)
+    resolve_timezone(data.get("timezone"))
+    return run_date
+
+
+def bench(validate, data, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        validate(data)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def bench_endpoint(count):
+    from app import create_app
+    from app.scheduler.scheduler import scheduler
+
+    client = create_app().test_client()
+    data = request_body()
+    started = time.perf_counter()
+    for _ in range(count):
+        response = client.post("/schedule-message", json=data)
+        assert response.status_code == 201, response.json
+    elapsed = time.perf_counter() - started
+    scheduler.shutdown(wait=False)
+    return count / elapsed
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    for timezone in ("Africa/Nairobi", "America/New_York", "UTC"):
+        data = request_body(timezone)
+        previous = bench(validate_previous, data, count)
+        current = bench(validate_current, data, count)
+        print(f"{timezone:<18} previous {previous:6.2f} us   compiled {current:6.2f} us   ({previous / current:4.1f}x)")
+
+    print(f"/schedule-message:  {bench_endpoint(count // 10):,.0f} requests/sec (test client, memory store)")
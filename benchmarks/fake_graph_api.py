@@ -0,0 +1,264 @@
+import argparse
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the parts of the WhatsApp Graph API this app calls:
+#   POST /<version>/<phone_number_id>/messages
+#   GET|POST /<version>/<phone_number_id>/message_templates
+#   GET /<version>/<phone_number_id> (token checks)
+# plus GET /_stats and POST /_reset for load tests. Point the app at it with
+#   WHATSAPP_API_URL=http://127.0.0.1:8090
+# Only the standard library is used, so it runs anywhere the app does.
+
+ROUTE = re.compile(r"^/(?P<version>v[\d.]+)/(?P<phone_number_id>[^/]+)/(?P<edge>messages|message_templates)$")
+PHONE_NUMBER_ROUTE = re.compile(r"^/(?P<version>v[\d.]+)/(?P<phone_number_id>[^/]+)$")
+
+
+class FakeGraphState:
+    def __init__(self, latency_ms=50, jitter_ms=10, error_rate=0.0, throttle_rate=0.0,
+                 rate_limit=0, retry_after=1, seed=None, error_status=500):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.error_rate = error_rate
+        # 500 may have delivered the message, so senders don't retry it; 503
+        # (without Retry-After) says it didn't
+        self.error_status = error_status
+        self.throttle_rate = throttle_rate
+        # Sends per second per phone_number_id before real 429s (0 = no limit)
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # Tokens answered as expired, for credential checks
+        self.revoked_tokens = set()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.message_ids = itertools.count(1)
+            self.counts = {}
+            self.arrivals = []
+            self.windows = {}
+            self.templates = {}
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def over_rate_limit(self, phone_number_id):
+        if not self.rate_limit:
+            return False
+        second = int(time.time())
+        with self.lock:
+            window, sent = self.windows.get(phone_number_id, (second, 0))
+            if window != second:
+                window, sent = second, 0
+            self.windows[phone_number_id] = (window, sent + 1)
+            return sent >= self.rate_limit
+
+    def stats(self, include_arrivals=False):
+        with self.lock:
+            arrivals = list(self.arrivals)
+            stats = {"counts": dict(self.counts), "messages": len(arrivals)}
+        if arrivals:
+            stats["first_arrival"] = min(arrivals)
+            stats["last_arrival"] = max(arrivals)
+        if include_arrivals:
+            stats["arrivals"] = arrivals
+        return stats
+
+
+def _graph_error(code, message, error_type="OAuthException"):
+    return {"error": {"message": message, "type": error_type, "code": code, "fbtrace_id": "fake"}}
+
+
+class FakeGraphHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(body) if body else {}
+        except ValueError:
+            return None
+
+    def _reply(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self, phone_number_id, edge):
+        # Returns an error reply to send instead of the normal one, if any
+        state = self.state
+        delay = max(state.latency + state.random.uniform(-state.jitter, state.jitter), 0)
+        if delay:
+            time.sleep(delay)
+        authorization = self.headers.get("Authorization", "")
+        if (
+            not authorization.startswith("Bearer ")
+            or authorization[len("Bearer "):] in state.revoked_tokens
+        ):
+            return 401, _graph_error(190, "Invalid OAuth access token"), None
+        if edge == "messages" and (
+            state.over_rate_limit(phone_number_id) or state.random.random() < state.throttle_rate
+        ):
+            return (
+                429,
+                _graph_error(130429, "Rate limit hit", "OAuthException"),
+                {"Retry-After": str(state.retry_after)},
+            )
+        if state.random.random() < state.error_rate:
+            return state.error_status, _graph_error(2, "Service temporarily unavailable"), None
+        return None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/_stats":
+            include = "arrivals" in parse_qs(url.query).get("include", [""])[0]
+            return self._reply(200, self.state.stats(include))
+        match = PHONE_NUMBER_ROUTE.match(url.path)
+        if match:
+            failure = self._simulate(match["phone_number_id"], "phone_number")
+            if failure:
+                self.state.count(f"phone_number_{failure[0]}")
+                return self._reply(*failure)
+            self.state.count("phone_number_200")
+            return self._reply(200, {"id": match["phone_number_id"]})
+        match = ROUTE.match(url.path)
+        if not match or match["edge"] != "message_templates":
+            return self._reply(404, _graph_error(803, "Unknown path"))
+
+        failure = self._simulate(match["phone_number_id"], "message_templates")
+        if failure:
+            self.state.count(f"templates_{failure[0]}")
+            return self._reply(*failure)
+        self.state.count("templates_200")
+        with self.state.lock:
+            templates = list(self.state.templates.get(match["phone_number_id"], {}).values())
+        self._reply(200, {"data": templates, "paging": {"cursors": {}}})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/_reset":
+            self._read_json()
+            self.state.reset()
+            return self._reply(200, {"reset": True})
+        match = ROUTE.match(url.path)
+        if not match:
+            return self._reply(404, _graph_error(803, "Unknown path"))
+
+        payload = self._read_json()
+        edge = match["edge"]
+        if payload is None:
+            self.state.count(f"{edge}_400")
+            return self._reply(400, _graph_error(100, "Invalid JSON body", "GraphMethodException"))
+
+        failure = self._simulate(match["phone_number_id"], edge)
+        if failure:
+            self.state.count(f"{edge}_{failure[0]}")
+            return self._reply(*failure)
+
+        if edge == "messages":
+            if not payload.get("to"):
+                self.state.count("messages_400")
+                return self._reply(400, _graph_error(100, "Missing recipient", "GraphMethodException"))
+            with self.state.lock:
+                message_id = next(self.state.message_ids)
+                self.state.arrivals.append(time.time())
+            self.state.count("messages_200")
+            return self._reply(200, {
+                "messaging_product": "whatsapp",
+                "contacts": [{"input": payload["to"], "wa_id": payload["to"]}],
+                "messages": [{"id": f"wamid.FAKE{message_id:012d}"}],
+            })
+
+        template_id = str(abs(hash((match["phone_number_id"], payload.get("name")))))
+        template = {
+            "id": template_id,
+            "name": payload.get("name"),
+            "language": payload.get("language"),
+            "category": payload.get("category"),
+            "components": payload.get("components", []),
+            "status": "APPROVED",
+        }
+        with self.state.lock:
+            self.state.templates.setdefault(match["phone_number_id"], {})[template_id] = template
+        self.state.count("message_templates_200")
+        self._reply(200, {"id": template_id, "status": "PENDING", "category": payload.get("category")})
+
+
+class FakeGraphServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Read by the constructor's listen(), so a burst of new connections
+    # (e.g. a whole dispatch batch) isn't dropped by a short accept backlog
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up before the reply; that's theirs to report
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def start(host="127.0.0.1", port=0, **options):
+    # Serves on a background thread; returns (base url, state, server)
+    state = FakeGraphState(**options)
+    handler = type("Handler", (FakeGraphHandler,), {"state": state})
+    server = FakeGraphServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="fake-graph-api", daemon=True).start()
+    return f"http://{host}:{server.server_port}", state, server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake WhatsApp Graph API for local load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=50, help="mean response latency")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="+/- uniform latency jitter")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of error replies")
+    parser.add_argument("--error-status", type=int, default=500, help="status of error replies")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of sends answered with 429")
+    parser.add_argument("--rate-limit", type=int, default=0, help="sends/sec per phone_number_id before 429s")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds on 429s")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    url, _, server = start(
+        args.host,
+        args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        throttle_rate=args.throttle_rate,
+        rate_limit=args.rate_limit,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    # First line of output is the address, for scripts that start it with --port 0
+    print(url, flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Drives a real app server (in this process, over HTTP) against the fake
+# Graph API (in a subprocess) and writes the results to JSON, e.g.
+#   python benchmarks/load_test.py --dispatch-mode asyncio --output new.json --compare old.json
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(values, scale=1000.0):
+    # Latencies in milliseconds
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * scale, 3) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * scale, 3) if values else None,
+        "max_ms": round(max(values) * scale, 3) if values else None,
+    }
+
+
+def rss_mb():
+    with open("/proc/self/statm") as handle:
+        pages = int(handle.read().split()[1])
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def start_fake_api(args):
+    command = [
+        sys.executable,
+        os.path.join(ROOT, "benchmarks", "fake_graph_api.py"),
+        "--port", "0",
+        "--latency-ms", str(args.latency_ms),
+        "--jitter-ms", str(args.jitter_ms),
+        "--error-rate", str(args.error_rate),
+        "--throttle-rate", str(args.throttle_rate),
+        "--rate-limit", str(args.api_rate_limit),
+        "--seed", "1",
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return process.stdout.readline().strip(), process
+
+
+def start_app():
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    # One access log line per request would dominate the measurements
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, name="app-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def message(index, run_at, senders, payload, priority=None):
+    item = {
+        "schedule_time": run_at.isoformat(),
+        "phone_number": f"2557{index:08d}",
+        "auth_token": "load-test-token",
+        "phone_number_id": f"10000{index % senders}",
+    }
+    if priority:
+        item["priority"] = priority
+    if payload == "template":
+        item["template"] = {"name": "load_test", "language": "en_US"}
+        item["parameters"] = {"body": [f"customer {index}", "10:00"]}
+    else:
+        item["message_data"] = {"type": "text", "text": {"body": f"Load test message {index}"}}
+    return item
+
+
+def run_schedule(base_url, args):
+    # Open loop: requests start at the target rate whether or not earlier
+    # ones have finished, up to --concurrency in flight
+    import requests
+
+    local = threading.local()
+    run_at = datetime.now(timezone.utc) + timedelta(days=1)
+    latencies, errors = [], []
+
+    def send(index):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = session.post(
+                f"{base_url}/schedule-message", json=message(index, run_at, args.senders, args.payload)
+            )
+            elapsed = time.perf_counter() - started
+            if response.status_code == 201:
+                latencies.append(elapsed)
+            else:
+                errors.append(response.status_code)
+        except requests.RequestException as e:
+            errors.append(type(e).__name__)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for index in range(args.schedule_count):
+            delay = started + index / args.schedule_rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, index)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "target_rate": args.schedule_rate,
+        "achieved_rate": round(len(latencies) / elapsed, 1),
+        "errors": len(errors),
+        "latency": summarize(latencies),
+        "rss_mb": rss_mb(),
+    }
+
+
+def bulk_body(count, run_at, senders, payload, offset=0, priority=None):
+    for index in range(offset, offset + count):
+        item = message(index, run_at, senders, payload, priority)
+        yield (json.dumps(item) + "\n").encode("utf-8")
+
+
+def run_bulk(base_url, count, run_at, args, offset=0, priority=None):
+    import requests
+
+    started = time.perf_counter()
+    response = requests.post(
+        f"{base_url}/schedule-messages/bulk",
+        data=bulk_body(count, run_at, args.senders, args.payload, offset, priority),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    elapsed = time.perf_counter() - started
+    summary = json.loads(response.text.strip().splitlines()[-1])
+    return {
+        "count": count,
+        "scheduled": summary.get("scheduled"),
+        "failed": summary.get("failed"),
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(count / elapsed, 1),
+        "rss_mb": rss_mb(),
+    }
+
+
+def run_dispatch(base_url, fake_url, args):
+    # Everything is due at the same instant; lateness is each send's arrival
+    # at the fake API minus that instant
+    import requests
+
+    requests.post(f"{fake_url}/_reset")
+    run_at = datetime.now(timezone.utc) + timedelta(seconds=args.dispatch_lead)
+    bulk = run_bulk(base_url, args.dispatch_count, run_at, args, offset=10**7)
+    due = run_at.timestamp()
+    if time.time() > due:
+        print("warning: scheduling finished after the run time; raise --dispatch-lead", file=sys.stderr)
+
+    deadline = due + args.dispatch_timeout
+    peak = rss_mb()
+    while time.time() < deadline:
+        stats = requests.get(f"{fake_url}/_stats").json()
+        peak = max(peak, rss_mb())
+        # Done once every message got a reply, including injected errors
+        replies = sum(
+            count for key, count in stats["counts"].items() if key.startswith("messages_")
+        )
+        if replies >= args.dispatch_count:
+            break
+        time.sleep(0.25)
+
+    stats = requests.get(f"{fake_url}/_stats", params={"include": "arrivals"}).json()
+    arrivals = stats.get("arrivals", [])
+    lateness = [max(arrival - due, 0.0) for arrival in arrivals]
+    span = (max(arrivals) - min(arrivals)) if len(arrivals) > 1 else None
+    return {
+        "count": args.dispatch_count,
+        "scheduling": bulk,
+        "delivered": len(arrivals),
+        "api_replies": stats.get("counts", {}),
+        "sends_per_second": round(len(arrivals) / span, 1) if span else None,
+        "seconds_to_last_send": round(max(arrivals) - due, 3) if arrivals else None,
+        "lateness": summarize(lateness),
+        "rss_mb": peak,
+    }
+
+
+def run_priority(base_url, args):
+    # A bulk-lane burst due at one instant, and transactional messages
+    # scheduled every --probe-interval seconds while it drains. Lateness is
+    # when each send started (from the outcome history) minus its run time.
+    import requests
+    from app.scheduler.scheduler import lane_backlog
+    from app.services.outcomes import outcome_store
+
+    run_at = datetime.now(timezone.utc) + timedelta(seconds=args.dispatch_lead)
+    bulk = run_bulk(base_url, args.dispatch_count, run_at, args, offset=2 * 10**7, priority="bulk")
+    time.sleep(max(run_at.timestamp() - time.time(), 0) + 1)
+
+    session = requests.Session()
+    probes, refused = [], 0
+    backlog = []
+    for index in range(int(args.probe_seconds / args.probe_interval)):
+        item = message(3 * 10**7 + index, datetime.now(timezone.utc) + timedelta(seconds=0.5),
+                       args.senders, args.payload, "transactional")
+        response = session.post(f"{base_url}/schedule-message", json=item)
+        if response.status_code == 201:
+            probes.append(response.json()["job_id"])
+        else:
+            refused += 1
+        backlog.append(lane_backlog("bulk"))
+        time.sleep(args.probe_interval)
+
+    def lateness(job_ids):
+        values = []
+        for job_id in job_ids:
+            for outcome in outcome_store.get(job_id, 1):
+                started = outcome["finished_ts"] - (outcome["latency_ms"] or 0) / 1000
+                values.append(max(started - outcome["run_ts"], 0.0))
+        return values
+
+    deadline = time.time() + args.dispatch_timeout
+    transactional = lateness(probes)
+    while len(transactional) < len(probes) and time.time() < deadline:
+        time.sleep(0.5)
+        transactional = lateness(probes)
+    # The rest of the burst has to drain before the fake API stops
+    while lane_backlog("bulk") and time.time() < deadline:
+        time.sleep(0.25)
+    return {
+        "bulk": bulk,
+        "bulk_seconds_to_drain": round(time.time() - run_at.timestamp(), 3),
+        # Bulk jobs submitted and not finished while the probes ran
+        "bulk_backlog_min": min(backlog) if backlog else None,
+        "transactional_sent": len(transactional),
+        "transactional_refused": refused,
+        "transactional_lateness": summarize(transactional),
+    }
+
+
+def compare(previous, current):
+    # Headline numbers side by side with the relative change
+    def pick(results):
+        scenarios = results.get("scenarios", {})
+        return {
+            "schedule p50 ms": scenarios.get("schedule", {}).get("latency", {}).get("p50_ms"),
+            "schedule p99 ms": scenarios.get("schedule", {}).get("latency", {}).get("p99_ms"),
+            "bulk msgs/s": scenarios.get("bulk", {}).get("messages_per_second"),
+            "dispatch sends/s": scenarios.get("dispatch", {}).get("sends_per_second"),
+            "lateness p50 ms": scenarios.get("dispatch", {}).get("lateness", {}).get("p50_ms"),
+            "lateness p99 ms": scenarios.get("dispatch", {}).get("lateness", {}).get("p99_ms"),
+            "txn lateness p99 ms": scenarios.get("priority", {}).get("transactional_lateness", {}).get("p99_ms"),
+            "peak rss MB": results.get("peak_rss_mb"),
+        }
+
+    before, after = pick(previous), pick(current)
+    print(f"{'metric':<20}{previous.get('revision') or 'before':>14}{current.get('revision') or 'after':>14}{'change':>10}")
+    for name in before:
+        old, new = before[name], after[name]
+        change = f"{(new - old) / old:+.1%}" if old and new is not None else ""
+        print(f"{name:<20}{str(old):>14}{str(new):>14}{change:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the scheduler against a fake Graph API")
+    parser.add_argument("--scenarios", default="schedule,bulk,dispatch")
+    parser.add_argument("--schedule-count", type=int, default=2000)
+    parser.add_argument("--schedule-rate", type=float, default=200, help="requests per second")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--bulk-count", type=int, default=20000)
+    parser.add_argument("--dispatch-count", type=int, default=5000)
+    parser.add_argument("--dispatch-lead", type=float, default=10, help="seconds until the run time")
+    parser.add_argument("--dispatch-timeout", type=float, default=120)
+    parser.add_argument("--probe-seconds", type=float, default=10, help="priority: how long to send probes")
+    parser.add_argument("--probe-interval", type=float, default=0.1, help="priority: seconds between probes")
+    parser.add_argument("--senders", type=int, default=50, help="distinct phone_number_ids")
+    parser.add_argument("--payload", choices=("text", "template"), default="text")
+    parser.add_argument("--dispatch-mode", default=None, help="SCHEDULER_DISPATCH_MODE for the app")
+    parser.add_argument("--jobstore", default=None, help="SCHEDULER_JOBSTORE for the app")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--api-rate-limit", type=int, default=0)
+    parser.add_argument("--output", default=None, help="results file (default benchmarks/results/)")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare with")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    fake_url, fake_process = start_fake_api(args)
+
+    # The app reads its configuration at import time
+    os.environ["WHATSAPP_API_URL"] = fake_url
+    os.environ["SCHEDULER_DB_PATH"] = os.path.join(workdir, "scheduler.db")
+    os.environ["OUTCOME_DB_PATH"] = os.path.join(workdir, "outcomes.db")
+    os.environ["LOG_DIR"] = os.path.join(workdir, "logs")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if args.dispatch_mode:
+        os.environ["SCHEDULER_DISPATCH_MODE"] = args.dispatch_mode
+    if args.jobstore:
+        os.environ["SCHEDULER_JOBSTORE"] = args.jobstore
+
+    from app.config import Config
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            **{key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "dispatch_mode": Config.SCHEDULER_DISPATCH_MODE,
+            "jobstore": Config.SCHEDULER_JOBSTORE,
+        },
+        "scenarios": {},
+    }
+
+    base_url, server = start_app()
+    results["startup_rss_mb"] = rss_mb()
+    try:
+        scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+        if "schedule" in scenarios:
+            results["scenarios"]["schedule"] = run_schedule(base_url, args)
+        if "bulk" in scenarios:
+            run_at = datetime.now(timezone.utc) + timedelta(days=2)
+            results["scenarios"]["bulk"] = run_bulk(base_url, args.bulk_count, run_at, args)
+        if "dispatch" in scenarios:
+            results["scenarios"]["dispatch"] = run_dispatch(base_url, fake_url, args)
+        if "priority" in scenarios:
+            results["scenarios"]["priority"] = run_priority(base_url, args)
+    finally:
+        server.shutdown()
+        fake_process.terminate()
+        from app.scheduler.scheduler import scheduler
+
+        scheduler.shutdown(wait=False)
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"load_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump(results, handle, indent=2)
+    print(json.dumps(results["scenarios"], indent=2))
+    print(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            compare(json.load(handle), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Config reads its settings when app.config is first imported, so every
+# store points at a scratch directory before any test imports the app.
+# Nothing in these tests is due soon enough to be sent.
+DATA_DIR = tempfile.mkdtemp(prefix="scheduler-tests-")
+os.environ.update(
+    LOG_DIR=os.path.join(DATA_DIR, "logs"),
+    LOG_LEVEL="WARNING",
+    SCHEDULER_DB_PATH=os.path.join(DATA_DIR, "scheduler.db"),
+    OUTCOME_DB_PATH=os.path.join(DATA_DIR, "outcomes.db"),
+    CREDENTIALS_DB_PATH=os.path.join(DATA_DIR, "credentials.db"),
+    BROADCAST_DB_PATH=os.path.join(DATA_DIR, "broadcasts.db"),
+    WHATSAPP_API_URL="http://127.0.0.1:9",
+)
+
+
+@pytest.fixture(scope="session")
+def app():
+    # One app for the whole run: the scheduler is a module-level singleton
+    from app import create_app
+    from app.scheduler.scheduler import scheduler
+
+    app = create_app()
+    yield app
+    scheduler.shutdown(wait=False)
+
+
+@pytest.fixture(scope="session")
+def graph_server():
+    # benchmarks/fake_graph_api.py on a free port, for the whole run
+    sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+    import fake_graph_api
+
+    url, _, server = fake_graph_api.start()
+    yield url, server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def graph_api(graph_server, monkeypatch):
+    # Points sends at the fake Graph API, answering without delay. Yields a
+    # fresh state for the test, which counts the requests it got.
+    import fake_graph_api
+    from app.config import Config
+
+    url, server = graph_server
+    state = fake_graph_api.FakeGraphState(latency_ms=0, jitter_ms=0)
+    monkeypatch.setattr(server.RequestHandlerClass, "state", state)
+    monkeypatch.setattr(Config, "WHATSAPP_API_URL", url)
+    return state
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def in_hours(hours):
+    return (datetime.now(timezone.utc) + timedelta(hours=hours)).isoformat()
+
+
+@pytest.fixture
+def message():
+    # A valid /schedule-message body, an hour out, with fields overridden
+    def build(**fields):
+        body = {
+            "phone_number": "255700000001",
+            "phone_number_id": "1001",
+            "auth_token": "test-token",
+            "message_data": {"type": "text", "text": {"body": "hello"}},
+            "schedule_time": in_hours(1),
+            "timezone": "UTC",
+        }
+        body.update(fields)
+        return body
+
+    return build
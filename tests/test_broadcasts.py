@@ -0,0 +1,130 @@
+import io
+import time
+
+import pytest
+
+from app.services.broadcasts import (
+    _iter_lines,
+    broadcast_store,
+    normalize_phone,
+    send_broadcast,
+)
+from app.services.rate_limiter import TokenBucket, rate_limiter
+from app.utils.ids import new_id
+
+TEXT = {"type": "text", "text": {"body": "hello"}}
+
+
+@pytest.fixture
+def broadcast():
+    # A scheduled broadcast from phone_number_id ``sender`` to ``count``
+    # recipients; returns its id
+    def create(sender, count, auth_token="token"):
+        broadcast_id = new_id()
+        broadcast_store.create(broadcast_id, time.time(), sender, auth_token, TEXT)
+        broadcast_store.add_recipients(
+            broadcast_id, [(n, f"2557001{n:05d}") for n in range(count)]
+        )
+        return broadcast_id
+
+    return create
+
+
+def test_recipients_wait_in_the_senders_queue(graph_api, broadcast, monkeypatch):
+    monkeypatch.setitem(rate_limiter._buckets, "5001", TokenBucket(rate=100, burst=5))
+    broadcast_id = broadcast("5001", 20)
+
+    assert send_broadcast(broadcast_id) == {"broadcast_id": broadcast_id, "sent": 20, "failed": 0}
+    assert graph_api.stats()["messages"] == 20
+    stats = rate_limiter.stats()["5001"]
+    assert stats["queued"] == 0
+    # Fifteen of them waited for a token, the last about 150ms
+    assert stats["max_wait_seconds"] == pytest.approx(0.15, abs=0.05)
+    assert broadcast_store.get(broadcast_id)["status"] == "completed"
+
+
+def test_each_recipient_gets_an_outcome(graph_api, broadcast):
+    from app.services.outcomes import outcome_store
+
+    broadcast_id = broadcast("5002", 3)
+    assert send_broadcast(broadcast_id)["sent"] == 3
+    outcome = outcome_store.get(f"{broadcast_id}:255700100001")[0]
+    assert outcome["status"] == "200" and outcome["wamid"]
+    assert outcome["phone_number_id"] == "5002" and outcome["attempts"] == 1
+
+    # A 500 may have been delivered, so it is recorded once and not retried
+    graph_api.error_rate = 1.0
+    broadcast_id = broadcast("5002", 2)
+    assert send_broadcast(broadcast_id)["failed"] == 2
+    failures = [
+        outcome for outcome in outcome_store.find(phone_number_id="5002")
+        if outcome["job_id"].startswith(f"{broadcast_id}:")
+    ]
+    assert sorted(outcome["status"] for outcome in failures) == ["500", "500"]
+    assert all(outcome["wamid"] is None and outcome["error"] for outcome in failures)
+
+
+@pytest.mark.parametrize("value, number", [
+    ("+255 700-100 200", 255700100200),
+    ("00255700100200", 255700100200),
+    (255700100200, 255700100200),
+    ("0700100200", None),
+    ("1234567", None),
+    ("2557OO100200", None),
+    (True, None),
+])
+def test_normalize_phone(value, number):
+    assert normalize_phone(value) == number
+
+
+def test_lines_split_across_chunks_stay_whole():
+    # With a byte order mark, which spreadsheet exports often start with
+    body = "phone_number\r\n255700100200\r\n255700100201".encode("utf-8-sig")
+    assert list(_iter_lines(io.BytesIO(body), 1)) == [
+        "phone_number\r\n", "255700100200\r\n", "255700100201",
+    ]
+
+
+def test_upload_then_cancel_closes_the_broadcast(client, message):
+    body = message(phone_number_id="5003")
+    del body["phone_number"]
+    created = client.post("/broadcasts", json=body)
+    assert created.status_code == 201
+    broadcast = created.get_json()
+    upload_url = broadcast["upload_url"]
+
+    csv_body = "name,Phone_Number\nA,255700100200\nB,+255 700 100 200\nC,not a number\n"
+    result = client.post(upload_url, data=csv_body, content_type="text/csv").get_json()
+    counts = [result[key] for key in ("received", "added", "duplicates", "invalid")]
+    assert counts == [3, 1, 1, 1]
+    assert result["invalid_samples"] == [{"line": 4, "value": "not a number"}]
+
+    ndjson_body = '"255700100201"\n{"phone_number": 255700100202}\n\n255700100200\n'
+    result = client.post(
+        upload_url, data=ndjson_body, content_type="application/x-ndjson"
+    ).get_json()
+    assert result["added"] == 2 and result["recipients"] == 3
+
+    assert client.post(upload_url, data="number\n1\n", content_type="text/csv").status_code == 400
+    assert client.delete(f"/scheduled-messages/{broadcast['job_id']}").status_code == 200
+    details = client.get(f"/broadcasts/{broadcast['broadcast_id']}").get_json()
+    assert details["status"] == "cancelled"
+    assert client.post(upload_url, data=csv_body, content_type="text/csv").status_code == 409
+
+
+def test_interrupted_broadcast_resumes_after_the_last_recorded_recipient(graph_api, broadcast):
+    broadcast_id = broadcast("5004", 10)
+    seq = broadcast_store.start(broadcast_id)["seq"]
+    # The process stopped after recording four sends
+    first = next(broadcast_store.iter_recipient_pages(seq))
+    broadcast_store.record_progress(seq, 4, 0, first[3])
+
+    assert broadcast_id in broadcast_store.unfinished()
+    broadcast_store.interrupt(broadcast_id)
+    assert send_broadcast(broadcast_id)["sent"] == 6
+    assert graph_api.stats()["messages"] == 6
+    finished = broadcast_store.get(broadcast_id)
+    assert (finished["status"], finished["sent"], finished["failed"]) == ("completed", 10, 0)
+    # Neither started twice nor resumed again
+    assert send_broadcast(broadcast_id)["sent"] == 0
+    assert broadcast_id not in broadcast_store.unfinished()
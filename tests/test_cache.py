@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from app.services.cache import TTLCache
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache(maxsize=10, ttl=0.05)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return len(loads)
+
+    assert cache.get_or_load("key", loader) == 1
+    assert cache.get_or_load("key", loader) == 1
+    time.sleep(0.06)
+    assert cache.get_or_load("key", loader) == 2
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expirations"]) == (1, 2, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    for key in ("a", "b"):
+        cache.get_or_load(key, lambda: key)
+    cache.get_or_load("a", lambda: "reloaded")
+    cache.get_or_load("c", lambda: "c")
+
+    assert cache.get_or_load("a", lambda: "reloaded") == "a"
+    assert cache.get_or_load("b", lambda: "reloaded") == "reloaded"
+    assert cache.stats()["evictions"] == 2
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache(maxsize=10, ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "value"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_load("key", loader)))
+        for _ in range(5)
+    ]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # The followers are waiting on the leader's load
+    deadline = time.monotonic() + 5
+    while cache.stats()["coalesced"] < 4 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == ["value"] * 5
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_failed_load_is_raised_to_waiters_and_not_cached():
+    cache = TTLCache(maxsize=10, ttl=60)
+
+    def failing():
+        raise RuntimeError("backend down")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_load("key", failing)
+    assert cache.get_or_load("key", lambda: "ok") == "ok"
+
+
+def test_invalidated_load_in_flight_is_not_cached():
+    cache = TTLCache(maxsize=10, ttl=60)
+
+    def loader():
+        cache.invalidate(lambda key: key == "key")
+        return "stale"
+
+    assert cache.get_or_load("key", loader) == "stale"
+    assert cache.get_or_load("key", lambda: "fresh") == "fresh"
@@ -0,0 +1,78 @@
+import pytest
+
+from app.services import circuit_breaker
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return clock
+
+
+def test_opens_at_the_failure_ratio_once_enough_calls_are_in(clock):
+    breaker = CircuitBreaker("1", window=10, min_calls=4, failure_ratio=0.5, open_seconds=15)
+    for ok in (False, True, False):
+        breaker.record(ok)
+    assert breaker.state == CLOSED
+    breaker.record(True)
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.before_send()
+    assert raised.value.retry_after == 15
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker("1", window=1, min_calls=1, open_seconds=10, max_open_seconds=15)
+    breaker.record(False)
+    clock.now += 10
+    breaker.before_send()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_send()
+
+    # A failed probe opens it again for longer, up to max_open_seconds
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == 15
+
+    clock.now += 15
+    breaker.before_send()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    breaker.before_send()
+
+
+def test_retry_after_holds_the_circuit_open(clock):
+    breaker = CircuitBreaker("1")
+    breaker.record(False, retry_after=30)
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == 30
+
+
+def test_retry_budget_is_spent_by_failures_and_earned_back(clock):
+    breaker = CircuitBreaker("1", min_calls=100, retry_tokens=10, retry_ratio=0.5)
+    for _ in range(4):
+        breaker.record(False)
+    assert breaker.allow_retry()
+    breaker.record(False)
+    # Five of ten tokens left: retrying needs more than half
+    assert not breaker.allow_retry()
+    breaker.record(True)
+    assert breaker.allow_retry()
+
+
+def test_no_retries_while_not_closed(clock):
+    breaker = CircuitBreaker("1", window=1, min_calls=1)
+    breaker.record(False)
+    assert not breaker.allow_retry()
@@ -0,0 +1,176 @@
+import pytest
+
+from app.services.credentials import CredentialChangedError, TokenVault
+
+
+@pytest.fixture
+def vault(tmp_path):
+    return TokenVault(str(tmp_path / "credentials.db"))
+
+
+@pytest.fixture
+def api_accepts(monkeypatch):
+    # What the WhatsApp API says of each token the routes verify
+    accepted = {}
+    monkeypatch.setattr(
+        "app.routes.credential_routes.verify_token",
+        lambda phone_number_id, auth_token: accepted.get(auth_token, False),
+    )
+    return accepted
+
+
+def _bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_rotate_replaces_only_the_current_token(vault):
+    assert vault.rotate("1", "first") is None
+    with pytest.raises(CredentialChangedError):
+        vault.rotate("1", "second")
+    with pytest.raises(CredentialChangedError):
+        vault.rotate("1", "second", current="stale")
+    assert vault.rotate("1", "second", current="first") is not None
+    assert vault.get("1") == "second"
+
+
+def test_remove_takes_the_current_token(vault):
+    vault.rotate("1", "first")
+    assert not vault.remove("1", "stale")
+    assert vault.get("1") == "first"
+    assert vault.remove("1", "first")
+    assert vault.get("1") is None
+
+
+def test_jobs_carry_a_reference_not_the_token(vault):
+    reference = vault.reference("1", "first")
+    assert "first" not in reference
+    assert vault.reference("1", "first") == reference
+    assert vault.resolve("1", reference) == "first"
+    # Referencing a token doesn't register it
+    assert vault.get("1") is None
+    # Nor does a vault opened on the same file need this one's cache
+    assert TokenVault(vault.path).resolve("1", reference) == "first"
+
+
+def test_registered_credential_wins_over_references(vault):
+    first = vault.reference("1", "first")
+    second = vault.reference("1", "second")
+
+    vault.adopt("1", "second")
+    assert vault.reference("1", "first") is None
+    assert vault.resolve("1", first) == "second"
+    assert vault.resolve("1", None) == "second"
+    # Jobs scheduled before references existed carry their token
+    assert vault.resolve("1", "inline") == "second"
+
+    vault.rotate("1", "third", current="second")
+    assert vault.resolve("1", second) == "third"
+    # A later token doesn't replace an adopted one
+    vault.adopt("1", "fourth")
+    assert vault.get("1") == "third"
+
+
+def test_registering_drops_the_numbers_referenced_tokens(vault):
+    reference = vault.reference("1", "first")
+    other = vault.reference("2", "first")
+    vault.rotate("1", "second")
+    vault.remove("1", "second")
+    # Jobs of a number whose credential was removed fail until a new one
+    # is registered
+    assert vault.resolve("1", reference) is None
+    assert vault.resolve("2", other) == "first"
+    rows = vault.conn.execute("SELECT phone_number_id FROM referenced_tokens").fetchall()
+    assert rows == [("2",)]
+
+
+def test_rotation_reaches_jobs_scheduled_before_registration(client, message, api_accepts):
+    from app.scheduler.scheduler import scheduler
+    from app.services.credentials import token_vault
+
+    response = client.post(
+        "/schedule-message", json=message(phone_number_id="2010", auth_token="early")
+    )
+    job = scheduler.get_job(response.get_json()["job_id"])
+    assert "early" not in repr(job.args)
+    assert token_vault.resolve("2010", job.args[2]) == "early"
+
+    api_accepts["rotated"] = True
+    assert client.put("/credentials/2010", json={"auth_token": "rotated"}).status_code == 200
+    assert token_vault.resolve("2010", job.args[2]) == "rotated"
+
+
+def test_register_needs_a_token_the_api_accepts(client, api_accepts):
+    response = client.put("/credentials/2001", json={"auth_token": "unknown"})
+    assert response.status_code == 400
+
+    api_accepts["new"] = True
+    response = client.put("/credentials/2001", json={"auth_token": "new"})
+    assert response.status_code == 200
+    assert response.get_json()["message"] == "Credential registered"
+
+
+def test_unreachable_api_is_a_bad_gateway(client, api_accepts):
+    api_accepts["new"] = None
+    response = client.put("/credentials/2002", json={"auth_token": "new"})
+    assert response.status_code == 502
+
+
+def test_rotate_needs_the_current_token(client, api_accepts):
+    api_accepts.update(old=True, new=True)
+    client.put("/credentials/2003", json={"auth_token": "old"})
+
+    response = client.put("/credentials/2003", json={"auth_token": "new"})
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+    response = client.put(
+        "/credentials/2003", json={"auth_token": "new"}, headers=_bearer("wrong")
+    )
+    assert response.status_code == 401
+
+    response = client.put("/credentials/2003", json={"auth_token": "new"}, headers=_bearer("old"))
+    assert response.status_code == 200
+    assert response.get_json()["message"] == "Credential rotated"
+    # The old token no longer authorizes anything
+    response = client.put("/credentials/2003", json={"auth_token": "old"}, headers=_bearer("old"))
+    assert response.status_code == 401
+
+
+def test_rotate_reports_a_concurrent_change(client, api_accepts, monkeypatch):
+    from app.services.credentials import token_vault
+
+    api_accepts.update(old=True, new=True)
+    client.put("/credentials/2004", json={"auth_token": "old"})
+
+    # Another request rotates the credential while this one is verifying
+    def verify(phone_number_id, auth_token):
+        token_vault.rotate(phone_number_id, "other", current="old")
+        return True
+
+    monkeypatch.setattr("app.routes.credential_routes.verify_token", verify)
+    response = client.put("/credentials/2004", json={"auth_token": "new"}, headers=_bearer("old"))
+    assert response.status_code == 409
+    assert token_vault.get("2004") == "other"
+
+
+def test_delete_needs_the_current_token(client, api_accepts):
+    assert client.delete("/credentials/2005").status_code == 404
+
+    api_accepts["old"] = True
+    client.put("/credentials/2005", json={"auth_token": "old"})
+    assert client.delete("/credentials/2005").status_code == 401
+    assert client.delete("/credentials/2005", headers=_bearer("wrong")).status_code == 401
+    assert client.delete("/credentials/2005", headers=_bearer("old")).status_code == 200
+    assert client.delete("/credentials/2005", headers=_bearer("old")).status_code == 404
+
+
+def test_first_successful_send_registers_the_referenced_token(client, message, graph_api):
+    from app.scheduler.jobs import send_scheduled_message
+    from app.scheduler.scheduler import scheduler
+    from app.services.credentials import token_vault
+
+    response = client.post(
+        "/schedule-message", json=message(phone_number_id="2011", auth_token="first-send")
+    )
+    job = scheduler.get_job(response.get_json()["job_id"])
+    assert "messages" in send_scheduled_message(*job.args)
+    assert token_vault.get("2011") == "first-send"
@@ -0,0 +1,159 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from app.scheduler.executors import AsyncioDispatchExecutor, BatchDispatchExecutor
+from app.services.whatsapp_service import send_whatsapp_message_async
+
+TEXT = {"type": "text", "text": {"body": "hello"}}
+
+
+@pytest.fixture
+def run_jobs():
+    # Runs ``func`` (a send by default) with each (executor alias, args) at
+    # once on a scheduler with the given executors; returns {job id: event}
+    # once all have finished
+    schedulers = []
+
+    def run(executors, sends, func=send_whatsapp_message_async):
+        scheduler = BackgroundScheduler(executors=executors, timezone="UTC")
+        schedulers.append(scheduler)
+        events = {}
+        done = threading.Event()
+
+        def listener(event):
+            events[event.job_id] = event
+            if len(events) == len(sends):
+                done.set()
+
+        scheduler.add_listener(listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+        scheduler.start()
+        now = datetime.now(timezone.utc)
+        for index, (alias, args) in enumerate(sends):
+            scheduler.add_job(
+                func, "date", args, id=f"send-{index}",
+                run_date=now + timedelta(milliseconds=50), executor=alias,
+            )
+        assert done.wait(10)
+        return events
+
+    yield run
+    for scheduler in schedulers:
+        scheduler.shutdown()
+
+
+def test_asyncio_lanes_send_on_their_own_loops(graph_api, run_jobs):
+    executors = {
+        "asyncio": AsyncioDispatchExecutor(10),
+        "transactional": AsyncioDispatchExecutor(5),
+    }
+    sends = [
+        (alias, ("25570000000%s" % n, TEXT, "token", f"30{n}"))
+        for n, alias in enumerate(["asyncio", "transactional"] * 2)
+    ]
+    events = run_jobs(executors, sends)
+
+    for event in events.values():
+        assert event.exception is None
+        assert "messages" in event.retval, event.retval
+    assert graph_api.stats()["messages"] == 4
+
+
+def test_asyncio_executor_caps_concurrent_jobs(run_jobs):
+    import asyncio
+
+    running = []
+    peak = [0]
+
+    async def job(n):
+        running.append(n)
+        peak[0] = max(peak[0], len(running))
+        await asyncio.sleep(0.02)
+        running.remove(n)
+        return n
+
+    sends = [("asyncio", (n,)) for n in range(10)]
+    events = run_jobs({"asyncio": AsyncioDispatchExecutor(3)}, sends, job)
+
+    assert sorted(event.retval for event in events.values()) == list(range(10))
+    assert peak[0] == 3
+
+
+def test_asyncio_executor_runs_plain_functions_off_its_loop(run_jobs):
+    def job():
+        return threading.current_thread().name
+
+    events = run_jobs({"asyncio": AsyncioDispatchExecutor(3)}, [("asyncio", ())], job)
+    assert not events["send-0"].retval.startswith("asyncio-dispatch")
+
+
+def test_batches_take_one_rate_limit_acquire_per_sender(graph_api, run_jobs, monkeypatch):
+    from app.services.rate_limiter import rate_limiter
+
+    acquires = []
+    acquire_many = rate_limiter.acquire_many
+
+    def counted(phone_number_id, count):
+        acquires.append((phone_number_id, count))
+        return acquire_many(phone_number_id, count)
+
+    monkeypatch.setattr(rate_limiter, "acquire_many", counted)
+    sends = [
+        ("batch", ("25570000000%s" % n, TEXT, "token", ("3101", "3102")[n % 2]))
+        for n in range(6)
+    ]
+    events = run_jobs({"batch": BatchDispatchExecutor(bucket_ms=100, batch_size=10)}, sends)
+
+    assert all("messages" in event.retval for event in events.values())
+    assert graph_api.stats()["messages"] == 6
+    assert sorted(acquires) == [("3101", 3), ("3102", 3)]
+
+
+def test_a_bucket_is_split_into_even_batches():
+    class Pool:
+        def __init__(self):
+            self.batches = []
+
+        def submit(self, func, batch):
+            self.batches.append(batch)
+
+    executor = BatchDispatchExecutor(bucket_ms=100, batch_size=4)
+    executor._pool = Pool()
+    due = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    later = due + timedelta(seconds=1)
+    pending = [(f"job-{n}", [due]) for n in range(6)] + [("job-later", [later])]
+    executor._dispatch(pending)
+
+    assert [[job for job, _ in batch] for batch in executor._pool.batches] == [
+        ["job-0", "job-1", "job-2"],
+        ["job-3", "job-4", "job-5"],
+        ["job-later"],
+    ]
+    assert executor.in_flight == 7
+
+
+def test_closing_one_loops_session_keeps_the_others():
+    import asyncio
+
+    from app.services.http_client import close_async_session, get_async_session
+
+    async def session():
+        return get_async_session()
+
+    first, second = asyncio.new_event_loop(), asyncio.new_event_loop()
+    try:
+        first_session = first.run_until_complete(session())
+        second_session = second.run_until_complete(session())
+        assert first_session is not second_session
+        assert first.run_until_complete(session()) is first_session
+
+        first.run_until_complete(close_async_session())
+        assert first_session.closed and not second_session.closed
+        assert second.run_until_complete(session()) is second_session
+    finally:
+        second.run_until_complete(close_async_session())
+        first.close()
+        second.close()
@@ -0,0 +1,100 @@
+import json
+import math
+from datetime import datetime, timedelta, timezone
+
+from app.scheduler.job_index import JobIndex
+from app.scheduler.metadata import MessageMeta
+
+
+def _meta(job_id, run_ts, phone_number_id="1001", campaign=None):
+    return MessageMeta(job_id, run_ts, "255700000001", phone_number_id, "text", campaign=campaign)
+
+
+def test_update_many_keeps_order_and_postings():
+    index = JobIndex()
+    index.add(_meta("b", 20.0))
+    index.update_many([_meta("c", 10.0, campaign="x"), _meta("a", 30.0, campaign="x")])
+    # Moving an entry replaces its old position
+    index.update_many([_meta("b", 5.0)], removed=["a"])
+
+    assert [entry.job_id for entry in index.select()] == ["b", "c"]
+    assert [entry.job_id for entry in index.select({"campaign": "x"})] == ["c"]
+    assert "a" not in index
+
+
+def test_paused_jobs_sort_last():
+    index = JobIndex()
+    index.add(_meta("paused", math.inf))
+    index.add(_meta("due", 1.0))
+    assert [entry.job_id for entry in index.select()] == ["due", "paused"]
+
+
+def test_index_follows_add_reschedule_and_cancel(client, message):
+    from app.scheduler.scheduler import job_index
+
+    response = client.post("/schedule-message", json=message())
+    assert response.status_code == 201
+    job_id = response.get_json()["job_id"]
+    assert job_index.get(job_id).phone_number_id == "1001"
+
+    new_time = datetime.now(timezone.utc) + timedelta(hours=3)
+    response = client.patch(
+        f"/scheduled-messages/{job_id}", json={"schedule_time": new_time.isoformat()}
+    )
+    assert response.status_code == 200
+    assert job_index.get(job_id).run_ts == new_time.timestamp()
+
+    assert client.delete(f"/scheduled-messages/{job_id}").status_code == 200
+    assert job_index.get(job_id) is None
+
+
+def test_index_follows_bulk_add_and_cancel(client, message):
+    from app.scheduler.scheduler import job_index
+
+    body = [message(phone_number=f"25570000{n:04d}", campaign="index-bulk") for n in range(5)]
+    response = client.post("/schedule-messages/bulk", json=body)
+    job_ids = [line["job_id"] for line in _ndjson(response) if "job_id" in line]
+    assert len(job_ids) == 5
+    assert job_index.count({"campaign": "index-bulk"}) == 5
+
+    response = client.delete("/scheduled-messages?campaign=index-bulk")
+    assert response.get_json()["cancelled"] == 5
+    assert job_index.count({"campaign": "index-bulk"}) == 0
+    assert not any(job_id in job_index for job_id in job_ids)
+
+
+def _ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_bulk_cancel_reaches_jobs_this_process_has_not_indexed(client, message):
+    # Another API worker's job is in the shared store before this process's
+    # index is refreshed
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from app.config import Config
+    from app.scheduler.jobs import send_scheduled_message
+    from app.scheduler.jobstores import SQLiteJobStore
+    from app.scheduler.scheduler import job_index
+
+    run_date = datetime.now(timezone.utc) + timedelta(hours=2)
+    other = BackgroundScheduler(jobstores={"default": SQLiteJobStore(Config.SCHEDULER_DB_PATH)})
+    other.start(paused=True)
+    other.add_job(
+        send_scheduled_message,
+        "date",
+        run_date=run_date,
+        id="other-worker",
+        args=["255700000001", {"type": "text"}, None, "1003"],
+        kwargs={
+            "job_id": "other-worker",
+            "meta": MessageMeta(
+                "other-worker", run_date.timestamp(), "255700000001", "1003", "text",
+                campaign="index-other",
+            ),
+        },
+    )
+    other.shutdown(wait=False)
+    assert "other-worker" not in job_index
+
+    response = client.delete("/scheduled-messages?campaign=index-other")
+    assert response.get_json()["cancelled"] == 1
@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from app.scheduler.jobs import send_scheduled_message
+from app.scheduler.jobstores import SQLiteJobStore, lane_rank
+from app.scheduler.metadata import MessageMeta
+from app.scheduler.recurrence import Recurrence
+from app.scheduler.sharding import shard_key
+
+
+@pytest.fixture
+def store(tmp_path):
+    # A paused scheduler writes added jobs straight to the store
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    scheduler = BackgroundScheduler(
+        jobstores={"default": store},
+        executors={
+            "default": {"type": "threadpool"},
+            "transactional": {"type": "threadpool"},
+            "bulk": {"type": "threadpool"},
+        },
+    )
+    scheduler.start(paused=True)
+    yield scheduler, store
+    scheduler.shutdown(wait=False)
+
+
+def _add(scheduler, job_id, run_date, phone_number_id="1001", executor="default", **meta_fields):
+    meta = MessageMeta(
+        job_id, run_date.timestamp(), "255700000001", phone_number_id, "text", **meta_fields
+    )
+    scheduler.add_job(
+        send_scheduled_message,
+        "date",
+        run_date=run_date,
+        id=job_id,
+        executor=executor,
+        args=["255700000001", {"type": "text"}, None, phone_number_id],
+        kwargs={"job_id": job_id, "meta": meta},
+    )
+    return meta
+
+
+def _columns(store, job_id):
+    return store._conn.execute(
+        f"SELECT shard_key, lane FROM {store.tablename} WHERE id = ?", (job_id,)
+    ).fetchone()
+
+
+def test_meta_shard_and_lane_round_trip(store):
+    scheduler, store = store
+    run_date = datetime.now(timezone.utc) + timedelta(hours=1)
+    recurrence = Recurrence("interval", 3600, "UTC", run_date.timestamp())
+    meta = _add(
+        scheduler, "job-1", run_date, executor="bulk",
+        campaign="spring", priority="bulk", recurrence=recurrence,
+    )
+
+    job = store.lookup_job("job-1")
+    assert job.kwargs["meta"] == meta
+    assert job.executor == "bulk"
+    assert list(store.iter_metadata()) == [meta]
+    assert _columns(store, "job-1") == (shard_key(meta), lane_rank("bulk"))
+
+
+def test_shard_key_follows_the_shard_by_setting():
+    meta = MessageMeta("job-1", 0.0, "255700000001", "1001")
+    assert shard_key(meta) == shard_key(MessageMeta("job-2", 0.0, None, "1001"))
+    assert shard_key(meta, "job_id") != shard_key(MessageMeta("job-2", 0.0, None, "1001"), "job_id")
+
+
+def test_due_jobs_come_by_lane_then_run_time_within_a_shard(store):
+    scheduler, store = store
+    now = datetime.now(timezone.utc)
+    _add(scheduler, "normal-early", now - timedelta(seconds=30), phone_number_id="1")
+    _add(scheduler, "bulk", now - timedelta(seconds=20), phone_number_id="1", executor="bulk")
+    _add(scheduler, "otp", now - timedelta(seconds=10), phone_number_id="1", executor="transactional")
+    _add(scheduler, "later", now + timedelta(hours=1), phone_number_id="1")
+
+    due = [job.id for job in store.get_due_jobs(now)]
+    assert due == ["otp", "normal-early", "bulk"]
+    assert store.count_due(lane_rank("default"), now.timestamp()) == 1
+
+    # Every job above hashes to one shard; the other one has nothing due
+    owner = shard_key(MessageMeta("x", 0.0, None, "1")) % 2
+    for shard in (0, 1):
+        sharded = SQLiteJobStore(store.path, shard=shard, shards=2)
+        sharded.start(scheduler, f"shard-{shard}")
+        expected = due if shard == owner else []
+        assert [job.id for job in sharded.get_due_jobs(now)] == expected
+        sharded.shutdown()
+
+
+def test_columns_are_added_to_an_older_table(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE apscheduler_jobs (id TEXT NOT NULL PRIMARY KEY, "
+        "next_run_time REAL, job_state BLOB NOT NULL)"
+    )
+    conn.commit()
+    conn.close()
+
+    store = SQLiteJobStore(path)
+    store.start(BackgroundScheduler(), "default")
+    columns = {row[1] for row in store._conn.execute("PRAGMA table_info(apscheduler_jobs)")}
+    store.shutdown()
+    assert {"meta", "shard_key", "lane"} <= columns
+
+
+def test_select_metadata_matches_the_index_filters(store):
+    scheduler, store = store
+    now = datetime.now(timezone.utc)
+    _add(scheduler, "spring-1", now + timedelta(hours=1), campaign="spring")
+    _add(scheduler, "spring-2", now + timedelta(hours=3), phone_number_id="1002", campaign="spring")
+    _add(scheduler, "summer", now + timedelta(hours=2), campaign="summer")
+    scheduler.pause_job("spring-2")
+
+    def ids(*args):
+        return sorted(meta.job_id for meta in store.select_metadata(*args))
+
+    assert ids({"campaign": "spring"}) == ["spring-1", "spring-2"]
+    assert ids({"campaign": "spring", "phone_number_id": "1001"}) == ["spring-1"]
+    # Paused jobs are after every window start and before no window end
+    window_start = (now + timedelta(minutes=90)).timestamp()
+    assert ids({}, window_start) == ["spring-2", "summer"]
+    assert ids({}, None, window_start) == ["spring-1"]
+
+
+def test_transaction_rolls_back_nested_batches(store):
+    scheduler, store = store
+    _add(scheduler, "kept", datetime.now(timezone.utc) + timedelta(hours=1))
+
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            assert store.remove_jobs(["kept"]) == {"kept"}
+            raise RuntimeError
+    assert store.lookup_job("kept") is not None
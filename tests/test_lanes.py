@@ -0,0 +1,76 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from app.config import Config, lane_executors
+
+
+def noop():
+    pass
+
+
+def test_lane_executors_copy_the_dispatch_modes_executor():
+    executors = {
+        "default": {"type": "threadpool", "max_workers": 20},
+        "asyncio": {"class": "AsyncioDispatchExecutor", "max_concurrency": 1000},
+    }
+    budgets = {"transactional": 10, "bulk": 5}
+
+    assert lane_executors(executors, "threadpool", budgets)["bulk"] == {
+        "type": "threadpool", "max_workers": 5,
+    }
+    assert lane_executors(executors, "asyncio", budgets)["transactional"] == {
+        "class": "AsyncioDispatchExecutor", "max_concurrency": 10,
+    }
+    # The base executor is left as it was
+    assert executors["default"]["max_workers"] == 20
+
+
+def test_full_lane_answers_429_and_leaves_the_others_open(client, message, monkeypatch):
+    from app.scheduler.scheduler import admission_rejected, scheduler
+
+    monkeypatch.setitem(Config.LANE_MAX_BACKLOG, "bulk", 0)
+    rejected = admission_rejected.values().get(("bulk",), 0)
+
+    bulk = message(phone_number_id="8001", priority="bulk")
+    response = client.post("/schedule-message", json=bulk)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "5"
+    assert admission_rejected.values()[("bulk",)] == rejected + 1
+
+    body = [bulk, message(phone_number_id="8001", priority="transactional")]
+    response = client.post("/schedule-messages/bulk", json=body)
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0]["retry_after"] == 5
+    # Transactional messages run on their own lane's executor
+    assert scheduler.get_job(lines[1]["job_id"]).executor == "transactional"
+
+    response = client.post("/schedule-message", json=message(phone_number_id="8001"))
+    assert response.status_code == 201
+
+
+def test_api_workers_count_the_lanes_due_jobs_in_the_store(app, monkeypatch):
+    from app.scheduler import scheduler as scheduler_module
+    from app.services.cache import TTLCache
+
+    monkeypatch.setattr(Config, "SCHEDULER_ROLE", "api")
+    monkeypatch.setattr(scheduler_module, "_due_counts", TTLCache(3, 60))
+    monkeypatch.setitem(Config.LANE_MAX_BACKLOG, "transactional", 1)
+    scheduler = scheduler_module.scheduler
+
+    assert scheduler_module.lane_backlog("transactional") == 0
+    soon = datetime.now(timezone.utc) + timedelta(seconds=30)
+    later = datetime.now(timezone.utc) + timedelta(hours=1)
+    for job_id, run_date in (("lane-soon", soon), ("lane-later", later)):
+        scheduler.add_job(
+            id=job_id, func=noop, trigger="date", run_date=run_date, executor="transactional"
+        )
+    try:
+        # Counted once per refresh interval
+        assert scheduler_module.lane_backlog("transactional") == 0
+        monkeypatch.setattr(scheduler_module, "_due_counts", TTLCache(3, 60))
+        assert scheduler_module.lane_backlog("transactional") == 1
+        assert scheduler_module.lane_is_full("transactional")
+        assert not scheduler_module.lane_is_full("bulk")
+    finally:
+        scheduler.remove_job("lane-soon")
+        scheduler.remove_job("lane-later")
@@ -0,0 +1,137 @@
+import io
+import json
+
+import pytest
+
+
+def _ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_idempotency_header_returns_the_existing_job(client, message):
+    headers = {"Idempotency-Key": "order-1"}
+    first = client.post("/schedule-message", json=message(), headers=headers)
+    assert first.status_code == 201
+
+    # A retry, even with a changed body, gets the job the first one created
+    retry = client.post("/schedule-message", json=message(campaign="other"), headers=headers)
+    assert retry.status_code == 200
+    assert retry.get_json()["message"] == "Message already scheduled"
+    assert retry.get_json()["job_id"] == first.get_json()["job_id"]
+
+
+def test_idempotency_field_returns_the_existing_job(client, message):
+    first = client.post("/schedule-message", json=message(idempotency_key="order-2"))
+    retry = client.post("/schedule-message", json=message(idempotency_key="order-2"))
+    assert (first.status_code, retry.status_code) == (201, 200)
+    assert retry.get_json()["job_id"] == first.get_json()["job_id"]
+
+    # Keys are per phone number
+    other = client.post(
+        "/schedule-message", json=message(phone_number_id="1002", idempotency_key="order-2")
+    )
+    assert other.status_code == 201
+    assert other.get_json()["job_id"] != first.get_json()["job_id"]
+
+
+def test_bulk_idempotency_key_reports_a_duplicate(client, message):
+    body = [message(idempotency_key="order-3"), message(idempotency_key="order-3")]
+    lines = _ndjson(client.post("/schedule-messages/bulk", json=body))
+    assert lines[0]["job_id"] == lines[1]["job_id"]
+    assert lines[1]["duplicate"] is True
+
+
+def test_bulk_malformed_item_keeps_the_earlier_ones(client, message):
+    body = "[{}, {}, {{\"phone_number\": }}, {}]".format(
+        json.dumps(message()), json.dumps(message()), json.dumps(message())
+    )
+    response = client.post(
+        "/schedule-messages/bulk", data=body, content_type="application/json"
+    )
+    assert response.status_code == 200
+    lines = _ndjson(response)
+    assert [line["index"] for line in lines[:-1]] == [0, 1, 2]
+    assert "job_id" in lines[0] and "job_id" in lines[1]
+    assert "the rest of the request body was not read" in lines[2]["error"]
+    assert lines[-1] == {"scheduled": 2, "failed": 1}
+
+
+def test_bulk_body_must_be_an_array(client, message):
+    response = client.post("/schedule-messages/bulk", json=message())
+    lines = _ndjson(response)
+    assert lines[0]["index"] == 0
+    assert lines[0]["error"].startswith("Expected a JSON array of messages")
+    assert lines[-1] == {"scheduled": 0, "failed": 1}
+
+
+def test_bulk_unterminated_array(client, message):
+    body = "[" + json.dumps(message())
+    lines = _ndjson(
+        client.post("/schedule-messages/bulk", data=body, content_type="application/json")
+    )
+    assert "job_id" in lines[0]
+    assert lines[1]["error"].startswith("Unexpected end of JSON array")
+    assert lines[-1] == {"scheduled": 1, "failed": 1}
+
+
+def test_bulk_ndjson_bad_lines_fail_alone(client, message):
+    invalid = message()
+    del invalid["phone_number"]
+    body = "\n".join(
+        [json.dumps(message()), "not json", "", json.dumps(invalid), json.dumps(message())]
+    )
+    response = client.post(
+        "/schedule-messages/bulk", data=body, content_type="application/x-ndjson"
+    )
+    lines = _ndjson(response)
+    assert "job_id" in lines[0]
+    assert lines[1]["error"].startswith("Invalid JSON")
+    assert "phone_number" in lines[2]["errors"]
+    assert "job_id" in lines[3]
+    assert lines[-1] == {"scheduled": 2, "failed": 2}
+
+
+# Values whose tails look like complete JSON when cut at the wrong place
+TRICKY_ITEMS = [
+    {"text": "quote \" and ] } [ { inside", "n": 12345, "neg": -1.5e3},
+    "caf\u00e9 \u2603",
+    [1, [2, [3]], {"a": [True, False, None]}],
+    123456789,
+    {"escape": "\\\\", "unicode": "\\u00e9"},
+    None,
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64])
+def test_json_array_items_split_across_chunks(chunk_size):
+    from app.routes.message_routes import _iter_json_array
+
+    body = json.dumps(TRICKY_ITEMS, ensure_ascii=False).encode("utf-8")
+    items = list(_iter_json_array(io.BytesIO(body), chunk_size))
+    assert items == TRICKY_ITEMS
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 64])
+def test_json_array_invalid_item_fails_whatever_the_chunks(chunk_size):
+    from app.routes.message_routes import _iter_json_array
+
+    items = _iter_json_array(io.BytesIO(b'[{"a": 1}, {"b": tru}, {"c": 3}]'), chunk_size)
+    assert next(items) == {"a": 1}
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_scheduler_status_pages_jobs_and_rejects_bad_params(client, message):
+    for _ in range(2):
+        assert client.post("/schedule-message", json=message(phone_number_id="7001")).status_code == 201
+
+    first = client.get("/scheduler-status?limit=1").get_json()
+    assert len(first["jobs"]) == 1 and first["next_cursor"]
+    assert "rate_limits" in first and "circuit_breakers" in first
+    following = client.get(f"/scheduler-status?limit=1&cursor={first['next_cursor']}").get_json()
+    assert following["jobs"][0]["id"] != first["jobs"][0]["id"]
+
+    for query in ("limit=ten", "cursor=!!"):
+        response = client.get(f"/scheduler-status?{query}")
+        assert response.status_code == 400
+        assert response.get_json()["error"].startswith("Invalid query parameter")
@@ -0,0 +1,56 @@
+import gc
+import threading
+
+from app.utils.metrics import Counter, Gauge, Histogram, render
+
+
+def _in_thread(func):
+    thread = threading.Thread(target=func)
+    thread.start()
+    thread.join()
+
+
+def test_counter_keeps_counts_of_finished_threads():
+    counter = Counter("test_sends_total", "Sends", ("status",))
+    counter.inc("200")
+    for _ in range(3):
+        _in_thread(lambda: counter.inc("200", amount=2))
+    _in_thread(lambda: counter.inc("500"))
+    gc.collect()
+
+    assert counter.values() == {("200",): 7, ("500",): 1}
+    assert counter.total() == 8
+    # Finished threads' shards are folded into the retired total
+    assert len(counter._shards) == 1
+
+
+def test_unlabelled_counter_reads_zero_before_its_first_increment():
+    assert Counter("test_unused_total", "Unused").values() == {(): 0}
+
+
+def test_histogram_merges_threads_and_summarises():
+    histogram = Histogram("test_latency_seconds", "Latency", (0.1, 1), ("lane",))
+    histogram.observe(0.05, "otp")
+    _in_thread(lambda: histogram.observe(0.5, "otp"))
+    _in_thread(lambda: histogram.observe(5, "bulk"))
+
+    otp = histogram.snapshot("otp")
+    assert otp["count"] == 2
+    assert otp["buckets"] == {"0.1": 1, "1": 2, "+Inf": 2}
+    assert otp["p50"] == 0.1 and otp["p99"] == 1
+    # Observations past the last bound have no finite quantile
+    assert histogram.snapshot("bulk")["p99"] is None
+    assert histogram.snapshot()["count"] == 3
+
+
+def test_render_exposes_every_kind():
+    Counter("test_rendered_total", "Rendered", ("status",)).inc('say "hi"')
+    Gauge("test_queue_depth", "Depth", ("executor",), lambda: {("default",): 4})
+    Histogram("test_rendered_seconds", "Rendered", (1,)).observe(0.5)
+
+    text = render()
+    assert "# TYPE test_queue_depth gauge" in text
+    assert 'test_queue_depth{executor="default"} 4' in text
+    assert 'test_rendered_total{status="say \\"hi\\""} 1' in text
+    assert 'test_rendered_seconds_bucket{le="+Inf"} 1' in text
+    assert "test_rendered_seconds_sum 0.5" in text
@@ -0,0 +1,44 @@
+from app.services.outcomes import OutcomeStore
+
+
+def _store(tmp_path, **options):
+    # Nothing is written until a lookup or flush() does it
+    return OutcomeStore(str(tmp_path / "outcomes.db"), flush_seconds=60, **options)
+
+
+def test_record_keeps_the_message_id_status_and_timing(tmp_path):
+    store = _store(tmp_path)
+    accepted = {"messages": [{"id": "wamid.1"}]}
+    store.record("job-1", 100.0, "1001", accepted, {"status": 200, "latency": 0.0425, "attempts": 2})
+    store.record("job-1", 200.0, "1001", {"error": {"message": "Invalid token", "code": 190}},
+                 {"status": 401})
+
+    latest, first = store.get("job-1")
+    assert first["wamid"] == "wamid.1" and first["error"] is None
+    assert first["latency_ms"] == 42.5 and first["attempts"] == 2
+    assert latest["status"] == "401" and latest["error"] == "Invalid token"
+    assert store.find(wamid="wamid.1")[0]["run_ts"] == 100.0
+
+
+def test_status_given_by_the_caller_wins_and_errors_are_capped(tmp_path):
+    store = _store(tmp_path)
+    store.record("job-2", None, "1002", {"error": "x" * 1000}, status="deferred")
+    store.record("job-3", None, "1002", None, status="missed")
+
+    outcomes = store.find(phone_number_id="1002")
+    assert {outcome["status"] for outcome in outcomes} == {"deferred", "missed"}
+    assert len(store.get("job-2")[0]["error"]) == 200
+
+
+def test_find_by_window_and_prune_past_retention(tmp_path):
+    store = _store(tmp_path, retention_days=1)
+    store.record("old", None, "1003", None, status="200")
+    store.flush()
+    store.conn.execute("UPDATE outcomes SET finished_ts = finished_ts - 2 * 86400")
+    store.record("new", None, "1003", None, status="200")
+    store.flush()
+
+    recent = store.find(phone_number_id="1003", start_ts=store.get("new")[0]["finished_ts"])
+    assert [outcome["job_id"] for outcome in recent] == ["new"]
+    assert store.prune() == 1
+    assert [outcome["job_id"] for outcome in store.find(phone_number_id="1003")] == ["new"]
@@ -0,0 +1,109 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from app.scheduler.metadata import MessageMeta
+from app.scheduler.recurrence import Recurrence
+from app.services.rate_limiter import RateLimitedError, RateLimiter, TokenBucket, rate_limiter
+
+TEXT = {"type": "text", "text": {"body": "hello"}}
+
+
+def test_refused_sends_get_slots_at_the_bucket_rate():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.try_acquire_many(5) == [0.0, 0.0] + [pytest.approx(n / 10, abs=0.01) for n in (1, 2, 3)]
+    assert bucket.stats()["acquired"] == 2
+    assert bucket.stats()["limited"] == 3
+
+
+def test_take_hands_out_no_slots():
+    bucket = TokenBucket(rate=10, burst=1)
+    assert bucket.take() == 0.0
+    assert bucket.take() == pytest.approx(0.1, abs=0.01)
+    assert bucket.take() == pytest.approx(0.1, abs=0.01)
+    assert bucket.stats()["limited"] == 0
+
+
+def test_acquire_raises_without_a_token():
+    limiter = RateLimiter(1, 1)
+    limiter.acquire("1")
+    with pytest.raises(RateLimitedError) as raised:
+        limiter.acquire("1")
+    assert raised.value.retry_after == pytest.approx(1, abs=0.01)
+
+
+def test_queue_drains_in_order_at_the_senders_rate():
+    limiter = RateLimiter(50, 1, workers=4)
+    sent = []
+
+    def send(n):
+        # The queue took this send's token
+        limiter.acquire("1")
+        sent.append((n, time.monotonic()))
+        return n
+
+    started = time.monotonic()
+    futures = [limiter.submit("1", send, n) for n in range(6)]
+    stats = limiter.stats()["1"]
+    assert 0 < stats["queued"] <= 6
+    assert [future.result(2) for future in futures] == list(range(6))
+
+    # One token up front, then one every 20ms
+    assert time.monotonic() - started == pytest.approx(0.1, abs=0.05)
+    assert sorted(sent, key=lambda item: item[1]) == sorted(sent)
+    stats = limiter.stats()["1"]
+    assert stats["queued"] == 0
+    assert stats["max_wait_seconds"] == pytest.approx(0.1, abs=0.05)
+
+
+def test_queue_reports_its_depth_and_oldest_wait():
+    limiter = RateLimiter(0.001, 1)
+    limiter.acquire("1")
+    limiter.submit("1", lambda: None)
+    limiter.submit("1", lambda: None)
+    time.sleep(0.05)
+    stats = limiter.stats()["1"]
+    assert stats["queued"] == 2
+    assert stats["oldest_wait_seconds"] >= 0.05
+
+
+def test_queued_send_waits_for_its_delay_and_senders_are_independent():
+    limiter = RateLimiter(1000, 1000)
+    started = time.monotonic()
+    held = limiter.submit("1", time.monotonic, delay=0.1)
+    other = limiter.submit("2", time.monotonic)
+    assert other.result(1) - started < 0.05
+    assert held.result(1) - started >= 0.1
+
+
+def test_rate_limited_recurring_message_is_queued_not_slept(graph_api, monkeypatch):
+    # A worker hands the occurrence to the queue and returns at once
+    from app.scheduler import jobs
+
+    monkeypatch.setitem(rate_limiter._buckets, "4001", TokenBucket(rate=2, burst=1))
+    rate_limiter.acquire("4001")
+    start = datetime.now(timezone.utc)
+    meta = MessageMeta(
+        "recurring", start.timestamp(), "255700000001", "4001", "text",
+        recurrence=Recurrence.from_request({"interval": 3600}, start, "UTC"),
+    )
+    monkeypatch.setattr(jobs, "_record_outcome", lambda *args: None)
+    sent = threading.Event()
+    original = jobs.send_whatsapp_message
+
+    def send_whatsapp_message(**kwargs):
+        result = original(**kwargs)
+        sent.set()
+        return result
+
+    monkeypatch.setattr(jobs, "send_whatsapp_message", send_whatsapp_message)
+
+    started = time.monotonic()
+    result = jobs.send_scheduled_message("255700000001", TEXT, "token", "4001", "recurring", meta)
+    assert result == {"queued": True}
+    # Its slot was half a second away
+    assert time.monotonic() - started < 0.4
+    assert sent.wait(3)
+    assert graph_api.stats()["messages"] == 1
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from app.scheduler.recurrence import Recurrence
+
+UTC = pytz.utc
+START = UTC.localize(datetime(2030, 1, 1, 9, 0))
+
+
+def test_count_sets_end_to_the_last_occurrence():
+    recurrence = Recurrence.from_request({"interval": 3600, "count": 3}, START, "UTC")
+    assert recurrence.end_ts == (START + timedelta(hours=2)).timestamp()
+    first = recurrence.next_fire_ts()
+    assert recurrence.occurrences(first, 10) == [
+        (START + timedelta(hours=hours)).timestamp() for hours in range(3)
+    ]
+
+
+def test_cron_count_follows_the_expression():
+    recurrence = Recurrence.from_request({"cron": "0 9 * * 1", "count": 2}, START, "UTC")
+    # 2030-01-01 is a Tuesday: Mondays 7 and 14 January
+    assert recurrence.end_ts == UTC.localize(datetime(2030, 1, 14, 9, 0)).timestamp()
+
+
+@pytest.mark.parametrize(
+    "day_of_week, first_day",
+    [("0", 6), ("7", 6), ("1-5", 1), ("5-7", 4), ("sat,sun", 5), ("*/3", 2)],
+)
+def test_cron_weekdays_count_from_sunday(day_of_week, first_day):
+    # First run on or after Tuesday 1 January 2030
+    recurrence = Recurrence.from_request({"cron": f"0 10 * * {day_of_week}"}, START, "UTC")
+    assert recurrence.next_fire_ts() == UTC.localize(datetime(2030, 1, first_day, 10, 0)).timestamp()
+
+
+def test_earlier_end_date_wins_over_count():
+    end_date = START + timedelta(hours=1, minutes=30)
+    recurrence = Recurrence.from_request(
+        {"interval": 3600, "count": 5, "end_date": end_date.isoformat()}, START, "UTC"
+    )
+    # Two runs fit before the end date; the schedule stops at the second
+    assert recurrence.end_ts == (START + timedelta(hours=1)).timestamp()
+    assert recurrence.next_fire_ts(recurrence.end_ts) is None
+
+
+def test_count_of_one_ends_at_the_first_run():
+    recurrence = Recurrence.from_request({"interval": {"days": 1}, "count": 1}, START, "UTC")
+    assert recurrence.end_ts == START.timestamp()
+    assert recurrence.next_fire_ts(START.timestamp()) is None
+
+
+@pytest.mark.parametrize("count", [0, -1, 1.5, True, "3"])
+def test_invalid_count_is_rejected(count):
+    with pytest.raises(ValueError):
+        Recurrence.from_request({"interval": 3600, "count": count}, START, "UTC")
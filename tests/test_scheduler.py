@@ -0,0 +1,55 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from apscheduler.events import EVENT_JOB_ADDED, EVENT_JOB_REMOVED
+from apscheduler.jobstores.base import ConflictingIdError
+
+
+def noop(*args):
+    pass
+
+
+def _job_def(job_id, run_date):
+    return {
+        "func": noop,
+        "trigger": "date",
+        "run_date": run_date,
+        "id": job_id,
+        "args": ["255700000001", {"type": "text"}, None, "6001"],
+    }
+
+
+def test_add_jobs_announces_indexes_and_wakes_the_scheduler(app):
+    from app.scheduler.scheduler import add_jobs, job_index, scheduler, start_scheduler
+
+    start_scheduler()
+    added, ran = [], threading.Event()
+
+    def listener(event):
+        if event.code == EVENT_JOB_ADDED:
+            added.append(event.job_id)
+        elif event.job_id == "batch-due":
+            # A one-off job leaves the store once it has been run
+            ran.set()
+
+    scheduler.add_listener(listener, EVENT_JOB_ADDED | EVENT_JOB_REMOVED)
+    try:
+        later = datetime.now(timezone.utc) + timedelta(hours=2)
+        add_jobs([_job_def("batch-later", later)])
+        results = add_jobs([
+            _job_def("batch-due", datetime.now(timezone.utc)),
+            _job_def("batch-later", later),
+            _job_def("batch-other", later),
+        ])
+
+        assert isinstance(results[1], ConflictingIdError)
+        assert [job.id for job in (results[0], results[2])] == ["batch-due", "batch-other"]
+        assert added == ["batch-later", "batch-due", "batch-other"]
+        assert job_index.get("batch-other").phone_number_id == "6001"
+        # The scheduler was waiting for a job hours away
+        assert ran.wait(2)
+        assert "batch-due" not in job_index
+    finally:
+        scheduler.remove_listener(listener)
+        scheduler.remove_job("batch-later")
+        scheduler.remove_job("batch-other")
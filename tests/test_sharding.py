@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from app.scheduler.sharding import acquire_shard, start_poller
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "scheduler.db")
+
+
+def test_a_shard_has_one_owner(db_path):
+    handle = acquire_shard(db_path, 0, 2)
+    with pytest.raises(RuntimeError, match="already owned"):
+        acquire_shard(db_path, 0, 2)
+    acquire_shard(db_path, 1, 2).close()
+    handle.close()
+    acquire_shard(db_path, 0, 2).close()
+
+
+def test_shard_counts_must_agree_while_dispatchers_run(db_path):
+    handle = acquire_shard(db_path, 0, 2)
+    with pytest.raises(RuntimeError, match="using 2 shards"):
+        acquire_shard(db_path, 1, 3)
+    handle.close()
+    # A stopped dispatcher's count no longer applies
+    acquire_shard(db_path, 1, 3).close()
+
+    with pytest.raises(ValueError):
+        acquire_shard(db_path, 3, 3)
+
+
+def test_dispatchers_started_together_agree_on_the_layout(tmp_path):
+    # Each round two dispatchers with different shard counts start at once;
+    # at most one of them may get a shard
+    for attempt in range(30):
+        db_path = str(tmp_path / f"scheduler-{attempt}.db")
+        barrier = threading.Barrier(2)
+        handles = []
+
+        def start(shard, shards):
+            barrier.wait()
+            try:
+                handles.append(acquire_shard(db_path, shard, shards))
+            except RuntimeError:
+                pass
+
+        threads = [
+            threading.Thread(target=start, args=args) for args in ((0, 2), (1, 3))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(handles) == 1
+        handles[0].close()
+
+
+def test_poller_keeps_going_after_a_failing_call():
+    calls = []
+    done = threading.Event()
+
+    def callback():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("store locked")
+        done.set()
+
+    stop = start_poller(callback, 0.01, "test-poller")
+    assert done.wait(2)
+    stop.set()
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+import pytest
+import pytz
+
+from app.utils.validators import (
+    ValidationError,
+    localize,
+    resolve_timezone,
+    validate_message,
+    validate_reschedule,
+)
+
+
+@pytest.mark.parametrize("value", [
+    "2026-07-01T12:00:00",
+    # Repeated when the clocks go back, and skipped when they go forward
+    "2026-11-01T01:30:00",
+    "2026-03-08T02:30:00",
+])
+def test_localize_agrees_with_pytz(value):
+    naive = datetime.fromisoformat(value)
+    zone = pytz.timezone("America/New_York")
+    localized = localize(naive, "America/New_York")
+    assert localized.timestamp() == zone.localize(naive).timestamp()
+    assert localized.tzinfo.zone == "America/New_York"
+
+
+def test_every_missing_and_invalid_field_is_reported(message):
+    body = message(schedule_time="tomorrow", timezone="Mars/Base", priority="urgent")
+    del body["auth_token"]
+    with pytest.raises(ValidationError) as error:
+        validate_message(body)
+
+    assert error.value.missing == ["auth_token"]
+    assert set(error.value.errors) == {"auth_token", "schedule_time", "timezone", "priority"}
+    assert str(error.value) == "Missing required fields: auth_token"
+
+
+def test_naive_times_are_local_to_the_requested_timezone(message):
+    body = message(schedule_time="2100-01-01T09:00:00", timezone="Asia/Tokyo")
+    assert validate_message(body).isoformat() == "2100-01-01T09:00:00+09:00"
+
+    with pytest.raises(ValidationError, match="must be in the future"):
+        validate_message(message(schedule_time="2000-01-01T09:00:00"))
+
+
+def test_unknown_timezone_falls_back_to_the_default():
+    assert resolve_timezone("Asia/Tokyo")[0] == "Asia/Tokyo"
+    assert resolve_timezone("Mars/Base")[0] == "Africa/Dar_es_Salaam"
+
+
+def test_reschedule_takes_a_time_or_a_shift():
+    run_date, shift = validate_reschedule({"schedule_time": "2100-01-01T00:00:00Z"})
+    assert run_date.year == 2100 and shift is None
+    assert validate_reschedule({"shift_seconds": 60}, allow_shift=True) == (None, 60)
+
+    with pytest.raises(ValidationError, match="only accepted for bulk moves"):
+        validate_reschedule({"shift_seconds": 60})
+    with pytest.raises(ValidationError, match="exactly one"):
+        validate_reschedule({}, allow_shift=True)
+    with pytest.raises(ValidationError, match="must be a number of seconds"):
+        validate_reschedule({"shift_seconds": True}, allow_shift=True)
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from app.config import Config
+from app.services import whatsapp_service
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError, circuit_breakers
+from app.services.http_client import close_async_session
+
+TEXT = {"type": "text", "text": {"body": "hello"}}
+
+
+def _send_sync(phone_number_id):
+    return whatsapp_service.send_whatsapp_message("255700000001", TEXT, "token", phone_number_id)
+
+
+def _send_async(phone_number_id):
+    async def send():
+        try:
+            return await whatsapp_service.send_whatsapp_message_async(
+                "255700000001", TEXT, "token", phone_number_id
+            )
+        finally:
+            await close_async_session()
+
+    return asyncio.run(send())
+
+
+@pytest.fixture(params=["sync", "async"])
+def send(request, monkeypatch):
+    # Sends through one of the two send loops, with a fresh breaker per
+    # phone number that opens on its first failure and no backoff
+    monkeypatch.setattr(whatsapp_service, "BACKOFF_FACTOR", 0)
+    monkeypatch.setattr(
+        circuit_breakers, "options", dict(circuit_breakers.options, window=1, min_calls=1)
+    )
+    sender = _send_sync if request.param == "sync" else _send_async
+    numbers = iter(range(1000))
+
+    def send(**breaker):
+        phone_number_id = f"{request.param}-{request.node.name}-{next(numbers)}"
+        if breaker:
+            circuit_breakers._breakers[phone_number_id] = CircuitBreaker(
+                phone_number_id, **dict(circuit_breakers.options, **breaker)
+            )
+        return sender(phone_number_id)
+
+    return send
+
+
+def test_success_returns_the_response(graph_api, send):
+    assert "messages" in send()
+    assert graph_api.stats()["counts"] == {"messages_200": 1}
+
+
+def test_error_that_may_have_been_delivered_is_not_retried(graph_api, send):
+    # Even though the failure opens the circuit, the job isn't deferred
+    graph_api.error_rate = 1.0
+    result = send()
+    assert result["error"]["message"] == "Service temporarily unavailable"
+    assert graph_api.stats()["counts"] == {"messages_500": 1}
+
+
+def test_status_the_api_did_not_take_is_retried_then_deferred(graph_api, send):
+    graph_api.error_rate, graph_api.error_status = 1.0, 503
+    # A budget big enough for every retry, and a circuit that only opens
+    # on the last failure
+    with pytest.raises(CircuitOpenError):
+        send(min_calls=Config.SEND_MAX_RETRIES + 1, window=10, retry_tokens=100)
+    assert graph_api.stats()["counts"] == {"messages_503": Config.SEND_MAX_RETRIES + 1}
+
+
+def test_retry_after_defers_without_retrying(graph_api, send):
+    graph_api.throttle_rate, graph_api.retry_after = 1.0, 7
+    with pytest.raises(CircuitOpenError) as raised:
+        send()
+    assert raised.value.retry_after == pytest.approx(7, abs=1)
+    assert graph_api.stats()["counts"] == {"messages_429": 1}
+
+
+def test_read_timeout_is_not_deferred(graph_api, send, monkeypatch):
+    # The API may have delivered the message before the response timed out;
+    # sending it again from a deferred job would be a duplicate
+    graph_api.latency = 0.5
+    monkeypatch.setattr(whatsapp_service, "REQUEST_TIMEOUT", (1, 0.1))
+    monkeypatch.setattr("app.services.http_client.REQUEST_TIMEOUT", (1, 0.1))
+    assert send() == {"error": "Read timeout occurred"}
+
+
+def test_connection_refused_is_retried_then_deferred(send, monkeypatch):
+    # Nothing listens on the discard port: the request never went out
+    monkeypatch.setattr(Config, "WHATSAPP_API_URL", "http://127.0.0.1:9")
+    with pytest.raises(CircuitOpenError):
+        send(min_calls=Config.SEND_MAX_RETRIES + 1, window=10, retry_tokens=100)